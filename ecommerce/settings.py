@@ -24,8 +24,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'shop.middleware.ReplicaMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -37,7 +39,7 @@ ROOT_URLCONF = 'ecommerce.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'shop.instrumentation.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],  # Templates folder
         'APP_DIRS': True,
         'OPTIONS': {
@@ -46,6 +48,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'shop.context_processors.catalog',
             ],
         },
     },
@@ -54,13 +57,70 @@ TEMPLATES = [
 WSGI_APPLICATION = 'ecommerce.wsgi.application'
 
 # Database
+# The interaction log gets its own SQLite file so its frequent inserts never
+# wait on the lock held by cart and checkout writes (see shop.routers)
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    'interactions': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'interactions.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+# Read replicas: SHOP_READ_REPLICAS=N adds aliases replica1..replicaN that
+# serve catalog reads. Locally they are SQLite copies of the primary,
+# refreshed with `manage.py sync_replicas`.
+SHOP_READ_REPLICAS = []
+for _number in range(1, int(os.environ.get('SHOP_READ_REPLICAS', 0)) + 1):
+    DATABASES[f'replica{_number}'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'db.replica{_number}.sqlite3',
+        'TEST': {'MIRROR': 'default'},
     }
+    SHOP_READ_REPLICAS.append(f'replica{_number}')
+# After a session writes, its reads stay on the primary this long (seconds)
+SHOP_REPLICA_STICKY_SECONDS = 5
+# Replicas that sync_replicas does not refresh are trusted with the current
+# catalog version once it is this old (seconds); until then the primary serves it
+SHOP_REPLICA_MAX_LAG_SECONDS = 5
+
+DATABASE_ROUTERS = ['shop.routers.InteractionRouter', 'shop.routers.ReplicaRouter']
+SHOP_INTERACTIONS_DATABASE = 'interactions'
+
+# Applied to every new SQLite connection (shop.db); WAL lets readers run
+# alongside the single writer, and busy_timeout makes writers queue instead
+# of failing immediately with "database is locked"
+SHOP_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,
 }
 
+# Cache (product cards and pages are keyed by the catalog version). The
+# catalog version and replica sync marks live in 'versions', which every
+# process must share: web workers, sync_replicas and the management commands
+# that change the catalog. A file cache covers one host; point it at Redis
+# or Memcached when servers run on several.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'shared_cache',
+    },
+}
+SHOP_VERSION_CACHE = 'versions'
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -83,11 +143,56 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Media files (User uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Threads resizing uploaded product images into per-slot JPEG/WebP copies
+# (shop.images); 0 resizes inline during the request
+SHOP_IMAGE_WORKERS = 2
 
 # Login settings
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 
+# Recommendation engine artifacts (fitted feature pipeline, ...)
+RECOMMENDATION_ARTIFACT_DIR = BASE_DIR / 'artifacts'
+
+# Performance instrumentation
+SHOP_SLOW_REQUEST_MS = 500
+
+# Products per page of the product list, which pages by primary key (shop.pagination.KeysetPage)
+SHOP_PRODUCTS_PER_PAGE = 24
+
+# Metrics: set SHOP_METRICS_DIR when running several worker processes so
+# /metrics aggregates all of them
+SHOP_METRICS_DIR = os.environ.get('SHOP_METRICS_DIR')
+SHOP_METRICS_FLUSH_INTERVAL = 5
+
+# Similar-products index: kept in memory up to this many products and
+# brought up to date with the catalog on a background thread
+SHOP_NEIGHBOUR_INDEX_MAX_PRODUCTS = 20000
+
+# Product popularity (shop.popularity): views, carts and purchases feed
+# counters that halve every SHOP_POPULARITY_HALF_LIFE_HOURS; each process
+# writes its collected events at most every SHOP_POPULARITY_FLUSH_SECONDS to
+# the interactions database, and `manage.py refresh_popularity` turns the
+# counters into popularity_score
+SHOP_POPULARITY_HALF_LIFE_HOURS = 72
+SHOP_POPULARITY_FLUSH_SECONDS = 10
+
+# The recommendation stack (NumPy/SciPy/scikit-learn) is imported by the first
+# request that needs it. Set this for servers that load the app before forking
+# workers (gunicorn --preload), so the workers share the imported modules.
+SHOP_PREWARM_ENGINE = os.environ.get('SHOP_PREWARM_ENGINE') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'shop': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
@@ -1,6 +1,26 @@
 # shop/admin.py
 from django.contrib import admin
-from .models import Category, Product, Cart, CartItem, Order, OrderItem, UserInteraction
+from django.db.models import DecimalField, F, Sum
+
+from .models import Category, Product, Cart, CartItem, Order, OrderItem, UserInteraction, ProductAssociation
+from .pagination import EstimatedCountPaginator, KeysetChangeList
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Change list settings for tables too big to count, facet or page by OFFSET.
+
+    Newest rows first by primary key, keyset pages, estimated totals; the
+    date hierarchy (templates/admin/shop/change_list.html) probes indexed
+    date ranges instead of scanning for distinct dates.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    ordering = ['-pk']
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -11,37 +31,70 @@ class CategoryAdmin(admin.ModelAdmin):
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'price', 'stock', 'popularity_score', 'rating']
     list_filter = ['category', 'created_at']
+    list_select_related = ['category']
     search_fields = ['name', 'description']
     list_editable = ['price', 'stock', 'popularity_score', 'rating']
 
 @admin.register(Cart)
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(LargeTableAdmin):
     list_display = ['user', 'created_at', 'get_total']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    
+    def get_queryset(self, request):
+        # One grouped query for the page instead of an aggregate per cart
+        return super().get_queryset(request).annotate(total=Sum(
+            F('items__quantity') * F('items__product__price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
     
     def get_total(self, obj):
-        return f"₹{obj.get_total()}"
+        return f"₹{obj.total or 0}"
     get_total.short_description = 'Total'
 
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(LargeTableAdmin):
     list_display = ['cart', 'product', 'quantity', 'get_subtotal']
+    list_select_related = ['cart__user', 'product']
+    raw_id_fields = ['cart', 'product']
     
     def get_subtotal(self, obj):
         return f"₹{obj.get_subtotal()}"
     get_subtotal.short_description = 'Subtotal'
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['id', 'user', 'created_at', 'total_amount', 'status']
-    list_filter = ['status', 'created_at']
-    search_fields = ['user__username']
+    list_filter = ['status']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    date_hierarchy = 'created_at'
+    date_hierarchy_follows_pk = True  # auto_now_add
+    # Exact matches use the unique username and primary key indexes
+    search_fields = ['=user__username', '=id']
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdmin):
     list_display = ['order', 'product', 'quantity', 'price']
+    list_select_related = ['order__user', 'product']
+    raw_id_fields = ['order', 'product']
 
 @admin.register(UserInteraction)
-class UserInteractionAdmin(admin.ModelAdmin):
+class UserInteractionAdmin(LargeTableAdmin):
     list_display = ['user', 'product', 'interaction_type', 'timestamp']
-    list_filter = ['interaction_type', 'timestamp']
-    search_fields = ['user__username', 'product__name']
\ No newline at end of file
+    list_filter = ['interaction_type']
+    date_hierarchy = 'timestamp'
+    date_hierarchy_follows_pk = True  # auto_now_add
+    # Users and products are in another database, so no joins or search across
+    # them; each page fetches its users and products with one IN query apiece
+    list_select_related = ()  # not False, which would join every foreign key
+    raw_id_fields = ['user', 'product']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('user', 'product')
+
+@admin.register(ProductAssociation)
+class ProductAssociationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'rank', 'associated', 'confidence', 'lift', 'support']
+    list_select_related = ['product', 'associated']
+    raw_id_fields = ['product', 'associated']
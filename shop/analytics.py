@@ -0,0 +1,182 @@
+# shop/analytics.py
+"""Daily sales rollups, reports read from them, and the order export.
+
+Reports never aggregate Order/OrderItem: update_rollups() adds the orders
+placed since its high-water mark to per-day product and category tables,
+a chunk of orders per short transaction, and the staff report only reads
+those. The CSV export walks the orders by primary key, one short query
+per chunk, so neither memory nor an open read depends on the period.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyCategorySales, DailyProductSales, Order, OrderItem, RollupState
+
+ROLLUP = 'daily_sales'
+CHUNK_SIZE = 5000  # orders per rollup transaction or export query
+# Orders younger than this are left for the next run: ids are handed out
+# before commit, so a higher id can become visible before a lower one
+LAG_SECONDS = 60
+EXPORT_FIELDS = ['order_id', 'created_at', 'customer', 'status', 'order_total',
+                 'product_id', 'product', 'quantity', 'unit_price', 'line_total']
+# Spreadsheets evaluate a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def spreadsheet_text(value):
+    """A user-supplied string that a spreadsheet opening the export shows as text"""
+    return "'" + value if value.startswith(FORMULA_PREFIXES) else value
+
+
+def aggregate_orders(first, last):
+    """{rollup model: rows} for the orders with first <= id <= last.
+
+    An order falls in exactly one range, so the distinct order counts of
+    successive ranges add up.
+    """
+    items = (OrderItem.objects.filter(order_id__gte=first, order_id__lte=last).order_by()
+             .annotate(day=TruncDate('order__created_at')))
+    totals = {
+        'orders': Count('order_id', distinct=True),
+        'units': Sum('quantity'),
+        'revenue': Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+    }
+    return {
+        DailyProductSales: items.values('day', key=F('product_id')).annotate(**totals),
+        DailyCategorySales: items.values('day', key=F('product__category_id')).annotate(**totals),
+    }
+
+
+def merge(model, rows):
+    """Add aggregated rows to a rollup table, creating the (date, key) rows not there yet"""
+    rows = list(rows)
+    if not rows:
+        return
+    key = 'product' if model is DailyProductSales else 'category'
+    existing = {
+        (row.date, getattr(row, f'{key}_id')): row
+        for row in model.objects.filter(date__in={row['day'] for row in rows})
+    }
+    merged = []
+    for row in rows:
+        current = existing.get((row['day'], row['key']))
+        merged.append(model(
+            date=row['day'], orders=row['orders'], units=row['units'], revenue=row['revenue'],
+            **{f'{key}_id': row['key']},
+        ))
+        if current is not None:
+            merged[-1].orders += current.orders
+            merged[-1].units += current.units
+            merged[-1].revenue += current.revenue
+    model.objects.bulk_create(merged, update_conflicts=True, unique_fields=['date', key],
+                              update_fields=['orders', 'units', 'revenue'], batch_size=500)
+
+
+def update_rollups(chunk_size=CHUNK_SIZE, lag=LAG_SECONDS, now=None):
+    """Add the orders placed since the high-water mark to the daily rollups.
+
+    Each chunk of orders is merged and the mark advanced in one
+    transaction, so an interrupted run resumes where it stopped and
+    nothing is counted twice. Returns the number of orders counted.
+    """
+    now = timezone.now() if now is None else now
+    cutoff = now - datetime.timedelta(seconds=lag)
+    # Orders are created with auto_now_add, so created_at follows the id
+    ready = (Order.objects.filter(created_at__lte=cutoff).order_by('-created_at', '-id')
+             .values_list('id', flat=True).first())
+    RollupState.objects.get_or_create(name=ROLLUP)
+    state = RollupState.objects.filter(name=ROLLUP)
+    counted = 0
+    while True:
+        with transaction.atomic():
+            # Writing first takes the write lock, so a concurrent run waits
+            # for this chunk and then reads the advanced mark
+            state.update(updated_at=now)
+            mark = state.values_list('last_order_id', flat=True).get()
+            if ready is None or mark >= ready:
+                return counted
+            last = min(mark + chunk_size, ready)
+            for model, rows in aggregate_orders(mark + 1, last).items():
+                merge(model, rows)
+            counted += Order.objects.filter(id__gt=mark, id__lte=last).count()
+            state.update(last_order_id=last)
+
+
+def reset_rollups():
+    """Empty the rollups so the next update_rollups() recounts every order"""
+    with transaction.atomic():
+        DailyProductSales.objects.all().delete()
+        DailyCategorySales.objects.all().delete()
+        RollupState.objects.filter(name=ROLLUP).update(last_order_id=0, updated_at=None)
+
+
+def sales_report(start, end, top=20):
+    """Sales between two dates (inclusive), read from the rollups only"""
+    categories = DailyCategorySales.objects.filter(date__range=(start, end)).order_by()
+    products = DailyProductSales.objects.filter(date__range=(start, end)).order_by()
+    # An order spanning categories is in several category rows, so days and
+    # the period only total units and revenue
+    days = list(categories.values('date').annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('date'))
+    totals = {
+        'units': sum(day['units'] for day in days),
+        'revenue': sum((day['revenue'] for day in days), Decimal('0.00')),
+    }
+    sums = {'orders': Sum('orders'), 'units': Sum('units'), 'revenue': Sum('revenue')}
+    return {
+        'days': days,
+        'totals': totals,
+        'categories': list(categories.values('category_id', name=F('category__name'))
+                           .annotate(**sums).order_by('-revenue', 'category_id')),
+        'products': list(products.values('product_id', name=F('product__name'))
+                         .annotate(**sums).order_by('-revenue', 'product_id')[:top]),
+        'state': RollupState.objects.filter(name=ROLLUP).first(),
+    }
+
+
+def day_bounds(start=None, end=None):
+    """Aware datetimes [start of `start`, end of `end`) in the current time zone; None leaves a side open"""
+    def midnight(day):
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time()))
+
+    return (midnight(start) if start else None,
+            midnight(end + datetime.timedelta(days=1)) if end else None)
+
+
+def export_rows(start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Yield one tuple (EXPORT_FIELDS) per order line placed between two dates (inclusive), by order id.
+
+    The period becomes an order id range up front and every chunk is its
+    own `id > last ORDER BY id LIMIT n` query plus one for its lines, so
+    no cursor or transaction stays open while the client downloads.
+    """
+    since, until = day_bounds(start, end)
+    orders = Order.objects.order_by().values_list('id', flat=True)
+    first = orders.filter(created_at__gte=since) if since else orders
+    last = orders.filter(created_at__lt=until) if until else orders
+    first = first.order_by('created_at', 'id').first()
+    last = last.order_by('-created_at', '-id').first()
+    if first is None or last is None:
+        return
+    after = first - 1
+    while after < last:
+        chunk = list(
+            Order.objects.filter(id__gt=after, id__lte=last).order_by('id')
+            .values_list('id', 'created_at', 'user__username', 'status', 'total_amount')[:chunk_size]
+        )
+        if not chunk:
+            return
+        lines = {}
+        for order_id, *line in (OrderItem.objects.filter(order_id__gte=chunk[0][0], order_id__lte=chunk[-1][0])
+                                .order_by('order_id', 'id')
+                                .values_list('order_id', 'product_id', 'product__name', 'quantity', 'price')):
+            lines.setdefault(order_id, []).append(line)
+        for order_id, created_at, customer, status, total in chunk:
+            for product_id, name, quantity, price in lines.get(order_id, ()):
+                yield (order_id, created_at.isoformat(), spreadsheet_text(customer), status, total,
+                       product_id, spreadsheet_text(name), quantity, price, price * quantity)
+        after = chunk[-1][0]
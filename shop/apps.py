@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from . import db, signals  # noqa: F401
+
+        if getattr(settings, 'SHOP_PREWARM_ENGINE', False):
+            from .engine import prewarm
+
+            prewarm()
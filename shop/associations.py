@@ -0,0 +1,128 @@
+# shop/associations.py
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from django.db import connections, transaction
+from django.db.models import Max
+
+from .models import Order, OrderItem, Product, ProductAssociation
+
+
+def order_chunks(chunk_size):
+    """Yield (order codes, product ids) for consecutive ranges of `chunk_size` order ids"""
+    last_order = Order.objects.aggregate(last=Max('id'))['last'] or 0
+    for start in range(1, last_order + 1, chunk_size):
+        rows = list(
+            OrderItem.objects.filter(order_id__gte=start, order_id__lt=start + chunk_size)
+            .values_list('order_id', 'product_id')
+        )
+        if rows:
+            pairs = np.array(rows, dtype=np.int64)
+            yield pairs[:, 0] - start, pairs[:, 1]
+
+
+def count_chunk(order_codes, product_ids, columns):
+    """Co-occurrence counts of one chunk: B.T @ B for the binary order x product matrix.
+
+    The diagonal holds the number of orders containing each product.
+    """
+    baskets = sp.csr_matrix(
+        (np.ones(len(order_codes), dtype=np.int32), (order_codes, product_ids)),
+        shape=(int(order_codes.max()) + 1, columns),
+    )
+    baskets.data[:] = 1  # a product bought twice in one order counts once
+    return (baskets.T @ baskets).tocsr(), int(np.count_nonzero(np.diff(baskets.indptr)))
+
+
+def count_cooccurrences(chunk_size=10000, workers=1):
+    """Merged co-occurrence matrix and number of non-empty orders over all orders"""
+    columns = (Product.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+    total = sp.csr_matrix((columns, columns), dtype=np.int64)
+    orders = 0
+    if workers <= 1:
+        for codes, products in order_chunks(chunk_size):
+            counts, chunk_orders = count_chunk(codes, products, columns)
+            total = total + counts
+            orders += chunk_orders
+        return total, orders
+
+    # The parent streams chunks from the database and merges partial counts;
+    # children only do the sparse algebra. At most 2 chunks per worker are in flight.
+    # Forked, like the other pools: Python 3.14 makes forkserver the default on
+    # Linux, whose children would have to import and set up Django again.
+    connections.close_all()  # children must not inherit open connections
+    pending = deque()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    with pool:
+        for codes, products in order_chunks(chunk_size):
+            pending.append(pool.submit(count_chunk, codes, products, columns))
+            while len(pending) >= 2 * workers or (pending and pending[0].done()):
+                counts, chunk_orders = pending.popleft().result()
+                total = total + counts
+                orders += chunk_orders
+        for future in pending:
+            counts, chunk_orders = future.result()
+            total = total + counts
+            orders += chunk_orders
+    return total, orders
+
+
+def rank_associations(counts, orders, min_support=0.001, min_lift=1.0, top_k=10):
+    """(product, associated, rank, support, confidence, lift) arrays, best `top_k` per product.
+
+    Pairs are ranked by confidence (share of the product's orders that also
+    contain the associated product); the lift threshold drops pairs that
+    only co-occur because the associated product is popular everywhere.
+    """
+    frequency = counts.diagonal().astype(np.float64)
+    pairs = counts.tocoo()
+    off_diagonal = pairs.row != pairs.col
+    product, associated = pairs.row[off_diagonal], pairs.col[off_diagonal]
+    together = pairs.data[off_diagonal].astype(np.float64)
+
+    support = together / max(orders, 1)
+    confidence = together / frequency[product]
+    lift = confidence * orders / frequency[associated]
+    keep = (support >= min_support) & (lift >= min_lift)
+    product, associated = product[keep], associated[keep]
+    support, confidence, lift = support[keep], confidence[keep], lift[keep]
+
+    order = np.lexsort((-lift, -confidence, product))
+    product, associated = product[order], associated[order]
+    support, confidence, lift = support[order], confidence[order], lift[order]
+    first = np.searchsorted(product, product)  # start of each product's run
+    rank = np.arange(len(product)) - first
+    top = rank < top_k
+    return (product[top], associated[top], rank[top], support[top], confidence[top], lift[top])
+
+
+@transaction.atomic
+def store_associations(ranked, batch_size=5000):
+    """Replace the stored associations with `ranked` in one transaction"""
+    ProductAssociation.objects.all().delete()
+    rows = [
+        ProductAssociation(product_id=int(p), associated_id=int(a), rank=int(r),
+                           support=float(s), confidence=float(c), lift=float(l))
+        for p, a, r, s, c, l in zip(*ranked)
+    ]
+    ProductAssociation.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def bought_together(product_ids, exclude=(), limit=4):
+    """Products most often bought with any of `product_ids`, in a single indexed query"""
+    associations = (
+        ProductAssociation.objects.filter(product_id__in=product_ids)
+        .exclude(associated_id__in=list(product_ids) + list(exclude))
+        .select_related('associated')
+        .order_by('-confidence', '-lift')[:limit * max(len(product_ids), 1)]
+    )
+    products = {}
+    for association in associations:
+        products.setdefault(association.associated_id, association.associated)
+        if len(products) >= limit:
+            break
+    return list(products.values())
@@ -0,0 +1,197 @@
+# shop/benchmarks.py
+import contextlib
+import json
+import platform
+import statistics
+import tempfile
+import time
+from io import StringIO
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from sklearn.metrics.pairwise import cosine_similarity
+
+from . import feature_pipeline, neighbours
+from .models import Product, UserInteraction
+from .recommendation import RecommendationEngine
+from .routers import interactions_database
+
+try:
+    from .similarity_calc import cosine_similarity_optimized
+except ImportError:  # Cython extension not built
+    cosine_similarity_optimized = None
+
+HISTORY_LENGTHS = [1, 10, 100]
+# Products edited between two catalog versions, for the incremental pipeline refresh
+CHANGED_PRODUCTS = [1, 100]
+
+
+class Rollback(Exception):
+    """Raised to discard the synthetic catalog created for a benchmark run"""
+
+
+def measure(func, repeat):
+    """Run func `repeat` times and return timing statistics in seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'runs': repeat,
+    }
+
+
+def benchmark_catalog(size, repeat, seed):
+    """Benchmark the engine against a synthetic catalog of `size` products"""
+    results = []
+
+    def record(name, func, **params):
+        stats = measure(func, repeat)
+        results.append({'name': name, 'size': size, 'params': params, **stats})
+
+    engine = RecommendationEngine()
+    rng = np.random.default_rng(seed)
+    product_ids = list(Product.objects.values_list('id', flat=True))
+
+    ids, raw, categories = feature_pipeline.read_catalog_rows()
+    record('feature_pipeline.fit', lambda: feature_pipeline.FeaturePipeline.fit(ids, raw, categories))
+    pipeline = feature_pipeline.get_pipeline()  # fitted on this catalog: isolated() publishes none
+    for count in CHANGED_PRODUCTS:
+        rows = np.sort(rng.choice(len(ids), size=min(count, len(ids)), replace=False))
+        record('feature_pipeline.refreshed',
+               lambda: pipeline.refreshed(ids, ids[rows], raw[rows], categories[rows]), changed=count)
+
+    record('get_similar_products.similarity_blocks', lambda: sum(
+        1 for _ in pipeline.similarity_blocks(np.arange(min(size, 1024)))))
+    if size <= neighbours.max_indexed_products():
+        record('neighbour_index.build', lambda: neighbours.NeighbourIndex.build(pipeline))
+        index = neighbours.NeighbourIndex.build(pipeline)
+        edited = [int(rng.choice(product_ids))]
+        record('neighbour_index.apply', lambda: index.apply(pipeline, edited, []))
+
+    cold_user = User.objects.create(username=f'bench_cold_{size}')
+    record('get_recommendations', lambda: list(engine.get_recommendations(cold_user)), history=0)
+
+    for length in HISTORY_LENGTHS:
+        warm_user = User.objects.create(username=f'bench_warm_{size}_{length}')
+        UserInteraction.objects.bulk_create([
+            UserInteraction(user=warm_user, product_id=int(pid), interaction_type='view')
+            for pid in rng.choice(product_ids, size=length)
+        ])
+        record('get_recommendations', lambda: list(engine.get_recommendations(warm_user)),
+               history=length)
+
+    # The neighbour index is built in the background; time each path on its own
+    target = int(rng.choice(product_ids))
+    if neighbours.get_index(wait=True) is not None:
+        record('get_similar_products', lambda: list(engine.get_similar_products(target)), path='index')
+    with override_settings(SHOP_NEIGHBOUR_INDEX_MAX_PRODUCTS=0):
+        record('get_similar_products', lambda: list(engine.get_similar_products(target)), path='scan')
+
+    # Dense kernels are compared on the numeric block of the feature pipeline
+    features = np.ascontiguousarray(pipeline.numeric)
+    query = np.ascontiguousarray(features[:1])
+    record('cosine_similarity.sklearn', lambda: cosine_similarity(query, features))
+    if cosine_similarity_optimized is not None:
+        record('cosine_similarity.cython', lambda: cosine_similarity_optimized(query, features))
+
+    return results
+
+
+@contextlib.contextmanager
+def isolated():
+    """Run against empty throwaway databases instead of the shop's.
+
+    The engine then sees only the synthetic catalog, never loads a
+    published pipeline (the artifact directory is a temporary one), and
+    the catalog version bumps stay in this process instead of
+    invalidating the servers' caches.
+    """
+    aliases = {DEFAULT_DB_ALIAS} | ({interactions_database()} - {None})
+    with tempfile.TemporaryDirectory() as directory, \
+            override_settings(RECOMMENDATION_ARTIFACT_DIR=directory, SHOP_VERSION_CACHE='default'):
+        old_config = setup_databases(verbosity=0, interactive=False, aliases=aliases, serialized_aliases=set())
+        try:
+            yield
+        finally:
+            feature_pipeline.reset()
+            neighbours.reset()
+            teardown_databases(old_config, verbosity=0)
+
+
+def run_suite(sizes, repeat=5, seed=42, stdout=None):
+    """Run every benchmark for each catalog size in isolated databases"""
+    results = []
+    with isolated():
+        for size in sizes:
+            if stdout:
+                stdout.write(f'Benchmarking catalog of {size} products...')
+            try:
+                # Interactions may live in their own database; roll both back
+                with transaction.atomic(), transaction.atomic(using=router.db_for_write(UserInteraction)):
+                    call_command(
+                        'generate_dataset', seed=seed, categories=20, products=size,
+                        users=0, interactions=0, prefix=f'bench{size}',
+                        stdout=StringIO(),
+                    )
+                    results.extend(benchmark_catalog(size, repeat, seed))
+                    raise Rollback
+            except Rollback:
+                pass
+            # The rolled-back catalog must not linger in the process-wide pipeline
+            feature_pipeline.reset()
+            neighbours.reset()
+
+    return {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cython': cosine_similarity_optimized is not None,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def result_key(result):
+    params = ','.join(f'{k}={v}' for k, v in sorted(result['params'].items()))
+    return f"{result['name']}[size={result['size']}{',' + params if params else ''}]"
+
+
+def compare(current, baseline, threshold=0.10):
+    """Compare median timings; return a list of regressions beyond `threshold` (fractional)"""
+    baseline_by_key = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        key = result_key(result)
+        previous = baseline_by_key.get(key)
+        if previous is None or previous['median'] <= 0:
+            continue
+        change = result['median'] / previous['median'] - 1
+        if change > threshold:
+            regressions.append({
+                'benchmark': key,
+                'baseline': previous['median'],
+                'current': result['median'],
+                'change': change,
+            })
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,101 @@
+# shop/cache.py
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache, caches
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from . import metrics
+
+CATALOG_VERSION_KEY = 'shop:catalog_version'
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+PAGE_CACHE_TIMEOUT = 60 * 15
+
+
+def version_cache():
+    """Cache holding the catalog version, shared by every process (SHOP_VERSION_CACHE)"""
+    alias = getattr(settings, 'SHOP_VERSION_CACHE', 'versions')
+    return caches[alias if alias in settings.CACHES else 'default']
+
+
+def get_catalog_version():
+    """Current catalog version (millisecond timestamp of the last catalog change)"""
+    versions = version_cache()
+    version = versions.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        # Another process may have set it first; keep whichever won
+        versions.add(CATALOG_VERSION_KEY, version, timeout=None)
+        version = versions.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every catalog-derived cache entry, in every process, by moving to a new version"""
+    version = max(int(time.time() * 1000), get_catalog_version() + 1)
+    version_cache().set(CATALOG_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def product_card_key(product_id, variant, version=None):
+    if version is None:
+        version = get_catalog_version()
+    return f'shop:card:{version}:{variant}:{product_id}'
+
+
+def cart_recommendations_key(quantities, count, version=None):
+    """Key for recommendations computed from cart contents ({product_id: quantity})"""
+    if version is None:
+        version = get_catalog_version()
+    contents = ','.join(f'{pid}x{qty}' for pid, qty in sorted(quantities.items()))
+    cart_hash = hashlib.md5(contents.encode()).hexdigest()
+    return f'shop:cartrec:{version}:{count}:{cart_hash}'
+
+
+def _page_key(request, version):
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'shop:page:{version}:{path_hash}'
+
+
+def cache_anonymous_page(view_func):
+    """Serve anonymous GET requests from a cache keyed by URL and catalog version.
+
+    Responses carry an ETag and Last-Modified derived from the catalog
+    version, so repeat visitors get a 304 until the catalog changes.
+    Logged-in users and requests with pending flash messages always
+    hit the view.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD')
+                or request.user.is_authenticated
+                or len(messages.get_messages(request))):
+            return view_func(request, *args, **kwargs)
+
+        version = get_catalog_version()
+        key = _page_key(request, version)
+        etag = quote_etag(key.rsplit(':', 1)[-1] + f'-{version}')
+        last_modified = version // 1000
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            metrics.cache_requests.inc(cache='page', result='not_modified')
+            return not_modified
+
+        response = cache.get(key)
+        metrics.cache_requests.inc(cache='page', result='miss' if response is None else 'hit')
+        if response is None:
+            response = view_func(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(key, response, PAGE_CACHE_TIMEOUT)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+    return wrapper
@@ -0,0 +1,283 @@
+# shop/catalog_io.py
+import contextlib
+import csv
+import gzip
+import json
+import math
+import sys
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Coalesce, Concat
+
+from . import feature_pipeline, neighbours
+from .cache import bump_catalog_version
+from .models import Category, Product
+
+# Columns of an exported catalog, and of an import file (header row / JSON keys)
+FIELDS = ['sku', 'name', 'description', 'category', 'price', 'stock', 'popularity_score', 'rating']
+# Product columns every import row sets
+REQUIRED_FIELDS = ['name', 'category', 'price']
+# Columns a row may leave out (or leave empty): existing products keep their
+# value and new ones get the model default
+OPTIONAL_FIELDS = ['description', 'stock', 'popularity_score', 'rating']
+# Prefix of the SKUs exported for products that have none (see export_rows)
+GENERATED_SKU_PREFIX = 'SHOP-'
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+MAX_PRICE = Decimal('99999999.99')  # max_digits=10, decimal_places=2
+CHUNK_SIZE = 5000
+
+
+class RowError(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def detect_format(path, format=None):
+    """'csv' or 'jsonl', from an explicit format or the file extension (.gz allowed)"""
+    if format:
+        return format
+    name = path[:-3] if path.endswith('.gz') else path
+    for extension, detected in FORMATS.items():
+        if name.endswith(extension):
+            return detected
+    raise ValueError(f'Cannot tell the format of {path}; pass --format csv or jsonl')
+
+
+def open_text(path, mode):
+    """Text stream for a path, a gzipped path, or '-' for stdin/stdout"""
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    opener = gzip.open if path.endswith('.gz') else open
+    return opener(path, mode + 't', newline='', encoding='utf-8')
+
+
+def read_rows(stream, format):
+    """Yield (line number, raw row dict) without reading the whole file.
+
+    A JSON line that is not an object yields None as its row, so the
+    error is reported with the others instead of aborting the import.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            row = None
+        yield line, row if isinstance(row, dict) else None
+
+
+def clean_row(line, raw):
+    """Validated product values from a raw row, or RowError.
+
+    Optional columns that are missing or empty are left out of the result,
+    so the import does not overwrite them.
+    """
+    if raw is None:
+        raise RowError(line, 'not a JSON object')
+
+    def present(name):
+        value = raw.get(name)
+        return value is not None and str(value).strip() != ''
+
+    def text(name, max_length=None):
+        if not present(name):
+            raise RowError(line, f'{name} is required')
+        value = str(raw[name]).strip()
+        if max_length and len(value) > max_length:
+            raise RowError(line, f'{name} is longer than {max_length} characters')
+        return value
+
+    def number(name, parse, low, high):
+        if not present(name):
+            raise RowError(line, f'{name} is required')
+        try:
+            value = parse(raw[name])
+        except (TypeError, ValueError, ArithmeticError):
+            raise RowError(line, f'{name} is not a number: {raw[name]!r}')
+        if not low <= value <= high:
+            raise RowError(line, f'{name} must be between {low} and {high}')
+        return value
+
+    def decimal(value):
+        value = Decimal(str(value)).quantize(Decimal('0.01'))
+        if not value.is_finite():
+            raise ValueError
+        return value
+
+    def real(value):
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError
+        return value
+
+    row = {
+        'sku': text('sku', max_length=64),
+        'name': text('name', max_length=200),
+        'category': text('category', max_length=200),
+        'price': number('price', decimal, Decimal(0), MAX_PRICE),
+    }
+    optional = {
+        'description': lambda name: str(raw[name]).strip(),
+        'stock': lambda name: number(name, int, 0, 2 ** 31 - 1),
+        'popularity_score': lambda name: number(name, real, 0.0, 1.0),
+        'rating': lambda name: number(name, real, 0.0, 5.0),
+    }
+    for name in OPTIONAL_FIELDS:
+        if present(name):
+            row[name] = optional[name](name)
+    return row
+
+
+class CatalogImport:
+    """Upserts validated rows by SKU, `chunk_size` rows per transaction.
+
+    Categories are resolved by name through a map loaded once; names not
+    seen before are created in bulk with the chunk that introduces them.
+    Rows with the same columns share one INSERT ... ON CONFLICT (sku) DO
+    UPDATE of just those columns, so no per-row queries or model signals
+    run: call rebuild_artifacts() once the whole feed is in. An existing
+    product's popularity_score is only overwritten with
+    `update_popularity`, since shop.popularity maintains it from traffic.
+    A SHOP-<id> row first gives product <id> that SKU if it has none, so
+    exports of products without a SKU import back onto them.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, dry_run=False, progress=None, update_popularity=False):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.progress = progress
+        self.update_popularity = update_popularity
+        self.categories = dict(Category.objects.order_by('-id').values_list('name', 'id'))
+        self.pending = {}
+        self.rows = 0
+        self.imported = 0
+        self.categories_created = 0
+        self.errors = []
+
+    def add(self, line, raw):
+        self.rows += 1
+        try:
+            row = clean_row(line, raw)
+        except RowError as exc:
+            self.errors.append(exc)
+            return
+        self.pending[row['sku']] = row  # a SKU repeated within the chunk: the last row wins
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        rows = list(self.pending.values())
+        self.pending.clear()
+        if not rows:
+            return
+        if not self.dry_run:
+            self.write(rows)
+        self.imported += len(rows)
+        if self.progress:
+            self.progress(self)
+
+    def write(self, rows):
+        shapes = {}
+        for row in rows:
+            shapes.setdefault(tuple(name for name in OPTIONAL_FIELDS if name in row), []).append(row)
+        with transaction.atomic():
+            new_names = sorted({row['category'] for row in rows} - self.categories.keys())
+            if new_names:
+                Category.objects.bulk_create([Category(name=name) for name in new_names])
+                self.categories.update(Category.objects.filter(name__in=new_names).values_list('name', 'id'))
+                self.categories_created += len(new_names)
+            generated = [generated_sku_id(row['sku']) for row in rows]
+            assign_missing_skus([product_id for product_id in generated if product_id is not None])
+            for optional, shaped in shapes.items():
+                update_fields = REQUIRED_FIELDS + [
+                    name for name in optional if name != 'popularity_score' or self.update_popularity
+                ] + ['updated_at']
+                Product.objects.bulk_create(
+                    [Product(category_id=self.categories[row['category']],
+                             **{k: v for k, v in row.items() if k != 'category'}) for row in shaped],
+                    update_conflicts=True, unique_fields=['sku'], update_fields=update_fields,
+                )
+
+    def run(self, rows):
+        for line, raw in rows:
+            self.add(line, raw)
+        self.flush()
+        return self
+
+
+def rebuild_artifacts():
+    """Refresh everything derived from the catalog once, after a bulk load.
+
+    Bumps the catalog version in the shared version cache, so every
+    server's cached pages and cards are invalidated, refits and publishes
+    the feature pipeline, and drops this process's neighbour index; other
+    processes pick up the new generation and rebuild their index on their
+    next request.
+    """
+    bump_catalog_version()
+    pipeline = feature_pipeline.fit_catalog()
+    pipeline.save(feature_pipeline.artifact_dir())
+    feature_pipeline.reset()
+    neighbours.reset()
+    return pipeline
+
+
+def generated_sku(field='id'):
+    """SHOP-<id> as a query expression"""
+    return Concat(Value(GENERATED_SKU_PREFIX), Cast(field, CharField()))
+
+
+def generated_sku_id(sku):
+    """The product id of a SHOP-<id> SKU, or None for any other SKU"""
+    number = sku[len(GENERATED_SKU_PREFIX):]
+    if sku.startswith(GENERATED_SKU_PREFIX) and number.isdigit():
+        return int(number)
+    return None
+
+
+def assign_missing_skus(product_ids):
+    """Give the products among `product_ids` that have no SKU the SKU SHOP-<id>"""
+    assigned = 0
+    for start in range(0, len(product_ids), CHUNK_SIZE):
+        assigned += Product.objects.filter(id__in=product_ids[start:start + CHUNK_SIZE], sku__isnull=True) \
+            .update(sku=generated_sku())
+    return assigned
+
+
+def export_rows(chunk_size=CHUNK_SIZE):
+    """Yield catalog rows (dicts keyed by FIELDS) in id order, streamed from the database.
+
+    Read-only: products without a SKU are listed as SHOP-<id>, which an
+    import assigns to them (CatalogImport).
+    """
+    rows = Product.objects.order_by('id').values_list(
+        Coalesce('sku', generated_sku()), 'name', 'description', 'category__name', 'price', 'stock',
+        'popularity_score', 'rating',
+    )
+    for values in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(FIELDS, values))
+
+
+def write_rows(stream, format, rows):
+    """Write rows as CSV with a header or as JSON Lines; returns the number written"""
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    for row in rows:
+        stream.write(json.dumps({**row, 'price': str(row['price'])}) + '\n')
+        count += 1
+    return count
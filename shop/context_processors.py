@@ -0,0 +1,7 @@
+# shop/context_processors.py
+from .cache import get_catalog_version
+
+
+def catalog(request):
+    """Expose the catalog version so templates can key cached fragments on it"""
+    return {'catalog_version': get_catalog_version()}
@@ -0,0 +1,19 @@
+# shop/db.py
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Configure each new SQLite connection from SHOP_SQLITE_PRAGMAS.
+
+    Runs once per connection, so with CONN_MAX_AGE the cost is paid when a
+    worker thread first connects rather than on every request.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SHOP_SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
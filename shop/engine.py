@@ -0,0 +1,61 @@
+# shop/engine.py
+"""Entry points into the recommendation stack that do not import it.
+
+NumPy, SciPy and scikit-learn dominate a cold start, so views, signals
+and app loading reach the engine through these functions; the stack is
+imported by the first request that ranks products (or by prewarm()).
+"""
+import importlib
+import os
+import subprocess
+import sys
+
+# Imported on demand; prewarm() loads them all up front
+ENGINE_MODULES = ['shop.recommendation', 'shop.associations', 'shop.neighbours']
+
+
+def recommendation_engine():
+    from .recommendation import RecommendationEngine
+
+    return RecommendationEngine()
+
+
+def bought_together(product_ids, exclude=(), limit=4):
+    from .associations import bought_together
+
+    return bought_together(product_ids, exclude, limit)
+
+
+def prewarm():
+    """Import the whole stack now, e.g. before a preforking server forks its workers"""
+    for name in ENGINE_MODULES:
+        importlib.import_module(name)
+
+
+def import_costs(log):
+    """{top-level package: (self microseconds, modules)} from `python -X importtime` output"""
+    costs = {}
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        total, modules = costs.get(package, (0, 0))
+        costs[package] = (total + int(own), modules + 1)
+    return costs
+
+
+def profile_startup(prewarm=False):
+    """Import-time log of a fresh process that sets Django up and loads the URLconf"""
+    from django.conf import settings
+
+    script = ('import django; django.setup()\n'
+              'from django.urls import get_resolver; get_resolver().url_patterns\n')
+    if prewarm:
+        script += 'from shop.engine import prewarm; prewarm()\n'
+    environment = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], cwd=settings.BASE_DIR,
+                            env=environment, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return result.stderr
@@ -0,0 +1,303 @@
+# shop/evaluation.py
+import itertools
+import multiprocessing
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from django.db import connections
+from sklearn.decomposition import TruncatedSVD
+
+from .feature_pipeline import get_pipeline
+from .models import OrderItem, UserInteraction
+from .recommendation import INTERACTION_WEIGHTS, RecommendationEngine
+
+# Held-out events that count as the user wanting the product
+RELEVANT_TYPES = ('cart', 'purchase', 'like')
+TYPE_CODES = {name: code for code, name in enumerate(INTERACTION_WEIGHTS)}
+LOAD_CHUNK_SIZE = 50_000
+# One loaded event: user id, product id, TYPE_CODES code, Unix time
+EVENT_DTYPE = np.dtype([('user', np.int64), ('product', np.int64), ('type', np.int64), ('time', np.float64)])
+
+
+def fill_events(events, start, stop, rows):
+    """Copy (user, product, type code, time) tuples into events[start:stop], a chunk at a time.
+
+    Returns the index after the last row copied; rows beyond `stop` are ignored.
+    """
+    rows = iter(rows)
+    while start < stop:
+        size = min(LOAD_CHUNK_SIZE, stop - start)
+        chunk = np.fromiter(itertools.islice(rows, size), EVENT_DTYPE)
+        events[start:start + len(chunk)] = chunk
+        start += len(chunk)
+        if len(chunk) < size:
+            break
+    return start
+
+
+class EventLog:
+    """Interactions and order lines as parallel arrays, sorted by time"""
+
+    def __init__(self, users, products, types, times):
+        order = np.lexsort((np.arange(len(times)), times))
+        self.users = users[order]
+        self.products = products[order]
+        self.types = types[order]
+        self.times = times[order]
+
+    @classmethod
+    def load(cls):
+        interactions = UserInteraction.objects.order_by().values_list(
+            'user_id', 'product_id', 'interaction_type', 'timestamp',
+        )
+        # Order lines are purchases too, even when no interaction was logged for them
+        order_lines = OrderItem.objects.order_by().values_list(
+            'order__user_id', 'product_id', 'order__created_at',
+        )
+        # Counted first, so the rows stream into one preallocated array instead of
+        # Python lists; rows written after the count are left for the next run
+        interaction_count = interactions.count()
+        events = np.empty(interaction_count + order_lines.count(), dtype=EVENT_DTYPE)
+        end = fill_events(events, 0, interaction_count, (
+            (user_id, product_id, TYPE_CODES.get(interaction_type, 0), timestamp.timestamp())
+            for user_id, product_id, interaction_type, timestamp in interactions.iterator(LOAD_CHUNK_SIZE)
+        ))
+        end = fill_events(events, end, end + len(events) - interaction_count, (
+            (user_id, product_id, TYPE_CODES['purchase'], created_at.timestamp())
+            for user_id, product_id, created_at in order_lines.iterator(LOAD_CHUNK_SIZE)
+        ))
+        events = events[:end]
+        return cls(events['user'], events['product'], events['type'], events['time'])
+
+    def split(self, test_fraction):
+        """Events before and after the time that leaves `test_fraction` of them for testing"""
+        cut = int(len(self.times) * (1 - test_fraction))
+        return slice(0, cut), slice(cut, len(self.times))
+
+
+class Strategy:
+    """A ranking method scored over catalog columns (rows of the feature pipeline)"""
+    name = None
+
+    def __init__(self, context):
+        self.context = context
+
+    def scores(self, user, history):
+        raise NotImplementedError
+
+
+class ContentStrategy(Strategy):
+    """The production engine: similarity to the weighted interaction history"""
+    name = 'content'
+
+    def __init__(self, context):
+        super().__init__(context)
+        self.engine = RecommendationEngine()
+        self.engine.pipeline = context.pipeline
+
+    def scores(self, user, history):
+        product_ids = self.context.pipeline.product_ids
+        return self.engine.score_products({int(product_ids[c]): w for c, w in history.items()})
+
+
+class ColdStartStrategy(ContentStrategy):
+    """The engine's answer for users without history (popularity x rating)"""
+    name = 'cold-start'
+
+    def scores(self, user, history):
+        return self.engine.score_products({})
+
+
+class ItemCFStrategy(Strategy):
+    """Item-item cosine collaborative filtering over the training matrix"""
+    name = 'cf'
+
+    def __init__(self, context):
+        super().__init__(context)
+        norms = np.sqrt(np.asarray(context.train.multiply(context.train).sum(axis=0))).ravel()
+        norms[norms == 0] = 1.0
+        self.normalized = (context.train @ sp.diags(1.0 / norms)).tocsr()
+
+    def scores(self, user, history):
+        # r_u @ (Rn.T @ Rn) without materializing the item x item matrix
+        row = self.normalized[user]
+        return np.asarray((row @ self.normalized.T @ self.normalized).todense()).ravel()
+
+
+class SVDStrategy(Strategy):
+    """Matrix factorization of the training matrix (truncated SVD)"""
+    name = 'svd'
+    components = 32
+
+    def __init__(self, context):
+        super().__init__(context)
+        rank = max(1, min(self.components, min(context.train.shape) - 1))
+        svd = TruncatedSVD(n_components=rank, random_state=context.seed)
+        self.user_factors = svd.fit_transform(context.train)
+        self.item_factors = svd.components_
+
+    def scores(self, user, history):
+        return self.user_factors[user] @ self.item_factors
+
+
+STRATEGIES = {cls.name: cls for cls in [ContentStrategy, ItemCFStrategy, SVDStrategy, ColdStartStrategy]}
+
+
+class EvaluationContext:
+    """Everything the strategies and shard workers need, built once in the parent"""
+
+    def __init__(self, log, test_fraction, k, seed, max_users=None):
+        self.k = k
+        self.seed = seed
+        self.pipeline = get_pipeline()
+        columns = self.pipeline.rows_of(log.products)
+        known = columns >= 0
+        train_part, test_part = log.split(test_fraction)
+        self.cutoff = float(log.times[train_part.stop - 1]) if train_part.stop else None
+
+        user_ids, user_rows = np.unique(log.users, return_inverse=True)
+        self.user_ids = user_ids
+        weights = np.array(list(INTERACTION_WEIGHTS.values()), dtype=np.float64)[log.types]
+
+        train = np.zeros(len(log.times), dtype=bool)
+        train[train_part] = True
+        train &= known
+        self.train = sp.csr_matrix(
+            (weights[train], (user_rows[train], columns[train])),
+            shape=(len(user_ids), len(self.pipeline.product_ids)),
+        )
+        self.train.data = np.maximum(self.train.data, 0)  # net dislikes are not signal
+        self.train.eliminate_zeros()
+        self.popularity = np.asarray((self.train > 0).sum(axis=0)).ravel().astype(np.float64)
+
+        relevant_codes = [TYPE_CODES[t] for t in RELEVANT_TYPES]
+        test = np.zeros(len(log.times), dtype=bool)
+        test[test_part] = True
+        test &= known & np.isin(log.types, relevant_codes)
+        relevant = sp.csr_matrix(
+            (np.ones(test.sum()), (user_rows[test], columns[test])), shape=self.train.shape,
+        )
+        self.relevant = relevant.tocsr()
+        users = np.flatnonzero(np.diff(self.relevant.indptr))
+        if max_users and len(users) > max_users:
+            users = np.sort(np.random.default_rng(seed).choice(users, max_users, replace=False))
+        self.users = users
+
+
+_context = None
+_strategies = {}
+
+
+def evaluate_shard(strategy_name, users):
+    """Metric sums, latencies and recommended columns for a shard of user rows"""
+    context = _context
+    strategy = _strategies[strategy_name]
+    k = context.k
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    totals = {'precision': 0.0, 'recall': 0.0, 'ndcg': 0.0, 'hit_rate': 0.0}
+    latencies = []
+    recommended = set()
+
+    for user in users:
+        start, end = context.train.indptr[user], context.train.indptr[user + 1]
+        history = dict(zip(context.train.indices[start:end].tolist(),
+                           context.train.data[start:end].tolist()))
+        relevant = set(context.relevant.indices[
+            context.relevant.indptr[user]:context.relevant.indptr[user + 1]].tolist())
+
+        started = time.perf_counter()
+        scores = np.array(strategy.scores(user, history), dtype=np.float64)
+        if not np.any(scores):
+            scores = context.popularity.copy()
+        if history:
+            scores[list(history)] = -np.inf
+        kept = min(k, len(scores))
+        top = np.argpartition(-scores, kept - 1)[:kept]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        latencies.append(time.perf_counter() - started)
+
+        hits = np.array([column in relevant for column in top.tolist()], dtype=bool)
+        ideal = discounts[:min(len(relevant), k)].sum()
+        totals['precision'] += hits.sum() / k
+        totals['recall'] += hits.sum() / len(relevant)
+        totals['ndcg'] += discounts[:kept][hits].sum() / ideal
+        totals['hit_rate'] += float(hits.any())
+        recommended.update(top.tolist())
+
+    return totals, latencies, recommended
+
+
+def shards(users, count):
+    return [shard for shard in np.array_split(users, count) if len(shard)]
+
+
+def evaluate(strategy_names, test_fraction=0.2, k=10, workers=1, max_users=None, seed=42,
+             stdout=None):
+    """Replay the interaction log for each strategy and return a JSON-serializable report"""
+    global _context
+    log = EventLog.load()
+    _context = context = EvaluationContext(log, test_fraction, k, seed, max_users)
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'events': len(log.times),
+            'test_fraction': test_fraction,
+            'cutoff': context.cutoff,
+            'k': k,
+            'users': len(context.users),
+            'catalog': len(context.pipeline.product_ids),
+            'workers': workers,
+            'seed': seed,
+        },
+        'strategies': {},
+    }
+
+    for name in strategy_names:
+        if stdout:
+            stdout.write(f'Evaluating {name} on {len(context.users)} users...')
+        started = time.perf_counter()
+        _strategies[name] = STRATEGIES[name](context)
+        fitted = time.perf_counter()
+
+        results = []
+        if workers > 1 and len(context.users) > 1:
+            # Forked workers inherit the context and fitted strategy; nothing is pickled but ids
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('fork'))
+            parts = shards(context.users, workers * 4)
+            with pool:
+                results = list(pool.map(evaluate_shard, [name] * len(parts), parts))
+        elif len(context.users):
+            results = [evaluate_shard(name, context.users)]
+
+        totals = {'precision': 0.0, 'recall': 0.0, 'ndcg': 0.0, 'hit_rate': 0.0}
+        latencies, recommended = [], set()
+        for shard_totals, shard_latencies, shard_recommended in results:
+            for metric, value in shard_totals.items():
+                totals[metric] += value
+            latencies.extend(shard_latencies)
+            recommended |= shard_recommended
+
+        users = max(len(context.users), 1)
+        latencies = np.array(latencies or [0.0]) * 1000
+        report['strategies'][name] = {
+            f'precision@{k}': totals['precision'] / users,
+            f'recall@{k}': totals['recall'] / users,
+            f'ndcg@{k}': totals['ndcg'] / users,
+            f'hit_rate@{k}': totals['hit_rate'] / users,
+            'coverage': len(recommended) / max(len(context.pipeline.product_ids), 1),
+            'latency_ms': {
+                'mean': float(latencies.mean()),
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95)),
+            },
+            'fit_seconds': fitted - started,
+            'evaluate_seconds': time.perf_counter() - fitted,
+        }
+        del _strategies[name]
+    return report
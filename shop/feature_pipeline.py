@@ -0,0 +1,495 @@
+# shop/feature_pipeline.py
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+from django.db.models import Max
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from .cache import get_catalog_version
+from .instrumentation import stage
+from .models import Product
+
+PIPELINE_VERSION = 3
+
+# Numeric columns read from the database, in feature order
+FEATURE_LAYOUT = ['price', 'popularity_score', 'rating']
+POPULARITY, RATING = 1, 2
+
+# Hashed text space: no vocabulary is kept, words map straight to a column
+TEXT_FEATURES = 2 ** 18
+
+# Relative weight of each block in the combined similarity vector
+TEXT_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.8
+NUMERIC_WEIGHT = 0.5
+
+TEXT_CHUNK_SIZE = 5000
+
+# A refresh re-reads rows saved up to this long before the last one it saw,
+# so rows of transactions that committed late are not missed
+REFRESH_OVERLAP_SECONDS = 60
+# How often get_pipeline() looks for a newly published generation
+GENERATION_CHECK_SECONDS = 5
+
+# Published generations kept on disk, so workers still mapping an old one are unaffected
+GENERATIONS_KEPT = 2
+
+# Arrays written as one .npy file each and memory-mapped read-only on load
+ARRAY_NAMES = [
+    'mean', 'scale', 'idf', 'category_keys', 'product_ids', 'numeric', 'categories',
+    'text_data', 'text_indices', 'text_indptr',
+    'matrix_data', 'matrix_indices', 'matrix_indptr',
+]
+
+_vectorizer = HashingVectorizer(
+    n_features=TEXT_FEATURES, alternate_sign=False, norm=None, stop_words='english',
+)
+
+
+def artifact_dir():
+    return str(getattr(settings, 'RECOMMENDATION_ARTIFACT_DIR', settings.BASE_DIR / 'artifacts'))
+
+
+def read_catalog_rows(queryset=None):
+    """(product ids, raw numeric features, category ids) ordered by id"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    rows = list(queryset.order_by('id').values_list('id', 'category_id', *FEATURE_LAYOUT))
+    if not rows:
+        return (np.zeros(0, dtype=np.int64), np.zeros((0, len(FEATURE_LAYOUT))),
+                np.zeros(0, dtype=np.int64))
+    table = np.array(rows, dtype=np.float64)
+    return table[:, 0].astype(np.int64), raw_features(table[:, 2:]), table[:, 1].astype(np.int64)
+
+
+def latest_update():
+    """Unix time of the most recent product save, or None for an empty catalog"""
+    latest = Product.objects.aggregate(latest=Max('updated_at'))['latest']
+    return latest.timestamp() if latest else None
+
+
+def read_catalog_changes(pipeline):
+    """What changed in the catalog since `pipeline` read its rows.
+
+    Returns (all product ids, changed ids, their raw features, their
+    category ids, new watermark). Changed are the rows saved since the
+    pipeline's watermark, less REFRESH_OVERLAP_SECONDS, and products the
+    pipeline does not know; the rest of the catalog costs one id-only
+    scan, which also finds deletions.
+    """
+    watermark = latest_update()  # first: rows saved while reading are read again next time
+    product_ids = np.fromiter(Product.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+    since = datetime.datetime.fromtimestamp(pipeline.rows_updated_at - REFRESH_OVERLAP_SECONDS,
+                                            tz=datetime.timezone.utc)
+    blocks = [read_catalog_rows(Product.objects.filter(updated_at__gte=since))]
+    unseen = np.setdiff1d(product_ids, np.union1d(pipeline.product_ids, blocks[0][0]))
+    for start in range(0, len(unseen), TEXT_CHUNK_SIZE):
+        chunk = unseen[start:start + TEXT_CHUNK_SIZE].tolist()
+        blocks.append(read_catalog_rows(Product.objects.filter(id__in=chunk)))
+    changed_ids, raw, categories = (np.concatenate(parts) for parts in zip(*blocks))
+    order = np.argsort(changed_ids, kind='stable')
+    return product_ids, changed_ids[order], raw[order], categories[order], watermark
+
+
+def fit_catalog():
+    """Fit a pipeline on the whole catalog as it is now"""
+    version = get_catalog_version()
+    watermark = latest_update()
+    pipeline = FeaturePipeline.fit(*read_catalog_rows())
+    pipeline.catalog_version = version
+    pipeline.rows_updated_at = watermark
+    return pipeline
+
+
+def refresh_catalog(pipeline):
+    """`pipeline` with the catalog changes since its rows were read, and the current catalog version"""
+    version = get_catalog_version()  # first: changes made while reading get a newer version
+    if pipeline.rows_updated_at is None:
+        # Saved without a watermark: every row has to be read once
+        watermark = latest_update()
+        ids, raw, categories = read_catalog_rows()
+        return pipeline.refreshed(ids, ids, raw, categories, version, watermark)
+    ids, changed_ids, raw, categories, watermark = read_catalog_changes(pipeline)
+    return pipeline.refreshed(ids, changed_ids, raw, categories, version, watermark)
+
+
+def publish_changes(directory=None):
+    """Publish the catalog changes since the current generation as a new generation.
+
+    This is the expensive side of a catalog edit (reading the changed rows
+    and writing the matrix), run by `build_feature_pipeline --refresh`
+    instead of in every worker; workers just map the new generation.
+    Without a published generation the catalog is fitted. Returns the
+    published pipeline, or None when the current one is up to date.
+    """
+    directory = directory or artifact_dir()
+    pipeline = FeaturePipeline.load(directory)
+    if pipeline is None:
+        pipeline = fit_catalog()
+    elif pipeline.catalog_version == get_catalog_version():
+        return None
+    else:
+        pipeline = refresh_catalog(pipeline)
+    pipeline.save(directory)
+    return pipeline
+
+
+def raw_features(raw):
+    """Bring database values onto the engine's base scale (price in thousands, rating 0-1)"""
+    raw = raw.copy()
+    raw[:, 0] /= 1000
+    raw[:, 2] /= 5.0
+    return raw
+
+
+def hashed_term_counts(product_ids):
+    """Sparse hashed term counts of name + description, one row per id, in the given order"""
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    if len(product_ids) == 0:
+        return sp.csr_matrix((0, TEXT_FEATURES), dtype=np.float64)
+    blocks = []
+    for start in range(0, len(product_ids), TEXT_CHUNK_SIZE):
+        chunk = product_ids[start:start + TEXT_CHUNK_SIZE]
+        texts = dict(
+            (pid, f'{name} {description}')
+            for pid, name, description in Product.objects.filter(id__in=chunk.tolist())
+            .values_list('id', 'name', 'description')
+        )
+        blocks.append(_vectorizer.transform([texts.get(int(pid), '') for pid in chunk]))
+    return sp.vstack(blocks, format='csr')
+
+
+class FeaturePipeline:
+    """Fitted feature statistics plus the sparse feature matrix of the catalog.
+
+    Each product is one L2-normalized row combining hashed TF-IDF of its
+    name and description, a one-hot category and its scaled numeric
+    features, so cosine similarity is a sparse dot product. The statistics
+    (numeric mean/scale, IDF, category columns) are fitted once by the
+    build_feature_pipeline command; products added after the fit are
+    transformed with the same statistics instead of refitting.
+
+    Saved pipelines are published as numbered generations of .npy files
+    that every worker process memory-maps read-only, so the catalog matrix
+    is held once in the OS page cache rather than once per worker.
+    """
+
+    def __init__(self, mean, scale, idf, category_keys, product_ids, numeric,
+                 categories, text, fitted_at, catalog_version=None, matrix=None, generation=None,
+                 rows_updated_at=None):
+        self.mean = mean
+        self.scale = scale
+        self.idf = idf
+        self.category_keys = category_keys
+        self.category_columns = {int(c): i for i, c in enumerate(category_keys)}
+        self.fitted_at = fitted_at
+        self.catalog_version = catalog_version
+        self.generation = generation
+        # Unix time of the latest product save the rows include (None: unknown, re-read everything)
+        self.rows_updated_at = rows_updated_at
+        self.set_rows(product_ids, numeric, categories, text, matrix)
+
+    @classmethod
+    def fit(cls, product_ids, raw, categories, counts=None):
+        """Fit numeric scaling, IDF and category columns on the whole catalog"""
+        if counts is None:
+            counts = hashed_term_counts(product_ids)
+        with stage('rec-scale'):
+            if len(raw):
+                mean = raw.mean(axis=0)
+                scale = raw.std(axis=0)
+            else:
+                mean = np.zeros(len(FEATURE_LAYOUT))
+                scale = np.ones(len(FEATURE_LAYOUT))
+            scale[scale == 0] = 1.0
+            # Smoothed IDF, as TfidfTransformer(smooth_idf=True)
+            document_frequency = np.bincount(counts.indices, minlength=TEXT_FEATURES)
+            idf = (np.log((1 + len(product_ids)) / (1 + document_frequency)) + 1).astype(np.float32)
+            category_keys = np.unique(categories)
+
+        pipeline = cls(mean, scale, idf, category_keys, np.zeros(0, dtype=np.int64),
+                       np.zeros((0, len(FEATURE_LAYOUT))), np.zeros(0, dtype=np.int64),
+                       sp.csr_matrix((0, TEXT_FEATURES)), time.time())
+        pipeline.set_rows(product_ids, pipeline.transform(raw), categories,
+                          pipeline.transform_text(counts))
+        return pipeline
+
+    def set_rows(self, product_ids, numeric, categories, text, matrix=None):
+        self.product_ids = product_ids
+        self.numeric = numeric
+        self.categories = categories
+        self.text = text
+        self.matrix = matrix if matrix is not None else self.combine(numeric, categories, text)
+
+    def rows_of(self, product_ids):
+        """Row index of each product id, -1 where unknown (ids are sorted, so no dict is kept)"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        rows = np.searchsorted(self.product_ids, product_ids)
+        rows[rows >= len(self.product_ids)] = 0
+        found = len(self.product_ids) > 0
+        if found:
+            found = self.product_ids[rows] == product_ids
+        return np.where(found, rows, -1)
+
+    def transform(self, raw):
+        return (raw - self.mean) / self.scale
+
+    def inverse_transform(self, numeric):
+        return numeric * self.scale + self.mean
+
+    def transform_text(self, counts):
+        """Sublinear TF-IDF weighting of hashed counts, L2-normalized once"""
+        tfidf = counts.astype(np.float64)
+        tfidf.data = 1.0 + np.log(tfidf.data)
+        tfidf = (tfidf @ sp.diags(self.idf.astype(np.float64))).tocsr()
+        return normalize(tfidf, copy=False) if tfidf.shape[0] else tfidf
+
+    def combine(self, numeric, categories, text):
+        """Stack the weighted blocks into one L2-normalized CSR matrix"""
+        rows = len(categories)
+        columns = np.array([self.category_columns.get(int(c), -1) for c in categories], dtype=np.int64)
+        known = np.flatnonzero(columns >= 0)
+        one_hot = sp.csr_matrix(
+            (np.ones(len(known)), (known, columns[known])),
+            shape=(rows, len(self.category_keys)),
+        )
+        numeric_block = sp.csr_matrix(normalize(numeric) if rows else numeric)
+        matrix = sp.hstack([
+            TEXT_WEIGHT * text,
+            CATEGORY_WEIGHT * one_hot,
+            NUMERIC_WEIGHT * numeric_block,
+        ], format='csr')
+        return normalize(matrix, copy=False) if rows else matrix
+
+    def refreshed(self, product_ids, changed_ids, raw, categories, catalog_version=None, rows_updated_at=None):
+        """A copy for the catalog `product_ids` in which the rows of `changed_ids` are recomputed.
+
+        `raw` and `categories` are the changed products' rows. Every other
+        product keeps its numeric, text and combined rows; changed and new
+        products are transformed with the fitted statistics, text included,
+        so edited names and descriptions take effect. If nothing changed,
+        the (possibly shared, memory-mapped) arrays are kept as they are.
+        """
+        with stage('rec-scale'):
+            rows = self.rows_of(product_ids)
+            changed = np.isin(product_ids, changed_ids)
+            # Ids neither known nor read were deleted while the catalog was being read
+            product_ids = product_ids[changed | (rows >= 0)]
+            rows = self.rows_of(product_ids)
+            changed = np.isin(product_ids, changed_ids)
+            keep = np.isin(changed_ids, product_ids)
+            changed_ids, raw, categories = changed_ids[keep], raw[keep], categories[keep]
+            if not changed.any() and np.array_equal(product_ids, self.product_ids):
+                return FeaturePipeline(
+                    self.mean, self.scale, self.idf, self.category_keys, self.product_ids,
+                    self.numeric, self.categories, self.text, self.fitted_at, catalog_version,
+                    matrix=self.matrix, generation=self.generation, rows_updated_at=rows_updated_at,
+                )
+
+            known = np.flatnonzero(~changed)
+            fresh = np.flatnonzero(changed)
+            numeric = np.empty((len(product_ids), len(FEATURE_LAYOUT)))
+            numeric[known] = self.numeric[rows[known]]
+            numeric[fresh] = self.transform(raw)
+            all_categories = np.empty(len(product_ids), dtype=np.int64)
+            all_categories[known] = self.categories[rows[known]]
+            all_categories[fresh] = categories
+            fresh_text = self.transform_text(hashed_term_counts(changed_ids))
+            fresh_matrix = self.combine(numeric[fresh], categories, fresh_text)
+            # Stack kept rows then recomputed rows, and permute back into id order
+            order = np.empty(len(product_ids), dtype=np.int64)
+            order[known] = np.arange(len(known))
+            order[fresh] = len(known) + np.arange(len(fresh))
+            text = sp.vstack([self.text[rows[known]], fresh_text], format='csr')[order]
+            matrix = sp.vstack([self.matrix[rows[known]], fresh_matrix], format='csr')[order]
+        return FeaturePipeline(self.mean, self.scale, self.idf, self.category_keys, product_ids,
+                               numeric, all_categories, text, self.fitted_at, catalog_version,
+                               matrix=matrix, generation=self.generation, rows_updated_at=rows_updated_at)
+
+    def row_of(self, product_id):
+        row = int(self.rows_of([product_id])[0])
+        return row if row >= 0 else None
+
+    def similarities(self, query):
+        """Cosine similarity of every catalog row to a (sparse) query vector"""
+        return np.asarray((self.matrix @ query.T).todense()).ravel()
+
+    def similarity_blocks(self, rows=None, block_size=1024):
+        """Yield (row indices, dense similarity block) for rows against the whole catalog"""
+        if rows is None:
+            rows = np.arange(len(self.product_ids))
+        transposed = self.matrix.T.tocsc()
+        for start in range(0, len(rows), block_size):
+            block_rows = rows[start:start + block_size]
+            yield block_rows, (self.matrix[block_rows] @ transposed).toarray()
+
+    # Persistence
+
+    def save(self, directory=None):
+        """Publish the pipeline as a new generation and point CURRENT at it"""
+        directory = directory or artifact_dir()
+        os.makedirs(directory, exist_ok=True)
+        generation = (current_generation(directory) or 0) + 1
+        path = generation_path(directory, generation)
+        staging = path + '.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        arrays = {
+            'mean': self.mean, 'scale': self.scale, 'idf': self.idf,
+            'category_keys': self.category_keys, 'product_ids': self.product_ids,
+            'numeric': self.numeric, 'categories': self.categories,
+            'text_data': self.text.data, 'text_indices': self.text.indices,
+            'text_indptr': self.text.indptr,
+            'matrix_data': self.matrix.data, 'matrix_indices': self.matrix.indices,
+            'matrix_indptr': self.matrix.indptr,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, f'{name}.npy'), np.ascontiguousarray(array))
+        meta = {
+            'version': PIPELINE_VERSION,
+            'layout': FEATURE_LAYOUT,
+            'text_features': TEXT_FEATURES,
+            'fitted_at': self.fitted_at,
+            'rows_updated_at': self.rows_updated_at,
+            'catalog_version': self.catalog_version,
+            'products': len(self.product_ids),
+            'generation': generation,
+        }
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(staging, path)
+
+        # Readers only ever follow CURRENT, so the switch is a single rename
+        pointer = os.path.join(directory, 'CURRENT')
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(str(generation))
+        os.replace(pointer + '.tmp', pointer)
+        self.generation = generation
+        prune_generations(directory, generation)
+
+    @classmethod
+    def load(cls, directory=None, generation=None):
+        """Memory-map the current (or given) generation, or return None if missing or stale"""
+        directory = directory or artifact_dir()
+        if generation is None:
+            generation = current_generation(directory)
+            if generation is None:
+                return None
+        path = generation_path(directory, generation)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            arrays = {
+                name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                for name in ARRAY_NAMES
+            }
+        except (OSError, ValueError):
+            return None
+        if (meta.get('version') != PIPELINE_VERSION or meta.get('layout') != FEATURE_LAYOUT
+                or meta.get('text_features') != TEXT_FEATURES):
+            return None
+        rows = len(arrays['product_ids'])
+        # scipy keeps references to the mapped arrays, so nothing is copied here
+        text = sp.csr_matrix(
+            (arrays['text_data'], arrays['text_indices'], arrays['text_indptr']),
+            shape=(rows, TEXT_FEATURES),
+        )
+        matrix = sp.csr_matrix(
+            (arrays['matrix_data'], arrays['matrix_indices'], arrays['matrix_indptr']),
+            shape=(rows, TEXT_FEATURES + len(arrays['category_keys']) + len(FEATURE_LAYOUT)),
+        )
+        return cls(arrays['mean'], arrays['scale'], arrays['idf'], arrays['category_keys'],
+                   arrays['product_ids'], arrays['numeric'], arrays['categories'], text,
+                   meta['fitted_at'], meta.get('catalog_version'), matrix=matrix, generation=generation,
+                   rows_updated_at=meta.get('rows_updated_at'))
+
+
+def generation_path(directory, generation):
+    return os.path.join(directory, f'gen-{generation:06d}')
+
+
+def current_generation(directory=None):
+    """Generation number CURRENT points at, or None if nothing was published"""
+    try:
+        with open(os.path.join(directory or artifact_dir(), 'CURRENT')) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def prune_generations(directory, current):
+    for name in os.listdir(directory):
+        if not name.startswith('gen-'):
+            continue
+        try:
+            generation = int(name[4:].split('.')[0])
+        except ValueError:
+            continue
+        if generation <= current - GENERATIONS_KEPT:
+            # Unlinking is safe on POSIX: processes that still map the files keep them
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+_pipeline = None
+_generation = None
+_generation_checked = 0.0
+_lock = threading.Lock()
+
+
+def published_generation():
+    """CURRENT generation, re-read at most every GENERATION_CHECK_SECONDS"""
+    global _generation, _generation_checked
+    now = time.monotonic()
+    if now - _generation_checked >= GENERATION_CHECK_SECONDS:
+        _generation = current_generation()
+        _generation_checked = now
+    return _generation
+
+
+def get_pipeline():
+    """Process-wide pipeline: the published generation, memory-mapped by every worker.
+
+    Catalog changes reach it as new generations, published off the request
+    path by `build_feature_pipeline --refresh`; a worker swaps to one once
+    it sees CURRENT move, so requests never re-read the catalog and the
+    matrix stays one shared copy. Only when nothing usable is published (a
+    fresh checkout, tests) does the process fit its own pipeline and keep
+    it in step with the catalog version.
+    """
+    global _pipeline
+    generation = published_generation()
+    pipeline = _pipeline
+    if pipeline is not None and pipeline.generation == generation:
+        if generation is not None or pipeline.catalog_version == get_catalog_version():
+            return pipeline
+
+    with _lock:
+        if generation is not None and (_pipeline is None or _pipeline.generation != generation):
+            loaded = FeaturePipeline.load(generation=generation)
+            if loaded is not None:
+                _pipeline = loaded
+        if _pipeline is not None and generation is not None and _pipeline.generation == generation:
+            return _pipeline
+        if _pipeline is None or _pipeline.generation is not None:
+            _pipeline = fit_catalog()
+        elif _pipeline.catalog_version != get_catalog_version():
+            # Swap in a new object so concurrent readers never see half-updated rows
+            _pipeline = refresh_catalog(_pipeline)
+        return _pipeline
+
+
+def reset():
+    """Forget the loaded pipeline (used after the catalog was rebuilt wholesale)"""
+    global _pipeline, _generation_checked
+    with _lock:
+        _pipeline = None
+        _generation_checked = 0.0
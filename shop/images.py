@@ -0,0 +1,170 @@
+# shop/images.py
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+
+logger = logging.getLogger('shop.images')
+
+UNSPLASH_URL = 'https://images.unsplash.com/photo-{photo}?w={width}&h={height}&fit=crop&fm={format}'
+
+# Fallback photos for products without an uploaded image.
+# Checked in order, the first rule with a keyword in the product name wins.
+IMAGE_RULES = [
+    (('headphone', 'speaker'), '1505740420928-5e560c06d30e'),
+    (('watch',), '1523275335684-37898b6baf30'),
+    (('t-shirt', 'shirt'), '1521572163474-6864f9cf17ab'),
+    (('jeans',), '1542272604-787c3835535d'),
+    (('shoe',), '1542291026-7eec264c27ff'),
+    (('laptop', 'stand'), '1496181133206-80ce9b88a853'),
+    (('book', 'python'), '1532012197267-da84d127e765'),
+    (('blender',), '1585515320310-259814833e62'),
+    (('bottle',), '1602143407151-7111542de6e8'),
+    (('yoga', 'mat'), '1601925260368-ae2f83cf8b7f'),
+    (('dumbbell',), '1581009146145-b5ef050c2e1e'),
+    (('coffee',), '1517668808822-9ebb02f2a0e6'),
+]
+DEFAULT_PHOTO = '1560393464-5c69a73c5770'
+
+# Slot sizes used by the templates (width, height)
+IMAGE_SIZES = {
+    'card': (250, 200),
+    'thumb': (100, 100),
+    'large': (500, 500),
+}
+
+# Encoder settings of the derivatives generated for every slot size
+DERIVATIVE_FORMATS = {
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+}
+
+
+@lru_cache(maxsize=4096)
+def resolve_fallback_photo(name):
+    """Return the fallback photo id for a product name"""
+    name = name.lower()
+    for keywords, photo in IMAGE_RULES:
+        if any(keyword in name for keyword in keywords):
+            return photo
+    return DEFAULT_PHOTO
+
+
+@lru_cache(maxsize=4096)
+def fallback_image_url(name, size='card', format='jpeg'):
+    """Return the fallback image URL for a product name and slot size"""
+    width, height = IMAGE_SIZES[size]
+    format = 'jpg' if format == 'jpeg' else format
+    return UNSPLASH_URL.format(photo=resolve_fallback_photo(name), width=width, height=height,
+                               format=format)
+
+
+def derivative_name(name, size, format):
+    """Storage name of an uploaded image's derivative, e.g. products/derived/card/a.png.webp"""
+    directory, filename = posixpath.split(name)
+    extension = DERIVATIVE_FORMATS[format][0]
+    return posixpath.join(directory, 'derived', size, f'{filename}.{extension}')
+
+
+def has_derivatives(product):
+    return bool(product.image) and product.image_derived_from == product.image.name
+
+
+def product_image_url(product, size='card', format='jpeg'):
+    """Return the image URL to show for a product in the given slot size.
+
+    Until the derivatives of an upload exist the original is served.
+    """
+    if has_derivatives(product):
+        return default_storage.url(derivative_name(product.image.name, size, format))
+    if product.image:
+        return product.image.url
+    return fallback_image_url(product.name, size, format)
+
+
+def generate_derivatives(name, storage=None):
+    """Write every size x format derivative of the stored image `name`; returns their names.
+
+    Images are cropped to fill the slot (like object-fit: cover) after
+    applying the EXIF orientation.
+    """
+    from PIL import Image, ImageOps
+
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original = original.convert('RGBA' if original.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    written = []
+    for size, dimensions in IMAGE_SIZES.items():
+        resized = ImageOps.fit(original, dimensions, Image.Resampling.LANCZOS)
+        for format, (extension, options) in DERIVATIVE_FORMATS.items():
+            image = resized
+            if format == 'jpeg' and image.mode == 'RGBA':
+                image = Image.new('RGB', image.size, 'white')
+                image.paste(resized, mask=resized.getchannel('A'))
+            buffer = BytesIO()
+            image.save(buffer, format.upper(), **options)
+            target = derivative_name(name, size, format)
+            if storage.exists(target):
+                storage.delete(target)
+            written.append(storage.save(target, ContentFile(buffer.getvalue())))
+    return written
+
+
+def mark_derived(derived):
+    """Record {product id: image name} whose derivatives were written, then refresh cached cards"""
+    from .cache import bump_catalog_version
+    from .models import Product
+
+    products = [Product(pk=pk, image_derived_from=name) for pk, name in derived.items()]
+    Product.objects.bulk_update(products, ['image_derived_from'], batch_size=1000)
+    if products:
+        bump_catalog_version()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def process_upload(product_id, name):
+    """Generate the derivatives of one upload and record them on the product"""
+    from .models import Product
+
+    try:
+        generate_derivatives(name)
+    except Exception:
+        logger.exception('Generating derivatives of %s failed', name)
+        return
+    # Only if the product still has that image; a newer upload has its own job
+    if Product.objects.filter(pk=product_id, image=name).exists():
+        mark_derived({product_id: name})
+
+
+def run_in_worker(product_id, name):
+    close_old_connections()
+    try:
+        process_upload(product_id, name)
+    except Exception:
+        logger.exception('Recording derivatives of %s failed', name)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(product_id, name):
+    """Generate derivatives for a new upload on the worker pool (inline with SHOP_IMAGE_WORKERS = 0)"""
+    global _executor
+    workers = getattr(settings, 'SHOP_IMAGE_WORKERS', 2)
+    if not workers:
+        process_upload(product_id, name)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-derivatives')
+    _executor.submit(run_in_worker, product_id, name)
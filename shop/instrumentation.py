@@ -0,0 +1,104 @@
+# shop/instrumentation.py
+import heapq
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from . import metrics
+
+SLOWEST_QUERIES_KEPT = 5
+
+_current = ContextVar('shop_request_timings', default=None)
+
+
+class RequestTimings:
+    """Per-request accumulator for query, template and engine stage timings"""
+
+    def __init__(self):
+        self.stages = {}
+        self.query_count = 0
+        self.query_time = 0.0
+        self.slowest_queries = []  # min-heap of (duration, sql)
+        self.template_depth = 0
+
+    def add(self, name, duration):
+        self.stages[name] = self.stages.get(name, 0.0) + duration
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.query_count += 1
+            self.query_time += duration
+            entry = (duration, sql)
+            if len(self.slowest_queries) < SLOWEST_QUERIES_KEPT:
+                heapq.heappush(self.slowest_queries, entry)
+            elif duration > self.slowest_queries[0][0]:
+                heapq.heapreplace(self.slowest_queries, entry)
+
+    def server_timing(self, total):
+        """Format the timings as a Server-Timing header value (durations in ms)"""
+        metrics = [f'db;dur={self.query_time * 1000:.1f};desc="{self.query_count} queries"']
+        metrics += [f'{name};dur={duration * 1000:.1f}' for name, duration in self.stages.items()]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+def activate(timings):
+    return _current.set(timings)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block of work and attribute it to `name` on the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        metrics.engine_stage_duration.observe(duration, stage=name)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, duration)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        # Only the outermost render is timed; included templates are part of it
+        timings.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_depth -= 1
+            if timings.template_depth == 0:
+                timings.add('tpl', time.perf_counter() - started)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend whose templates report render time to the current request"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -0,0 +1,255 @@
+# shop/loadtest.py
+import http.cookiejar
+import logging
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connections
+from django.test import Client
+from django.urls import reverse
+
+from . import popularity
+from .models import Category, Product
+
+# Probabilities of each optional step in a shopping session
+FLOW = {
+    'filter': 0.4,       # product_list with a category or search filter
+    'feedback': 0.3,     # like/dislike after viewing a product
+    'add_to_cart': 0.4,  # per viewed product
+    'checkout': 0.5,     # once something is in the cart
+}
+MEAN_DETAIL_VIEWS = 2.5
+SEARCH_TERMS = ['smart', 'wireless', 'shirt', 'book', 'pro', 'classic']
+LOCK_MESSAGE = 'database is locked'
+
+_request_failure = threading.local()
+
+
+def note_lock_error(sender, **kwargs):
+    """got_request_exception runs in the failing request's thread, inside its except block"""
+    exc = sys.exc_info()[1]
+    if isinstance(exc, OperationalError) and LOCK_MESSAGE in str(exc):
+        _request_failure.locked = True
+
+
+class InProcessSession:
+    """Drives the app through Django's WSGI handler in this process (no network)"""
+
+    def __init__(self, user):
+        # Any host allowed when DEBUG is on and ALLOWED_HOSTS is empty. Exceptions
+        # are not re-raised: the test client collects them through a global signal,
+        # so concurrent clients would pick up each other's errors.
+        self.client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+        self.client.force_login(user)
+        got_request_exception.connect(note_lock_error, dispatch_uid='shop.loadtest')
+
+    def request(self, method, path, data=None):
+        _request_failure.locked = False
+        response = getattr(self.client, method)(path, data or {})
+        return response.status_code, _request_failure.locked
+
+    def close(self):
+        popularity.tracker.flush()  # events still collected in this process
+        connections.close_all()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    """Drives a running server over HTTP, logging in through the login form"""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), NoRedirect(),
+        )
+        self.request('get', reverse('login'))
+        self.request('post', reverse('login'), {'username': username, 'password': password})
+
+    def csrf_token(self):
+        return next((c.value for c in self.cookies if c.name == 'csrftoken'), '')
+
+    def request(self, method, path, data=None):
+        url = self.base_url + path
+        body = None
+        headers = {'Referer': url}
+        if method == 'post':
+            body = urllib.parse.urlencode({**(data or {}), 'csrfmiddlewaretoken': self.csrf_token()}).encode()
+            headers['X-CSRFToken'] = self.csrf_token()
+        elif data:
+            url += '?' + urllib.parse.urlencode(data)
+        try:
+            with self.opener.open(urllib.request.Request(url, body, headers)) as response:
+                response.read()
+                return response.status, False
+        except urllib.error.HTTPError as exc:
+            content = exc.read()
+            return exc.code, LOCK_MESSAGE.encode() in content
+        except urllib.error.URLError:
+            return 599, False
+
+    def close(self):
+        pass
+
+
+class Recorder:
+    """Per-thread latency and error log, merged once the run is over"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock_errors = 0
+
+    def timed(self, session, endpoint, method, path, data=None):
+        started = time.perf_counter()
+        status, locked = session.request(method, path, data)
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - started)
+        if status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        self.lock_errors += locked
+        return status
+
+
+def prepare_users(count, password):
+    """Load-test users, created on first use with one shared password hash"""
+    hashed = make_password(password)
+    users = []
+    for i in range(count):
+        user, created = User.objects.get_or_create(
+            username=f'loadtest_{i}', defaults={'password': hashed},
+        )
+        users.append(user)
+    return users
+
+
+def catalog_sample():
+    """Product ids weighted by popularity, and category ids, for picking targets"""
+    rows = np.array(list(Product.objects.values_list('id', 'popularity_score')), dtype=np.float64)
+    if not len(rows):
+        raise ValueError('The catalog is empty; run populate_db or generate_dataset first')
+    weights = np.maximum(rows[:, 1], 1e-6)
+    return rows[:, 0].astype(np.int64), weights / weights.sum(), list(
+        Category.objects.values_list('id', flat=True))
+
+
+def run_session(session, recorder, rng, products, weights, categories, think_time):
+    """One visit: browse, view details, maybe give feedback, add to cart and check out"""
+    def step(endpoint, method, path, data=None):
+        status = recorder.timed(session, endpoint, method, path, data)
+        if think_time:
+            time.sleep(rng.expovariate(1 / think_time))
+        return status
+
+    step('home', 'get', reverse('home'))
+    if rng.random() < FLOW['filter']:
+        query = ({'category': rng.choice(categories)} if categories and rng.random() < 0.5
+                 else {'search': rng.choice(SEARCH_TERMS)})
+        step('product_list', 'get', reverse('product_list'), query)
+    else:
+        step('product_list', 'get', reverse('product_list'))
+
+    added = False
+    views = 1 + int(rng.expovariate(1 / (MEAN_DETAIL_VIEWS - 1)))
+    for product_id in np.random.default_rng(rng.getrandbits(32)).choice(products, views, p=weights):
+        product_id = int(product_id)
+        step('product_detail', 'get', reverse('product_detail', args=[product_id]))
+        if rng.random() < FLOW['feedback']:
+            step('product_feedback', 'post', reverse('product_feedback', args=[product_id]),
+                 {'feedback': rng.choice(['like', 'like', 'dislike'])})
+        if rng.random() < FLOW['add_to_cart']:
+            step('add_to_cart', 'get', reverse('add_to_cart', args=[product_id]))
+            added = True
+
+    if added:
+        step('cart', 'get', reverse('cart'))
+        if rng.random() < FLOW['checkout']:
+            step('checkout', 'get', reverse('checkout'))
+            step('checkout_post', 'post', reverse('checkout'))
+
+
+def summarize(recorders, elapsed, users):
+    latencies, errors, lock_errors = {}, {}, 0
+    for recorder in recorders:
+        for endpoint, values in recorder.latencies.items():
+            latencies.setdefault(endpoint, []).extend(values)
+        for endpoint, count in recorder.errors.items():
+            errors[endpoint] = errors.get(endpoint, 0) + count
+        lock_errors += recorder.lock_errors
+
+    total = sum(len(values) for values in latencies.values())
+    endpoints = {}
+    for endpoint, values in sorted(latencies.items()):
+        ms = np.array(values) * 1000
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'errors': errors.get(endpoint, 0),
+            'throughput': len(values) / elapsed,
+            'mean_ms': float(ms.mean()),
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p95_ms': float(np.percentile(ms, 95)),
+            'p99_ms': float(np.percentile(ms, 99)),
+        }
+    return {
+        'meta': {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'users': users,
+                 'seconds': elapsed},
+        'requests': total,
+        'throughput': total / elapsed if elapsed else 0.0,
+        'errors': sum(errors.values()),
+        'lock_errors': lock_errors,
+        'endpoints': endpoints,
+    }
+
+
+def run(users=10, duration=None, sessions=None, base_url=None, think_time=0.0, seed=42,
+        password='loadtest-pass-123'):
+    """Run `users` concurrent virtual users until `duration` seconds or `sessions` visits each"""
+    if duration is None and sessions is None:
+        sessions = 10
+    accounts = prepare_users(users, password)
+    products, weights, categories = catalog_sample()
+    recorders = [Recorder() for _ in accounts]
+    deadline = time.monotonic() + duration if duration else None
+
+    def virtual_user(i):
+        rng = random.Random(seed + i)
+        if base_url:
+            session = HTTPSession(base_url, accounts[i].username, password)
+        else:
+            session = InProcessSession(accounts[i])
+        try:
+            done = 0
+            while (sessions is None or done < sessions) and (deadline is None or time.monotonic() < deadline):
+                run_session(session, recorders[i], rng, products, weights, categories, think_time)
+                done += 1
+        finally:
+            session.close()
+
+    # Failed requests are counted in the report; their tracebacks would drown the output
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    if not base_url:
+        request_logger.setLevel(logging.CRITICAL)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=virtual_user, args=(i,), name=f'vu-{i}') for i in range(users)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    finally:
+        request_logger.setLevel(level)
+    return summarize(recorders, time.monotonic() - started, users)
@@ -0,0 +1,48 @@
+# shop/management/commands/benchmark_recommendations.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the recommendation engine across catalog sizes and compare against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Comma-separated catalog sizes, e.g. 1000,10000,100000,1000000')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write JSON results to this file (default: stdout)')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='Baseline JSON file to check for regressions')
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Allowed slowdown of the median before flagging (0.10 = 10%%)')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        results = benchmarks.run_suite(
+            sizes, repeat=options['repeat'], seed=options['seed'], stdout=self.stderr,
+        )
+
+        if options['output']:
+            benchmarks.save_results(results, options['output'])
+            self.stderr.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(json.dumps(results, indent=2))
+
+        for result in results['results']:
+            self.stderr.write(f"  {benchmarks.result_key(result):<60} {result['median'] * 1000:10.2f} ms")
+
+        if options['compare']:
+            baseline = benchmarks.load_results(options['compare'])
+            regressions = benchmarks.compare(results, baseline, options['threshold'])
+            if regressions:
+                for r in regressions:
+                    self.stderr.write(self.style.ERROR(
+                        f"REGRESSION {r['benchmark']}: {r['baseline'] * 1000:.2f} ms -> "
+                        f"{r['current'] * 1000:.2f} ms (+{r['change']:.0%})"
+                    ))
+                raise CommandError(f'{len(regressions)} benchmark(s) regressed beyond {options["threshold"]:.0%}')
+            self.stderr.write(self.style.SUCCESS('No regressions against baseline'))
@@ -0,0 +1,55 @@
+# shop/management/commands/build_feature_pipeline.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.feature_pipeline import FeaturePipeline, artifact_dir, fit_catalog, publish_changes
+
+
+class Command(BaseCommand):
+    help = 'Fit the recommendation feature pipeline on the current catalog and publish it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Artifact directory (default: RECOMMENDATION_ARTIFACT_DIR)')
+        parser.add_argument('--if-older-than', type=float, metavar='HOURS',
+                            help='Only refit if the saved pipeline is older than this (for cron)')
+        parser.add_argument('--refresh', action='store_true',
+                            help='Publish the catalog changes since the current generation instead of refitting')
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='With --refresh, keep publishing changes at this interval')
+
+    def handle(self, *args, **options):
+        directory = options['output'] or artifact_dir()
+        if options['refresh']:
+            return self.refresh(directory, options['every'])
+
+        if options['if_older_than'] is not None:
+            existing = FeaturePipeline.load(directory)
+            if existing is not None:
+                age_hours = (time.time() - existing.fitted_at) / 3600
+                if age_hours < options['if_older_than']:
+                    self.stdout.write(f'Pipeline is {age_hours:.1f}h old, skipping refit')
+                    return
+
+        started = time.monotonic()
+        pipeline = fit_catalog()
+        pipeline.save(directory)
+        self.stdout.write(self.style.SUCCESS(
+            f'Fitted pipeline on {len(pipeline.product_ids)} products in '
+            f'{time.monotonic() - started:.2f}s -> {directory} (generation {pipeline.generation})'
+        ))
+
+    def refresh(self, directory, every):
+        while True:
+            started = time.monotonic()
+            pipeline = publish_changes(directory)
+            if pipeline is None:
+                self.stdout.write('Published pipeline is up to date with the catalog')
+            else:
+                self.stdout.write(
+                    f'Published generation {pipeline.generation} ({len(pipeline.product_ids)} products) '
+                    f'in {time.monotonic() - started:.2f}s'
+                )
+            if not every:
+                return
+            time.sleep(every)
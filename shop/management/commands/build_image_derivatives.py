@@ -0,0 +1,77 @@
+# shop/management/commands/build_image_derivatives.py
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import F
+
+from shop.images import generate_derivatives, mark_derived
+from shop.models import Product
+
+
+def derive(name):
+    """Worker side: (name, error message or None); one bad file must not stop the backfill"""
+    try:
+        generate_derivatives(name)
+    except Exception as exc:
+        return name, f'{type(exc).__name__}: {exc}'
+    return name, None
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized JPEG/WebP copies of uploaded product images that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes resizing images in parallel')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Products recorded as done per update')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate derivatives that already exist')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            products = products.exclude(image_derived_from=F('image'))
+        pending = list(products.order_by('id').values_list('id', 'image'))
+        if not pending:
+            self.stdout.write('Every product image already has its derivatives')
+            return
+        self.stdout.write(f'Generating derivatives for {len(pending)} images...')
+
+        names = [name for _, name in pending]
+        if options['workers'] > 1:
+            connections.close_all()  # children must not inherit open connections
+            # Forked children start with Django set up; spawn (the default on
+            # macOS, and on Linux from Python 3.14) would not
+            pool = ProcessPoolExecutor(max_workers=options['workers'],
+                                       mp_context=multiprocessing.get_context('fork'))
+            results = pool.map(derive, names, chunksize=8)
+        else:
+            pool = None
+            results = map(derive, names)
+
+        done, failed = {}, 0
+        try:
+            for (product_id, _), (name, error) in zip(pending, results):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                done[product_id] = name
+                if len(done) >= options['batch_size']:
+                    mark_derived(done)
+                    done = {}
+            mark_derived(done)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {len(pending) - failed} images ({failed} failed) '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,49 @@
+# shop/management/commands/copy_interactions.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from shop.models import UserInteraction
+from shop.routers import interactions_database
+
+
+class Command(BaseCommand):
+    help = ('Copy interactions logged in the default database, before the interactions database '
+            'existed, into the interactions database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Interactions copied per query')
+        parser.add_argument('--delete', action='store_true',
+                            help='Drop the old table from the default database once everything is copied')
+
+    def handle(self, *args, **options):
+        target = interactions_database()
+        if target is None:
+            raise CommandError('No interactions database is configured (SHOP_INTERACTIONS_DATABASE)')
+        table = UserInteraction._meta.db_table
+        if table not in connections[DEFAULT_DB_ALIAS].introspection.table_names():
+            self.stdout.write('No interactions in the default database')
+            return
+
+        # Rows keep their ids, so running again (or after an interruption) skips what is there
+        source = UserInteraction.objects.using(DEFAULT_DB_ALIAS).order_by('id')
+        copied = last = 0
+        while True:
+            chunk = list(source.filter(id__gt=last)[:options['chunk_size']])
+            if not chunk:
+                break
+            timestamps = [interaction.timestamp for interaction in chunk]
+            with transaction.atomic(using=target):
+                UserInteraction.objects.using(target).bulk_create(chunk, ignore_conflicts=True)
+                # bulk_create stamps auto_now_add fields with the current time
+                for interaction, timestamp in zip(chunk, timestamps):
+                    interaction.timestamp = timestamp
+                UserInteraction.objects.using(target).bulk_update(chunk, ['timestamp'], batch_size=500)
+            copied += len(chunk)
+            last = chunk[-1].id
+        self.stdout.write(f'Copied {copied} interactions to the {target} database')
+
+        if options['delete']:
+            with connections[DEFAULT_DB_ALIAS].schema_editor() as editor:
+                editor.delete_model(UserInteraction)
+            self.stdout.write(f'Dropped {table} from the default database')
@@ -0,0 +1,49 @@
+# shop/management/commands/evaluate_recommenders.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import evaluation
+
+
+class Command(BaseCommand):
+    help = 'Replay the interaction log with a time split and score each recommendation strategy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strategies', default=','.join(evaluation.STRATEGIES),
+                            help=f"Comma-separated subset of: {', '.join(evaluation.STRATEGIES)}")
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--test-fraction', type=float, default=0.2,
+                            help='Share of the most recent events held out for testing')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes evaluating user shards in parallel')
+        parser.add_argument('--max-users', type=int, help='Evaluate a seeded sample of test users')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the JSON report to this file (default: stdout)')
+
+    def handle(self, *args, **options):
+        names = [name for name in options['strategies'].split(',') if name]
+        unknown = set(names) - set(evaluation.STRATEGIES)
+        if unknown:
+            raise CommandError(f"Unknown strategies: {', '.join(sorted(unknown))}")
+
+        report = evaluation.evaluate(
+            names, test_fraction=options['test_fraction'], k=options['k'],
+            workers=options['workers'], max_users=options['max_users'], seed=options['seed'],
+            stdout=self.stderr,
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        k = options['k']
+        for name, result in report['strategies'].items():
+            self.stderr.write(
+                f"  {name:<12} P@{k} {result[f'precision@{k}']:.4f}  R@{k} {result[f'recall@{k}']:.4f}  "
+                f"NDCG@{k} {result[f'ndcg@{k}']:.4f}  coverage {result['coverage']:.3f}  "
+                f"{result['latency_ms']['mean']:.2f} ms/user"
+            )
@@ -0,0 +1,27 @@
+# shop/management/commands/export_catalog.py
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import CHUNK_SIZE, detect_format, export_rows, open_text, write_rows
+
+
+class Command(BaseCommand):
+    help = ('Stream the catalog to CSV or JSON Lines (optionally gzipped, - for stdout); '
+            'products without a SKU are listed as SHOP-<id>, which importing the file assigns to them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Output format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            format = detect_format(path, options['format'])
+            with open_text(path, 'w') as stream:
+                count = write_rows(stream, format, export_rows(options['chunk_size']))
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(f'Exported {count} products to {path}'))
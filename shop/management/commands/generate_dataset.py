@@ -0,0 +1,244 @@
+# shop/management/commands/generate_dataset.py
+import datetime
+import time
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from django.utils import timezone
+
+from shop.cache import bump_catalog_version
+from shop.models import Category, Product, UserInteraction
+
+ADJECTIVES = [
+    'Classic', 'Premium', 'Portable', 'Wireless', 'Smart', 'Compact', 'Deluxe', 'Eco',
+    'Ultra', 'Pro', 'Lightweight', 'Durable', 'Vintage', 'Modern', 'Ergonomic', 'Organic',
+]
+NOUNS = [
+    'Headphones', 'Speaker', 'Watch', 'Shirt', 'Jeans', 'Shoes', 'Backpack', 'Laptop Stand',
+    'Book', 'Blender', 'Bottle', 'Yoga Mat', 'Dumbbells', 'Coffee Maker', 'Lamp', 'Jacket',
+    'Keyboard', 'Mouse', 'Kettle', 'Notebook', 'Helmet', 'Tent', 'Camera', 'Charger',
+]
+DESCRIPTION_WORDS = [
+    'battery', 'cotton', 'steel', 'waterproof', 'fitness', 'kitchen', 'travel', 'office',
+    'outdoor', 'bluetooth', 'leather', 'bamboo', 'ceramic', 'wireless', 'fast', 'quiet',
+    'comfortable', 'adjustable', 'rechargeable', 'foldable', 'warm', 'breathable', 'gift',
+    'premium', 'classic', 'durable', 'compact', 'portable', 'programmable', 'nonstick',
+]
+INTERACTION_TYPES = np.array(['view', 'cart', 'purchase', 'like', 'dislike'])
+INTERACTION_PROBS = [0.78, 0.12, 0.05, 0.04, 0.01]
+# Mean seconds between two events of a session
+EVENT_GAP_SECONDS = 45.0
+
+
+def zipf_weights(n, alpha, rng):
+    """Power-law weights over n items, shuffled so popularity is not tied to id order"""
+    weights = 1.0 / np.arange(1, n + 1) ** alpha
+    rng.shuffle(weights)
+    return weights
+
+
+def chunked(total, chunk_size):
+    """Yield (start, size) pairs covering range(total)"""
+    for start in range(0, total, chunk_size):
+        yield start, min(chunk_size, total - start)
+
+
+class Command(BaseCommand):
+    help = 'Generate a large deterministic synthetic dataset (products, users, interactions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--interactions', type=int, default=50_000_000)
+        parser.add_argument('--chunk-size', type=int, default=10_000)
+        parser.add_argument('--alpha', type=float, default=1.1,
+                            help='Power-law exponent of product popularity')
+        parser.add_argument('--session-length', type=float, default=8.0,
+                            help='Mean number of interactions per session')
+        parser.add_argument('--days', type=float, default=90.0,
+                            help='Interactions are spread over this many days before --end')
+        parser.add_argument('--end', default=None,
+                            help='ISO date/time of the last interactions (default: now); '
+                                 'with --seed, the same --end gives the same timestamps')
+        parser.add_argument('--prefix', default='synth',
+                            help='Prefix for generated category names and usernames')
+        parser.add_argument('--password', default='shopai123',
+                            help='Password set on every generated user')
+
+    def handle(self, *args, **options):
+        self.rng = np.random.default_rng(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.prefix = options['prefix']
+        try:
+            end = datetime.datetime.fromisoformat(options['end']) if options['end'] else timezone.now()
+        except ValueError:
+            raise CommandError(f"--end is not an ISO date/time: {options['end']!r}")
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end, datetime.timezone.utc)
+        self.period = (end.timestamp() - options['days'] * 86400, end.timestamp())
+        started = time.monotonic()
+
+        category_ids = self.create_categories(options['categories'])
+        product_ids, product_categories, product_weights = self.create_products(
+            options['products'], category_ids, options['alpha']
+        )
+        # bulk_create bypasses the post_save signal that invalidates catalog caches
+        bump_catalog_version()
+        user_ids = self.create_users(options['users'], options['password'])
+        self.create_interactions(
+            options['interactions'], user_ids, product_ids, product_categories,
+            product_weights, options['session_length'],
+        )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Dataset generated in {elapsed:.1f}s'))
+
+    def create_categories(self, count):
+        self.stdout.write(f'Creating {count} categories...')
+        categories = [
+            Category(name=f'{self.prefix} {noun} {i}', description=f'Synthetic {noun.lower()} category')
+            for i, noun in enumerate(self.rng.choice(NOUNS, size=count))
+        ]
+        with transaction.atomic():
+            created = Category.objects.bulk_create(categories)
+        return np.array([c.id for c in created], dtype=np.int64)
+
+    def create_products(self, count, category_ids, alpha):
+        self.stdout.write(f'Creating {count} products...')
+        weights = zipf_weights(count, alpha, self.rng)
+        # Popularity feature on a log scale so the long tail is not all zeros
+        popularity = np.log1p(weights / weights.min()) / np.log1p(weights.max() / weights.min())
+        categories = self.rng.choice(category_ids, size=count)
+        last_id = Product.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        for start, size in chunked(count, self.chunk_size):
+            rng = self.rng
+            names = zip(rng.choice(ADJECTIVES, size=size).tolist(), rng.choice(NOUNS, size=size).tolist())
+            descriptions = rng.choice(DESCRIPTION_WORDS, size=(size, 8)).tolist()
+            prices = np.round(rng.lognormal(mean=7.3, sigma=0.8, size=size), 2).tolist()
+            chunk_popularity = popularity[start:start + size]
+            ratings = np.round(np.clip(rng.normal(3.2 + chunk_popularity, 0.6), 1.0, 5.0), 1).tolist()
+            stock = rng.integers(0, 500, size=size).tolist()
+            chunk_categories = categories[start:start + size].tolist()
+            chunk_popularity = chunk_popularity.tolist()
+
+            products = [
+                Product(
+                    name=f'{adjective} {noun} {start + i}',
+                    description=' '.join(descriptions[i]),
+                    price=prices[i],
+                    category_id=chunk_categories[i],
+                    stock=stock[i],
+                    popularity_score=chunk_popularity[i],
+                    rating=ratings[i],
+                )
+                for i, (adjective, noun) in enumerate(names)
+            ]
+            with transaction.atomic():
+                Product.objects.bulk_create(products, batch_size=self.chunk_size)
+            self.progress('products', start + size, count)
+
+        rows = np.array(
+            Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'category_id'),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        return rows[:, 0], rows[:, 1], weights[:len(rows)]
+
+    def create_users(self, count, password):
+        self.stdout.write(f'Creating {count} users...')
+        # Hashing is deliberately slow, so every generated user shares one hash
+        password_hash = make_password(password)
+        last_id = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        for start, size in chunked(count, self.chunk_size):
+            users = [
+                User(username=f'{self.prefix}_user_{start + i}', password=password_hash)
+                for i in range(size)
+            ]
+            with transaction.atomic():
+                User.objects.bulk_create(users, batch_size=self.chunk_size)
+            self.progress('users', start + size, count)
+
+        return np.array(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True),
+            dtype=np.int64,
+        )
+
+    def create_interactions(self, count, user_ids, product_ids, product_categories,
+                            product_weights, session_length):
+        self.stdout.write(f'Creating {count} interactions...')
+        if count == 0 or len(user_ids) == 0 or len(product_ids) == 0:
+            return
+
+        # Inverse-CDF tables: global popularity and popularity within each category
+        global_cdf = np.cumsum(product_weights) / product_weights.sum()
+        by_category = {}
+        for category_id in np.unique(product_categories):
+            members = np.flatnonzero(product_categories == category_id)
+            weights = product_weights[members]
+            by_category[category_id] = (members, np.cumsum(weights) / weights.sum())
+        session_categories = np.array(list(by_category))
+
+        # A few heavy users produce most sessions
+        user_cdf = np.cumsum(zipf_weights(len(user_ids), 1.0, self.rng))
+        user_cdf /= user_cdf[-1]
+
+        first, last = self.period
+        written = 0
+        while written < count:
+            size = min(self.chunk_size, count - written)
+            rng = self.rng
+
+            # Split the chunk into sessions; each session has one user and a focus category
+            lengths = rng.geometric(1.0 / session_length, size=size)
+            lengths = lengths[:np.searchsorted(np.cumsum(lengths), size) + 1]
+            lengths[-1] -= lengths.sum() - size
+            session_users = user_ids[np.searchsorted(user_cdf, rng.random(len(lengths)))]
+            session_focus = rng.choice(session_categories, size=len(lengths))
+            users = np.repeat(session_users, lengths)
+            focus = np.repeat(session_focus, lengths)
+
+            # 70% of events stay in the session's category, the rest browse globally
+            rows = np.searchsorted(global_cdf, rng.random(size))
+            in_focus = rng.random(size) < 0.7
+            for category_id in session_categories:
+                mask = in_focus & (focus == category_id)
+                if mask.any():
+                    members, cdf = by_category[category_id]
+                    rows[mask] = members[np.searchsorted(cdf, rng.random(mask.sum()))]
+            rows = np.minimum(rows, len(product_ids) - 1)
+            types = rng.choice(INTERACTION_TYPES, size=size, p=INTERACTION_PROBS)
+
+            # Sessions start evenly over the period, in generation order, and their
+            # events follow each other a random gap apart
+            session_first = np.repeat(np.cumsum(lengths) - lengths, lengths)
+            elapsed = np.cumsum(rng.exponential(EVENT_GAP_SECONDS, size=size))
+            seconds = (first + (last - first) * (written + session_first) / count
+                       + elapsed - elapsed[session_first])
+            # Ids follow time, as with live traffic (the admin's date drill-down relies on it)
+            order = np.argsort(seconds, kind='stable')
+            seconds = np.minimum(seconds[order], last)
+
+            interactions = [
+                UserInteraction(user_id=u, product_id=p, interaction_type=t)
+                for u, p, t in zip(users[order].tolist(), product_ids[rows[order]].tolist(),
+                                   types[order].tolist())
+            ]
+            alias = router.db_for_write(UserInteraction)
+            with transaction.atomic(using=alias):
+                UserInteraction.objects.using(alias).bulk_create(interactions, batch_size=self.chunk_size)
+                # bulk_create stamps auto_now_add fields with the current time
+                for interaction, second in zip(interactions, seconds.tolist()):
+                    interaction.timestamp = datetime.datetime.fromtimestamp(second, datetime.timezone.utc)
+                UserInteraction.objects.using(alias).bulk_update(interactions, ['timestamp'], batch_size=500)
+            written += size
+            self.progress('interactions', written, count)
+
+    def progress(self, label, done, total):
+        if done == total or done % (self.chunk_size * 20) == 0:
+            self.stdout.write(f'  {label}: {done}/{total}')
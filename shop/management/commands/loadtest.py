@@ -0,0 +1,47 @@
+# shop/management/commands/loadtest.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Simulate concurrent shopping sessions and report latency percentiles per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users')
+        parser.add_argument('--duration', type=float, help='Run for this many seconds')
+        parser.add_argument('--sessions', type=int,
+                            help='Shopping sessions per user (default 10 when --duration is not given)')
+        parser.add_argument('--url', help='Base URL of a running server (default: in-process WSGI handler)')
+        parser.add_argument('--think-time', type=float, default=0.0,
+                            help='Mean pause between requests, in seconds')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        try:
+            report = loadtest.run(
+                users=options['users'], duration=options['duration'], sessions=options['sessions'],
+                base_url=options['url'], think_time=options['think_time'], seed=options['seed'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'endpoint':<18} {'reqs':>6} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for endpoint, stats in report['endpoints'].items():
+            self.stdout.write(
+                f"{endpoint:<18} {stats['requests']:>6} {stats['errors']:>5} "
+                f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}"
+            )
+        style = self.style.ERROR if report['lock_errors'] or report['errors'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{report['requests']} requests in {report['meta']['seconds']:.1f}s "
+            f"({report['throughput']:.1f} req/s), {report['errors']} errors, "
+            f"{report['lock_errors']} database-locked"
+        ))
@@ -0,0 +1,34 @@
+# shop/management/commands/mine_associations.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.associations import count_cooccurrences, rank_associations, store_associations
+
+
+class Command(BaseCommand):
+    help = 'Mine "frequently bought together" product pairs from order baskets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10_000,
+                            help='Orders per counting chunk')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes counting chunks in parallel')
+        parser.add_argument('--min-support', type=float, default=0.001,
+                            help='Minimum share of all orders containing the pair')
+        parser.add_argument('--min-lift', type=float, default=1.0)
+        parser.add_argument('--top-k', type=int, default=10,
+                            help='Associations kept per product')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        counts, orders = count_cooccurrences(options['chunk_size'], options['workers'])
+        counted = time.monotonic()
+        ranked = rank_associations(
+            counts, orders, options['min_support'], options['min_lift'], options['top_k'],
+        )
+        stored = store_associations(ranked)
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {stored} associations from {orders} orders '
+            f'(counting {counted - started:.2f}s, total {time.monotonic() - started:.2f}s)'
+        ))
@@ -0,0 +1,28 @@
+# shop/management/commands/refresh_popularity.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.popularity import refresh_scores
+
+
+class Command(BaseCommand):
+    help = 'Recompute every product\'s popularity_score from the time-decayed view/cart/purchase counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep refreshing at this interval instead of running once (or use cron)')
+        parser.add_argument('--min-change', type=float, default=0.005,
+                            help='Scores that moved less than this are not rewritten')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            updated, pruned = refresh_scores(min_change=options['min_change'])
+            self.stdout.write(
+                f'Updated {updated} popularity scores, pruned {pruned} faded counters '
+                f'in {time.monotonic() - started:.2f}s'
+            )
+            if not options['every']:
+                return
+            time.sleep(options['every'])
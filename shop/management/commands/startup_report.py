@@ -0,0 +1,30 @@
+# shop/management/commands/startup_report.py
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.engine import import_costs, profile_startup
+
+HEAVY_PACKAGES = ['numpy', 'scipy', 'sklearn', 'PIL']
+
+
+class Command(BaseCommand):
+    help = 'Break down the import time of a fresh process (django.setup() plus the URLconf) by package'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prewarm', action='store_true',
+                            help='Also import the recommendation stack, as SHOP_PREWARM_ENGINE does')
+        parser.add_argument('--top', type=int, default=15, help='Packages listed')
+
+    def handle(self, *args, **options):
+        try:
+            costs = import_costs(profile_startup(options['prewarm']))
+        except RuntimeError as exc:
+            raise CommandError(f'Startup failed: {exc}')
+        total = sum(own for own, _ in costs.values())
+
+        self.stdout.write(f'{"package":<28} {"modules":>8} {"ms":>9} {"share":>7}')
+        ranked = sorted(costs.items(), key=lambda item: -item[1][0])
+        for package, (own, modules) in ranked[:options['top']]:
+            self.stdout.write(f'{package:<28} {modules:>8} {own / 1000:>9.1f} {own / max(total, 1):>7.1%}')
+        self.stdout.write(f'{"total":<28} {sum(m for _, m in costs.values()):>8} {total / 1000:>9.1f}')
+        loaded = [package for package in HEAVY_PACKAGES if package in costs]
+        self.stdout.write(f'Heavy packages imported at startup: {", ".join(loaded) or "none"}')
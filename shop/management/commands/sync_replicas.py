@@ -0,0 +1,48 @@
+# shop/management/commands/sync_replicas.py
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.cache import get_catalog_version
+from shop.routers import mark_replica_synced, read_replicas
+
+
+def copy_database(source, target):
+    """Online copy with SQLite's backup API: consistent while the primary takes writes,
+    and connections already open on the replica see the new contents"""
+    with sqlite3.connect(source) as primary, sqlite3.connect(target) as replica:
+        primary.backup(replica)
+    primary.close()
+    replica.close()
+
+
+class Command(BaseCommand):
+    help = 'Refresh the local SQLite read replicas (SHOP_READ_REPLICAS) from the primary database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep copying at this interval, simulating replication lag')
+
+    def handle(self, *args, **options):
+        replicas = read_replicas()
+        if not replicas:
+            raise CommandError('No read replicas configured; set SHOP_READ_REPLICAS=N')
+        databases = [settings.DATABASES[alias] for alias in ['default', *replicas]]
+        if any(database['ENGINE'] != 'django.db.backends.sqlite3' for database in databases):
+            raise CommandError('Only SQLite replicas are copied here; other backends replicate themselves')
+
+        while True:
+            started = time.monotonic()
+            for alias in replicas:
+                # Read before copying: the copy holds every change committed up to this version
+                version = get_catalog_version()
+                copy_database(settings.DATABASES['default']['NAME'], settings.DATABASES[alias]['NAME'])
+                mark_replica_synced(alias, version)
+            self.stdout.write(
+                f'Copied primary to {", ".join(replicas)} in {time.monotonic() - started:.2f}s'
+            )
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,31 @@
+# shop/management/commands/update_sales_rollups.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.analytics import CHUNK_SIZE, LAG_SECONDS, reset_rollups, update_rollups
+
+
+class Command(BaseCommand):
+    help = 'Add orders placed since the last run to the daily product and category sales rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Orders merged per transaction')
+        parser.add_argument('--lag', type=float, default=LAG_SECONDS, metavar='SECONDS',
+                            help='Leave orders younger than this for the next run')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Empty the rollups first and recount every order')
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep updating at this interval instead of running once (or use cron)')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            reset_rollups()
+        while True:
+            started = time.monotonic()
+            counted = update_rollups(chunk_size=options['chunk_size'], lag=options['lag'])
+            self.stdout.write(f'Rolled up {counted} orders in {time.monotonic() - started:.2f}s')
+            if not options['every']:
+                return
+            time.sleep(options['every'])
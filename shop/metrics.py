@@ -0,0 +1,300 @@
+# shop/metrics.py
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = None  # set by Registry.register()
+        self._shards = []  # (thread, shard) of every live thread that updated the metric
+        self._retired = {}  # samples of threads that have exited
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                # Fold the shards of exited threads in, so short-lived threads do not pile up
+                live = []
+                for thread, other in self._shards:
+                    if thread.is_alive():
+                        live.append((thread, other))
+                    else:
+                        self._add(self._retired, other)
+                self._shards = live + [(threading.current_thread(), shard)]
+        return shard
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _touched(self):
+        if self.registry is not None:
+            self.registry.touched()
+
+    def _add(self, totals, shard):
+        """Add the samples of a shard to totals"""
+        raise NotImplementedError
+
+    def collect(self):
+        """Return {label values: value} merged over every thread shard"""
+        totals = {}
+        with self._shards_lock:
+            self._add(totals, self._retired)
+            for thread, shard in self._shards:
+                self._add(totals, shard)
+        return totals
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+        self._touched()
+
+    def _add(self, totals, shard):
+        for key, value in list(shard.items()):
+            totals[key] = totals.get(key, 0) + value
+
+
+class Gauge(Metric):
+    """Last-written value; merged across processes with `multiprocess_mode` ('max' or 'sum')"""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), multiprocess_mode='max'):
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+        self._values = {}
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+        self._touched()
+
+    def collect(self):
+        return dict(self._values)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # bucket counts (non-cumulative), then sum, then count
+            state = shard[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+        self._touched()
+
+    def _add(self, totals, shard):
+        for key, state in list(shard.items()):
+            total = totals.setdefault(key, [0] * len(state))
+            for i, value in enumerate(state):
+                total[i] += value
+
+
+class Registry:
+    """In-process metrics, rendered at /metrics in the Prometheus text format.
+
+    Updates go to a per-thread shard so the hot path never takes a lock; the
+    shards are only summed on collection. When SHOP_METRICS_DIR is set, each
+    process also writes a snapshot of its samples there and render() merges
+    the snapshots of every running worker process; snapshots left by exited
+    workers are deleted, which Prometheus sees as a counter reset.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._last_flush = 0.0
+        self._flush_lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        metric.registry = self
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), multiprocess_mode='max'):
+        return self.register(Gauge(name, documentation, labelnames, multiprocess_mode))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        return {
+            name: [[list(key), value] for key, value in metric.collect().items()]
+            for name, metric in self.metrics.items()
+        }
+
+    # Multi-process support
+
+    def directory(self):
+        return getattr(settings, 'SHOP_METRICS_DIR', None)
+
+    def touched(self):
+        """Called on every update; writes this process' snapshot at most every flush interval"""
+        directory = self.directory()
+        if not directory:
+            return
+        interval = getattr(settings, 'SHOP_METRICS_FLUSH_INTERVAL', 5)
+        now = time.monotonic()
+        if now - self._last_flush >= interval and self._flush_lock.acquire(blocking=False):
+            try:
+                self._last_flush = now
+                self.flush(directory)
+            finally:
+                self._flush_lock.release()
+
+    def flush(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def merged_snapshots(self):
+        """Samples of this process, merged with other processes' snapshots if configured"""
+        directory = self.directory()
+        if not directory:
+            return [self.snapshot()]
+        with self._flush_lock:
+            self.flush(directory)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            path = os.path.join(directory, filename)
+            pid = filename[len('metrics-'):-len('.json')]
+            if pid.isdigit() and not process_running(int(pid)):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # snapshot being replaced or removed
+        return snapshots
+
+    def merge(self, snapshots):
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                values = merged[name]
+                for key, value in samples:
+                    key = tuple(key)
+                    if key not in values:
+                        values[key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(metric, Histogram):
+                        values[key] = [a + b for a, b in zip(values[key], value)]
+                    elif isinstance(metric, Gauge) and metric.multiprocess_mode == 'max':
+                        values[key] = max(values[key], value)
+                    else:
+                        values[key] += value
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        merged = self.merge(self.merged_snapshots())
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(merged[name].items()):
+                labels = dict(zip(metric.labelnames, key))
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets, value):
+                        cumulative += count
+                        le = '+Inf' if bound == math.inf else repr(bound)
+                        lines.append(f'{name}_bucket{format_labels({**labels, "le": le})} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {value[-2]}')
+                    lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+                else:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def process_running(pid):
+    """Whether a process with this id exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+_registry = Registry()
+registry = _registry
+
+http_requests = registry.counter(
+    'shop_http_requests_total', 'HTTP requests by view, method and status',
+    ['view', 'method', 'status'],
+)
+http_request_duration = registry.histogram(
+    'shop_http_request_duration_seconds', 'HTTP request latency by view', ['view'],
+)
+db_queries = registry.counter(
+    'shop_db_queries_total', 'SQL queries executed while serving requests', ['view'],
+)
+interaction_writes = registry.counter(
+    'shop_interactions_total', 'UserInteraction rows written by type', ['type'],
+)
+checkouts = registry.counter(
+    'shop_checkouts_total', 'Checkout attempts by outcome', ['outcome'],
+)
+cache_requests = registry.counter(
+    'shop_cache_requests_total', 'Page and fragment cache lookups (hit ratio = hit / total)',
+    ['cache', 'result'],
+)
+engine_stage_duration = registry.histogram(
+    'shop_engine_stage_seconds', 'Recommendation engine stage latency', ['stage'],
+)
+engine_catalog_size = registry.gauge(
+    'shop_engine_catalog_size', 'Products scored by the last recommendation engine run',
+)
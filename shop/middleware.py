@@ -0,0 +1,86 @@
+# shop/middleware.py
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import instrumentation, metrics, routers
+
+logger = logging.getLogger('shop.performance')
+
+
+class PerformanceMiddleware:
+    """Record SQL, template and recommendation timings for each request.
+
+    The timings are returned in a Server-Timing header, and requests slower
+    than SHOP_SLOW_REQUEST_MS are logged together with their slowest queries.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_request_ms = getattr(settings, 'SHOP_SLOW_REQUEST_MS', 500)
+
+    def __call__(self, request):
+        timings = instrumentation.RequestTimings()
+        token = instrumentation.activate(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.record_query))
+                response = self.get_response(request)
+        finally:
+            instrumentation.deactivate(token)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = timings.server_timing(total)
+        view = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+        metrics.http_requests.inc(view=view, method=request.method, status=response.status_code)
+        metrics.http_request_duration.observe(total, view=view)
+        metrics.db_queries.inc(timings.query_count, view=view)
+        if total * 1000 >= self.slow_request_ms:
+            self.log_slow_request(request, timings, total)
+        return response
+
+    def log_slow_request(self, request, timings, total):
+        queries = '\n'.join(
+            f'    {duration * 1000:8.1f} ms  {sql[:300]}'
+            for duration, sql in sorted(timings.slowest_queries, reverse=True)
+        )
+        logger.warning(
+            'Slow request %s %s: %.1f ms (%d queries, %.1f ms in SQL)\n%s',
+            request.method, request.get_full_path(), total * 1000,
+            timings.query_count, timings.query_time * 1000, queries,
+        )
+
+
+class ReplicaMiddleware:
+    """Let the request read the catalog from replicas unless its session wrote recently.
+
+    Must come after SessionMiddleware. Only GET and HEAD requests use
+    replicas; a request that writes pins its session to the primary for
+    SHOP_REPLICA_STICKY_SECONDS.
+    """
+    session_key = '_shop_primary_until'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'SHOP_REPLICA_STICKY_SECONDS', 5)
+
+    def __call__(self, request):
+        if not routers.read_replicas():
+            return self.get_response(request)
+        pinned = (request.method not in ('GET', 'HEAD')
+                  or request.session.get(self.session_key, 0) > time.time())
+        state = routers.ReplicaRouting(pinned)
+        token = routers.activate(state)
+        try:
+            with connections[DEFAULT_DB_ALIAS].execute_wrapper(state.watch):
+                response = self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        if state.wrote:
+            request.session[self.session_key] = time.time() + self.sticky_seconds
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-19 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_derived_from',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
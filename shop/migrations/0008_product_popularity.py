@@ -0,0 +1,22 @@
+# Generated by Django 5.0 on 2026-10-19 09:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='shop.product')),
+                ('score', models.FloatField(default=0.0)),
+                ('updated_at', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+
+
+def assign_missing_skus(apps, schema_editor):
+    # Same SKUs as shop.catalog_io.assign_missing_skus(), so the existing catalog can be exported and re-imported
+    Product = apps.get_model('shop', 'Product')
+    Product.objects.using(schema_editor.connection.alias).filter(sku__isnull=True).update(
+        sku=Concat(Value('SHOP-'), Cast('id', CharField())),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_missing_skus, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+import django.db.models.deletion
+from django.db import DEFAULT_DB_ALIAS, connections, migrations, models
+
+
+def move_counters(apps, schema_editor):
+    # The counters follow the interaction log (shop.routers): their table is recreated
+    # without the foreign key constraint, with the counters it held, and the old one
+    # dropped, or its constraint would keep products from being deleted
+    ProductPopularity = apps.get_model('shop', 'ProductPopularity')
+    table = ProductPopularity._meta.db_table
+    connection = schema_editor.connection
+    source = connection if table in connection.introspection.table_names() else connections[DEFAULT_DB_ALIAS]
+    counters = []
+    if table in source.introspection.table_names():
+        with source.cursor() as cursor:
+            cursor.execute(f'SELECT product_id, score, updated_at FROM {source.ops.quote_name(table)}')
+            counters = cursor.fetchall()
+        if source is connection:
+            schema_editor.delete_model(ProductPopularity)
+        else:
+            with source.schema_editor() as editor:
+                editor.delete_model(ProductPopularity)
+    schema_editor.create_model(ProductPopularity)
+    ProductPopularity.objects.using(connection.alias).bulk_create([
+        ProductPopularity(product_id=product_id, score=score, updated_at=updated_at)
+        for product_id, score, updated_at in counters
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='productpopularity',
+                name='product',
+                field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='popularity', serialize=False, to='shop.product'),
+            ),
+        ]),
+        migrations.RunPython(move_counters, migrations.RunPython.noop, hints={'model_name': 'productpopularity'}),
+    ]
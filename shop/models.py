@@ -1,5 +1,6 @@
 # shop/models.py
 from django.db import models
+from django.db.models import DecimalField, F, Sum
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 
@@ -14,13 +15,19 @@ class Category(models.Model):
         return self.name
 
 class Product(models.Model):
+    # Supplier stock-keeping unit; the key catalog imports upsert on
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Name of the image whose resized copies (shop.images) exist
+    image_derived_from = models.CharField(max_length=100, blank=True, editable=False)
     stock = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bulk writers set it explicitly; the feature pipeline re-reads only rows saved since its last read
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     # Features for recommendation (normalized 0-1)
     popularity_score = models.FloatField(default=0.5)
@@ -37,7 +44,10 @@ class Cart(models.Model):
         return f"Cart - {self.user.username}"
     
     def get_total(self):
-        return sum(item.get_subtotal() for item in self.items.all())
+        total = self.items.aggregate(
+            total=Sum(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        )['total']
+        return total or 0
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -63,6 +73,12 @@ class Order(models.Model):
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_at_idx'),
+        ]
+    
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
@@ -84,13 +100,97 @@ class UserInteraction(models.Model):
         ('dislike', 'Dislike'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Stored in the interactions database (shop.routers), so no constraints
+    # across files; shop.signals deletes the rows with their user or product
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False)
     interaction_type = models.CharField(max_length=20, choices=INTERACTION_TYPES)
     timestamp = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        ordering = ['-timestamp']
+        # No default ordering: a sort on every query of a table this size is not free
+        indexes = [
+            models.Index(fields=['timestamp'], name='interaction_timestamp_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} - {self.interaction_type} - {self.product.name}"
\ No newline at end of file
+        return f"{self.user.username} - {self.interaction_type} - {self.product.name}"
+
+class ProductAssociation(models.Model):
+    """'Frequently bought together' pair mined offline from order baskets"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='associations')
+    associated = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    support = models.FloatField()
+    confidence = models.FloatField()
+    lift = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_association_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.associated_id} (lift {self.lift:.2f})"
+
+class ProductPopularity(models.Model):
+    """Exponentially decayed, weighted count of a product's views, carts and purchases.
+
+    The value is `score` as of `updated_at` (Unix time); shop.popularity
+    decays it on every write and derives Product.popularity_score from it.
+    Written by page views, so kept in the interactions database with the
+    rest of the traffic (shop.routers); shop.signals deletes it with its product.
+    """
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, db_constraint=False,
+                                   primary_key=True, related_name='popularity')
+    score = models.FloatField(default=0.0)
+    updated_at = models.FloatField()
+
+    def __str__(self):
+        return f"{self.product_id}: {self.score:.2f}"
+
+class DailyProductSales(models.Model):
+    """Orders, units and revenue of one product on one day, rolled up by shop.analytics"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_daily_product_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.product_id}: {self.units} units"
+
+class DailyCategorySales(models.Model):
+    """Orders, units and revenue of one category on one day, rolled up by shop.analytics.
+
+    Kept separately rather than summed from the product rows because an
+    order with two products of a category counts once here.
+    """
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='unique_daily_category_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.category_id}: {self.units} units"
+
+class RollupState(models.Model):
+    """High-water mark of a rollup: orders up to last_order_id are counted"""
+    name = models.CharField(max_length=50, primary_key=True)
+    last_order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.name}: order {self.last_order_id}"
@@ -0,0 +1,260 @@
+# shop/neighbours.py
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from . import feature_pipeline
+from .instrumentation import stage
+
+logger = logging.getLogger('shop.neighbours')
+
+NEIGHBOURS_KEPT = 20
+# Beyond this share of changed products, a full build is cheaper than patching
+MAX_PATCHED_FRACTION = 0.05
+
+
+def top_k(similarities, candidate_ids, k):
+    """Best k (ids, scores) per row of a dense similarity block, sorted descending.
+
+    Missing slots are padded with id -1 and score -inf.
+    """
+    rows, columns = similarities.shape
+    ids = np.full((rows, k), -1, dtype=np.int64)
+    scores = np.full((rows, k), -np.inf, dtype=np.float32)
+    kept = min(k, columns)
+    if kept == 0:
+        return ids, scores
+    partition = np.argpartition(-similarities, kept - 1, axis=1)[:, :kept]
+    partition_scores = np.take_along_axis(similarities, partition, axis=1)
+    order = np.argsort(-partition_scores, axis=1, kind='stable')
+    best = np.take_along_axis(partition, order, axis=1)
+    scores[:, :kept] = np.take_along_axis(partition_scores, order, axis=1)
+    ids[:, :kept] = candidate_ids[best]
+    ids[~np.isfinite(scores)] = -1
+    return ids, scores
+
+
+class NeighbourIndex:
+    """Top-K most similar products for every product, patched when a few products change.
+
+    The initial build is O(N^2) over similarity blocks; afterwards a changed
+    or added product costs one sparse product against the catalog, O(N),
+    plus a re-sort of the neighbour lists it enters or leaves. Updates build
+    a new index object, so readers never see a half-patched list.
+    """
+
+    def __init__(self, product_ids, neighbours, scores, pipeline):
+        self.product_ids = product_ids
+        self.neighbours = neighbours
+        self.scores = scores
+        self.pipeline = pipeline
+
+    @classmethod
+    def build(cls, pipeline, k=NEIGHBOURS_KEPT):
+        product_ids = np.asarray(pipeline.product_ids, dtype=np.int64)
+        neighbours = np.full((len(product_ids), k), -1, dtype=np.int64)
+        scores = np.full((len(product_ids), k), -np.inf, dtype=np.float32)
+        with stage('rec-neighbours'):
+            for rows, block in pipeline.similarity_blocks():
+                block[np.arange(len(rows)), rows] = -np.inf  # a product is not its own neighbour
+                neighbours[rows], scores[rows] = top_k(block, product_ids, k)
+        return cls(product_ids, neighbours, scores, pipeline)
+
+    @property
+    def k(self):
+        return self.neighbours.shape[1]
+
+    def row_of(self, product_id):
+        row = np.searchsorted(self.product_ids, product_id)
+        if row < len(self.product_ids) and self.product_ids[row] == product_id:
+            return int(row)
+        return None
+
+    def neighbours_of(self, product_id, count):
+        row = self.row_of(product_id)
+        if row is None:
+            return []
+        return [int(pid) for pid in self.neighbours[row, :count] if pid >= 0]
+
+    def scored_neighbours(self, product_id):
+        """(ids, scores) of a product's neighbour list, best first"""
+        row = self.row_of(product_id)
+        if row is None:
+            # Not indexed yet (the index is catching up with the catalog) or already removed
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        listed = self.neighbours[row] >= 0
+        return self.neighbours[row][listed], self.scores[row][listed]
+
+    def similarities(self, vectors):
+        """Dense similarity of vectors to every indexed product"""
+        rows = self.pipeline.rows_of(self.product_ids)
+        return (vectors @ self.pipeline.matrix[rows].T).toarray()
+
+    def apply(self, pipeline, upsert_ids, deleted_ids):
+        """A new index for `pipeline`, with the rows of upsert_ids and deleted_ids patched in.
+
+        Every other product must have the same row in `pipeline` as in the
+        pipeline this index was built for (see changed_products()).
+        """
+        upsert_ids = np.asarray(upsert_ids, dtype=np.int64)
+        deleted = np.asarray(deleted_ids, dtype=np.int64)
+
+        # Drop deleted products and every list entry pointing at a changed
+        # product; changed products re-enter below with their new similarity
+        keep = ~np.isin(self.product_ids, deleted)
+        product_ids = self.product_ids[keep]
+        neighbours = self.neighbours[keep]
+        scores = self.scores[keep]
+        # Every product outside a full list scored at most its last entry
+        boundary = scores[:, -1].copy()
+        removed = np.isin(neighbours, np.concatenate([deleted, upsert_ids]))
+        neighbours[removed] = -1
+        scores[removed] = -np.inf
+        holed = removed.any(axis=1)
+
+        new_ids = np.setdiff1d(upsert_ids, product_ids)
+        if len(new_ids):
+            positions = np.searchsorted(product_ids, new_ids)
+            product_ids = np.insert(product_ids, positions, new_ids)
+            neighbours = np.insert(neighbours, positions, -1, axis=0)
+            scores = np.insert(scores, positions, -np.inf, axis=0)
+            boundary = np.insert(boundary, positions, -np.inf)
+            holed = np.insert(holed, positions, False)
+
+        index = NeighbourIndex(product_ids, neighbours, scores, pipeline)
+        index.resort(np.flatnonzero(holed))  # gaps go last, so the last slot is the weakest
+
+        if len(upsert_ids):
+            similarities = index.similarities(pipeline.matrix[pipeline.rows_of(upsert_ids)])
+            own_rows = np.searchsorted(product_ids, upsert_ids)
+            similarities[np.arange(len(upsert_ids)), own_rows] = -np.inf
+            neighbours[own_rows], scores[own_rows] = top_k(similarities, product_ids, self.k)
+
+            others = np.ones(len(product_ids), dtype=bool)
+            others[own_rows] = False
+            # A list with a gap only accepts products that beat its old boundary;
+            # below it, some unlisted product might rank higher
+            threshold = np.where(holed, boundary, -np.inf)
+            for product_id, row_similarities in zip(upsert_ids, similarities):
+                entering = np.flatnonzero(
+                    others & (row_similarities > scores[:, -1]) & (row_similarities >= threshold)
+                )
+                neighbours[entering, -1] = product_id
+                scores[entering, -1] = row_similarities[entering]
+                index.resort(entering)
+
+        # Lists still missing an entry that an unlisted product could fill are recomputed
+        index.recompute(np.flatnonzero(holed & np.isfinite(boundary) & ~np.isfinite(scores[:, -1])))
+        return index
+
+    def resort(self, rows):
+        if len(rows) == 0:
+            return
+        order = np.argsort(-self.scores[rows], axis=1, kind='stable')
+        self.neighbours[rows] = np.take_along_axis(self.neighbours[rows], order, axis=1)
+        self.scores[rows] = np.take_along_axis(self.scores[rows], order, axis=1)
+
+    def recompute(self, rows):
+        """Rebuild whole neighbour lists for rows, O(N) each"""
+        if len(rows) == 0:
+            return
+        similarities = self.similarities(self.pipeline.matrix[self.pipeline.rows_of(self.product_ids[rows])])
+        similarities[np.arange(len(rows)), rows] = -np.inf
+        self.neighbours[rows], self.scores[rows] = top_k(similarities, self.product_ids, self.k)
+
+
+def changed_products(old, new):
+    """(upserted ids, deleted ids) between two pipelines sharing fitted statistics.
+
+    A product counts as upserted when it is new or its combined row differs;
+    pipeline refreshes reuse the rows of untouched products, so this finds
+    exactly the products edited in any process since `old` was read.
+    """
+    deleted = np.setdiff1d(old.product_ids, new.product_ids)
+    added = np.setdiff1d(new.product_ids, old.product_ids)
+    if old.matrix is new.matrix:
+        return added, deleted
+    shared = np.intersect1d(old.product_ids, new.product_ids)
+    differs = old.matrix[old.rows_of(shared)] != new.matrix[new.rows_of(shared)]
+    return np.union1d(added, shared[differs.getnnz(axis=1) > 0]), deleted
+
+
+def updated_index(index, pipeline):
+    """An index for `pipeline`: `index` patched where possible, otherwise built from scratch"""
+    # Refreshed pipelines keep the fitted statistics; a refit changes every row
+    if index is None or index.pipeline.fitted_at != pipeline.fitted_at:
+        return NeighbourIndex.build(pipeline)
+    upsert_ids, deleted_ids = changed_products(index.pipeline, pipeline)
+    if len(upsert_ids) + len(deleted_ids) > MAX_PATCHED_FRACTION * len(pipeline.product_ids):
+        return NeighbourIndex.build(pipeline)
+    with stage('rec-neighbours'):
+        return index.apply(pipeline, upsert_ids, deleted_ids)
+
+
+_index = None
+_target = None
+_builder = None
+_lock = threading.Lock()
+
+
+def max_indexed_products():
+    return getattr(settings, 'SHOP_NEIGHBOUR_INDEX_MAX_PRODUCTS', 20000)
+
+
+def get_index(wait=False):
+    """Process-wide neighbour index, or None when there is none yet or the catalog is too large.
+
+    The index follows the feature pipeline, so edits made by any process
+    reach it with the generation that publishes them. Bringing it up to date
+    happens on a background thread: until then requests get the previous
+    index (or None in a fresh process, and callers fall back to scoring
+    against the pipeline). `wait` blocks until the index is current.
+    """
+    global _target, _builder
+    pipeline = feature_pipeline.get_pipeline()
+    if len(pipeline.product_ids) > max_indexed_products():
+        return None
+    index = _index
+    if index is not None and index.pipeline is pipeline:
+        return index
+
+    with _lock:
+        _target = pipeline
+        if _builder is None or not _builder.is_alive():
+            _builder = threading.Thread(target=sync, name='neighbour-index', daemon=True)
+            _builder.start()
+        builder = _builder
+    if wait:
+        builder.join()
+    return _index
+
+
+def sync():
+    """Bring the index up to the latest requested pipeline, until no newer one is waiting"""
+    global _index, _builder
+    while True:
+        with _lock:
+            index, target = _index, _target
+            if target is None or (index is not None and index.pipeline is target):
+                _builder = None
+                return
+        try:
+            updated = updated_index(index, target)
+        except Exception:
+            logger.exception('Neighbour index update failed')
+            with _lock:
+                _builder = None
+            return
+        with _lock:
+            if _index is index:  # not reset meanwhile
+                _index = updated
+
+
+def reset():
+    """Forget the index (used after the catalog was rebuilt wholesale)"""
+    global _index, _target
+    with _lock:
+        _index = None
+        _target = None
@@ -0,0 +1,180 @@
+# shop/pagination.py
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Query parameter holding the primary key the next keyset page starts below
+CURSOR_VAR = 'before'
+# Query parameter holding the primary key the next storefront page starts after
+AFTER_VAR = 'after'
+
+
+def estimated_row_count(queryset):
+    """Cheap row count of the queryset's whole table, or None when the database has none.
+
+    PostgreSQL and MySQL keep statistics; elsewhere (SQLite) the highest
+    auto-increment id is a single index seek and over-counts only deleted rows.
+    """
+    connection = connections[queryset.db]
+    opts = queryset.model._meta
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [opts.db_table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s', [opts.db_table],
+            )
+        else:
+            cursor.execute(f'SELECT MAX({quote(opts.pk.column)}) FROM {quote(opts.db_table)}')
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:  # reltuples is -1 before the first ANALYZE
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never runs COUNT(*) over a whole large table.
+
+    Unfiltered lists use estimated_row_count; filtered ones count at most
+    `count_limit` matching rows. `estimated` tells templates the number is approximate.
+    """
+    count_limit = 10000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        self.estimated = True
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset)
+            if estimate is not None:
+                return estimate
+        count = queryset.order_by()[:self.count_limit].count()
+        self.estimated = count >= self.count_limit
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    """Change list that pages by primary key instead of OFFSET.
+
+    While the list is ordered newest first (by -pk) each page is an index
+    seek, `pk < before LIMIT n`, however deep the user pages; sorting by
+    another column falls back to numbered pages. When the model admin sets
+    `date_hierarchy_follows_pk` (rows are inserted in date order, as with
+    auto_now_add), a date drill-down is turned into a primary key range too,
+    since otherwise the database sorts every row of the period.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        try:
+            self.before = int(request.GET[CURSOR_VAR])
+        except (KeyError, ValueError):
+            self.before = None
+        self.next_url = self.newest_url = None
+        self.date_range = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters(self, request):
+        filters = super().get_filters(request)
+        lookup_params = filters[2]
+        start = lookup_params.get(f'{self.date_hierarchy}__gte')
+        end = lookup_params.get(f'{self.date_hierarchy}__lt')
+        if start and end:
+            self.date_range = (start[0], end[0])
+        return filters
+
+    def pk_range(self, queryset):
+        """The queryset restricted to the primary keys of the selected dates"""
+        if self.date_range is None or not getattr(self.model_admin, 'date_hierarchy_follows_pk', False):
+            return queryset
+        field = self.date_hierarchy
+        rows = self.root_queryset.order_by().values_list('pk', flat=True)
+        first = rows.filter(**{f'{field}__gte': self.date_range[0]}).order_by(field, 'pk').first()
+        last = rows.filter(**{f'{field}__lt': self.date_range[1]}).order_by(f'-{field}', '-pk').first()
+        if first is None or last is None:
+            return queryset.none()
+        return queryset.filter(pk__gte=first, pk__lte=last)
+
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(CURSOR_VAR, None)
+        return params
+
+    def get_results(self, request):
+        # Filter and sort links start again from the newest rows
+        self.params.pop(CURSOR_VAR, None)
+        self.filter_params.pop(CURSOR_VAR, None)
+        ordering = set(self.queryset.query.order_by)  # admin and change list both add '-pk'
+        self.keyset = bool(ordering) and ordering <= {'-pk', f'-{self.lookup_opts.pk.name}'}
+        if not self.keyset or self.show_all:
+            return super().get_results(request)
+
+        queryset = self.pk_range(self.queryset)
+        paginator = self.model_admin.get_paginator(request, queryset, self.list_per_page)
+        if self.before is not None:
+            queryset = queryset.filter(pk__lt=self.before)
+        result_list = queryset[:self.list_per_page]
+        rows = list(result_list)  # fills the sliced queryset's cache for the template
+        if len(rows) == self.list_per_page and queryset.filter(pk__lt=rows[-1].pk).exists():
+            self.next_url = self.get_query_string({CURSOR_VAR: rows[-1].pk})
+        if self.before is not None:
+            self.newest_url = self.get_query_string()
+
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = self.next_url is not None or self.newest_url is not None
+        self.paginator = paginator
+
+
+class KeysetPage:
+    """One page of a queryset in primary key order, starting after the key in ?after=.
+
+    Each page is an index range scan, `pk > after LIMIT n + 1`, however deep
+    the shopper pages, where OFFSET would skip every earlier row. The rows
+    are fetched when first used, so a cached template fragment showing them
+    runs no query.
+    """
+
+    def __init__(self, queryset, params, per_page):
+        self.queryset = queryset
+        self.params = params
+        self.per_page = per_page
+        try:
+            self.after = int(params[AFTER_VAR])
+        except (KeyError, ValueError):
+            self.after = None
+
+    @cached_property
+    def fetched(self):
+        queryset = self.queryset.order_by('pk')
+        if self.after is not None:
+            queryset = queryset.filter(pk__gt=self.after)
+        return list(queryset[:self.per_page + 1])  # the extra row tells whether there is a next page
+
+    @property
+    def object_list(self):
+        return self.fetched[:self.per_page]
+
+    def url(self, after=None):
+        params = self.params.copy()
+        params.pop(AFTER_VAR, None)
+        if after is not None:
+            params[AFTER_VAR] = after
+        return f'?{params.urlencode()}'
+
+    @property
+    def next_url(self):
+        if len(self.fetched) <= self.per_page:
+            return None
+        return self.url(self.object_list[-1].pk)
+
+    @property
+    def first_url(self):
+        return None if self.after is None else self.url()
@@ -0,0 +1,188 @@
+# shop/popularity.py
+import atexit
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F
+from django.db.models.functions import Exp
+from django.utils import timezone
+
+from .models import Product, ProductPopularity
+
+logger = logging.getLogger('shop.popularity')
+
+# Counter increment per event
+EVENT_WEIGHTS = {'view': 1.0, 'cart': 3.0, 'purchase': 5.0}
+CHUNK_SIZE = 500
+# popularity_score = log1p(LOG_SCALE * counter / peak) / log1p(LOG_SCALE), so the
+# long tail keeps distinguishable scores instead of rounding to zero
+LOG_SCALE = 1000.0
+SCORE_DECIMALS = 3
+# Counters that decayed below this weight are deleted by refresh_scores()
+PRUNE_BELOW = 0.01
+
+
+def decay_rate():
+    """Per-second exponential decay rate of the counters"""
+    return math.log(2) / (getattr(settings, 'SHOP_POPULARITY_HALF_LIFE_HOURS', 72) * 3600)
+
+
+def apply_events(weights, now=None):
+    """Decay the counters of the products in {product_id: weight} to `now` and add the weights.
+
+    Counters only change through `score = score * decay + weight` UPDATEs, so
+    flushes from several processes never overwrite each other; products with
+    the same weight share one statement.
+    """
+    now = time.time() if now is None else now
+    product_ids = list(weights)
+    existing = set()
+    for start in range(0, len(product_ids), CHUNK_SIZE):
+        existing.update(Product.objects.filter(id__in=product_ids[start:start + CHUNK_SIZE])
+                        .values_list('id', flat=True))
+    by_weight = {}
+    for product_id in existing:
+        by_weight.setdefault(weights[product_id], []).append(product_id)
+
+    decay = Exp((F('updated_at') - now) * decay_rate())
+    # The counters live with the interaction log, so page views never write to the primary
+    with transaction.atomic(using=router.db_for_write(ProductPopularity)):
+        ProductPopularity.objects.bulk_create(
+            [ProductPopularity(product_id=product_id, updated_at=now) for product_id in existing],
+            ignore_conflicts=True, batch_size=CHUNK_SIZE,
+        )
+        for weight, ids in by_weight.items():
+            for start in range(0, len(ids), CHUNK_SIZE):
+                ProductPopularity.objects.filter(product_id__in=ids[start:start + CHUNK_SIZE]).update(
+                    score=F('score') * decay + weight, updated_at=now,
+                )
+    return len(existing)
+
+
+class PopularityTracker:
+    """Event weights collected in this process and written at most every flush interval.
+
+    Recording is a dict update; the request that finds the interval elapsed
+    writes everything collected so far, so the number of counter writes
+    does not grow with traffic. What an idle process still holds is written
+    by its next request or when it exits; only a process killed without
+    running exit handlers (SIGKILL, the OOM killer) loses its events, at
+    most one flush interval's worth.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush = 0.0
+
+    def record(self, counts, event):
+        """Add {product_id: number of events} of one event type"""
+        weight = EVENT_WEIGHTS[event]
+        with self.lock:
+            for product_id, count in counts.items():
+                self.pending[product_id] = self.pending.get(product_id, 0.0) + weight * count
+        interval = getattr(settings, 'SHOP_POPULARITY_FLUSH_SECONDS', 10)
+        if time.monotonic() - self.last_flush >= interval and self.flush_lock.acquire(blocking=False):
+            try:
+                self._flush()
+            finally:
+                self.flush_lock.release()
+
+    def flush(self):
+        """Write everything pending now"""
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            apply_events(pending)
+        except Exception:
+            # Keep the events for the next flush rather than fail the request
+            logger.exception('Writing popularity counters failed')
+            with self.lock:
+                for product_id, weight in pending.items():
+                    self.pending[product_id] = self.pending.get(product_id, 0.0) + weight
+
+
+tracker = PopularityTracker()
+# Worker shutdowns and restarts (max_requests recycling, deploys) write what is left
+atexit.register(tracker.flush)
+
+
+def record(product_id, event):
+    """Count a 'view', 'cart' or 'purchase' of a product"""
+    tracker.record({product_id: 1}, event)
+
+
+def record_all(counts, event):
+    """Count events of several products, {product_id: number of events}"""
+    tracker.record(counts, event)
+
+
+def refresh_scores(now=None, min_change=0.005):
+    """Recompute popularity_score for the whole catalog from the decayed counters.
+
+    One vectorized pass: every counter is decayed to `now`, scaled against
+    the most popular product, and only scores that moved by `min_change`
+    are written back, grouped by value. Products without a counter (no
+    events yet) keep the score they were loaded with. Returns (products
+    updated, counters pruned).
+    """
+    import numpy as np  # not at module level: views import this module (see shop.engine)
+
+    from .cache import bump_catalog_version
+
+    now = time.time() if now is None else now
+    counters = np.array(list(ProductPopularity.objects.values_list('product_id', 'score', 'updated_at')),
+                        dtype=np.float64).reshape(-1, 3)
+    if not len(counters):
+        return 0, 0  # no events yet: keep whatever scores the catalog came with
+    products = np.array(list(Product.objects.order_by('id').values_list('id', 'popularity_score')),
+                        dtype=np.float64).reshape(-1, 2)
+    product_ids = products[:, 0].astype(np.int64)
+
+    decayed = counters[:, 1] * np.exp(-decay_rate() * np.maximum(now - counters[:, 2], 0.0))
+    rows = np.searchsorted(product_ids, counters[:, 0].astype(np.int64))
+    known = rows < len(product_ids)
+    known[known] = product_ids[rows[known]] == counters[known, 0]
+    counts = np.zeros(len(product_ids))
+    counts[rows[known]] = decayed[known]
+    counted = np.zeros(len(product_ids), dtype=bool)
+    counted[rows[known]] = True
+
+    peak = counts.max() if len(counts) else 0.0
+    scores = np.log1p(LOG_SCALE * counts / peak) / np.log1p(LOG_SCALE) if peak > 0 else counts
+    # Rounded, scores take at most 10**SCORE_DECIMALS + 1 values: one UPDATE ... WHERE id IN
+    # per value and chunk writes the catalog far faster than per-row CASE statements
+    scores = np.round(scores, SCORE_DECIMALS)
+    changed = np.flatnonzero(counted & (np.abs(scores - products[:, 1]) >= min_change))
+    values, groups = np.unique(scores[changed], return_inverse=True)
+    order = np.argsort(groups, kind='stable')
+    bounds = np.searchsorted(groups[order], np.arange(len(values) + 1))
+    saved_at = timezone.now()  # queryset updates skip auto_now; the feature pipeline follows it
+    with transaction.atomic():
+        for value, start, end in zip(values.tolist(), bounds[:-1], bounds[1:]):
+            ids = product_ids[changed[order[start:end]]].tolist()
+            for chunk in range(0, len(ids), CHUNK_SIZE):
+                Product.objects.filter(id__in=ids[chunk:chunk + CHUNK_SIZE]).update(
+                    popularity_score=value, updated_at=saved_at,
+                )
+
+    stale = counters[decayed < PRUNE_BELOW, 0].astype(np.int64).tolist()
+    for start in range(0, len(stale), CHUNK_SIZE):
+        ProductPopularity.objects.filter(product_id__in=stale[start:start + CHUNK_SIZE],
+                                         updated_at__lte=now).delete()
+    if len(changed):
+        # bulk_update sends no signals; cached cards and the pipeline's rows follow the version
+        bump_catalog_version()
+    return len(changed), len(stale)
@@ -1,38 +1,43 @@
 # shop/recommendation.py
+import heapq
+
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
+import scipy.sparse as sp
+from django.core.cache import cache
+
+from . import metrics, neighbours
+from .cache import PAGE_CACHE_TIMEOUT, cart_recommendations_key
+from .feature_pipeline import get_pipeline
+from .instrumentation import stage
 from .models import Product, UserInteraction
 
+INTERACTION_WEIGHTS = {'view': 1, 'cart': 3, 'purchase': 5, 'like': 4, 'dislike': -2}
+
 class RecommendationEngine:
     def __init__(self):
-        self.scaler = StandardScaler()
+        self.pipeline = None
     
     def get_product_features(self):
-        products = Product.objects.all()
-        features = []
-        product_ids = []
-        
-        for product in products:
-            feature_vector = [
-                float(product.price) / 1000,
-                product.popularity_score,
-                product.rating / 5.0,
-                float(product.category.id)
-            ]
-            features.append(feature_vector)
-            product_ids.append(product.id)
-        
-        return np.array(features), product_ids
+        """Sparse L2-normalized feature matrix and product ids from the feature pipeline"""
+        with stage('rec-features'):
+            self.pipeline = get_pipeline()
+            product_ids = self.pipeline.product_ids.tolist()
+            metrics.engine_catalog_size.set(len(product_ids))
+            return self.pipeline.matrix, product_ids
+    
+    def hydrate(self, ranked_ids):
+        """Load products for ranked ids, keeping the ranking order"""
+        with stage('rec-hydrate'):
+            products = Product.objects.in_bulk(ranked_ids)
+            return [products[pid] for pid in ranked_ids if pid in products]
     
     def get_user_interactions_matrix(self, user):
-        interactions = UserInteraction.objects.filter(user=user)
-        weights = {'view': 1, 'cart': 3, 'purchase': 5, 'like': 4, 'dislike': -2}
-        
+        interactions = UserInteraction.objects.filter(user=user).values_list(
+            'product_id', 'interaction_type'
+        )
         product_scores = {}
-        for interaction in interactions:
-            product_id = interaction.product.id
-            weight = weights.get(interaction.interaction_type, 1)
+        for product_id, interaction_type in interactions:
+            weight = INTERACTION_WEIGHTS.get(interaction_type, 1)
             
             if product_id in product_scores:
                 product_scores[product_id] += weight
@@ -42,13 +47,35 @@ class RecommendationEngine:
         return product_scores
     
     def calculate_content_similarity(self, product_id, all_features, product_ids):
-        try:
-            target_idx = product_ids.index(product_id)
-            target_features = all_features[target_idx].reshape(1, -1)
-            similarities = cosine_similarity(target_features, all_features)[0]
-            return similarities
-        except ValueError:
+        target_idx = self.pipeline.row_of(product_id)
+        if target_idx is None:
             return np.zeros(len(product_ids))
+        # Rows are L2-normalized, so cosine similarity is a sparse dot product
+        return self.pipeline.similarities(all_features[target_idx])
+    
+    def score_products(self, user_scores):
+        """Score every catalog row for a {product_id: interaction weight} history"""
+        all_features, product_ids = self.pipeline.matrix, self.pipeline.product_ids
+        recommendation_scores = np.zeros(len(product_ids))
+        
+        with stage('rec-similarity'):
+            if user_scores:
+                # Sum of interaction-weighted similarities == similarity to the
+                # weighted sum of the interacted rows, so one sparse product suffices
+                rows = self.pipeline.rows_of(list(user_scores))
+                weights = np.array(list(user_scores.values()), dtype=np.float64)
+                known = rows >= 0
+                rows, weights = rows[known], weights[known]
+                if len(rows):
+                    query = sp.csr_matrix(
+                        (weights, (np.zeros(len(rows), dtype=np.int64), rows)), shape=(1, len(product_ids))
+                    ) @ all_features
+                    recommendation_scores = self.pipeline.similarities(query)
+            else:
+                # Cold start: rank by popularity x rating (unscaled columns)
+                raw = self.pipeline.inverse_transform(self.pipeline.numeric)
+                recommendation_scores = raw[:, 1] * raw[:, 2] * 5.0
+        return recommendation_scores
     
     def get_recommendations(self, user, num_recommendations=6, exclude_products=None):
         if exclude_products is None:
@@ -58,44 +85,72 @@ class RecommendationEngine:
         if len(product_ids) == 0:
             return []
         
-        all_features = self.scaler.fit_transform(all_features)
         user_scores = self.get_user_interactions_matrix(user)
-        recommendation_scores = np.zeros(len(product_ids))
-        
-        if user_scores:
-            for interacted_product_id, interaction_score in user_scores.items():
-                if interacted_product_id in product_ids:
-                    similarities = self.calculate_content_similarity(
-                        interacted_product_id, all_features, product_ids
-                    )
-                    recommendation_scores += similarities * interaction_score
-        else:
-            for idx, product_id in enumerate(product_ids):
-                product = Product.objects.get(id=product_id)
-                recommendation_scores[idx] = product.popularity_score * product.rating
-        
-        product_score_pairs = list(zip(product_ids, recommendation_scores))
-        product_score_pairs.sort(key=lambda x: x[1], reverse=True)
+        recommendation_scores = self.score_products(user_scores)
         
-        recommended_ids = []
-        for product_id, score in product_score_pairs:
-            if product_id not in exclude_products and product_id not in user_scores:
-                recommended_ids.append(product_id)
-                if len(recommended_ids) >= num_recommendations:
-                    break
+        with stage('rec-topk'):
+            product_score_pairs = list(zip(product_ids, recommendation_scores))
+            product_score_pairs.sort(key=lambda x: x[1], reverse=True)
+            
+            recommended_ids = []
+            for product_id, score in product_score_pairs:
+                if product_id not in exclude_products and product_id not in user_scores:
+                    recommended_ids.append(product_id)
+                    if len(recommended_ids) >= num_recommendations:
+                        break
         
-        return Product.objects.filter(id__in=recommended_ids)
+        return self.hydrate(recommended_ids)
     
+    def get_cart_recommendations(self, quantities, user=None, num_recommendations=4):
+        """Products scored against the cart contents ({product_id: quantity}).
+
+        Each candidate scores the quantity-weighted sum of its similarity to
+        the cart items, taken from the precomputed neighbour lists, so the
+        cost is cart size x K rather than the catalog size.
+        """
+        if not quantities:
+            return []
+        index = neighbours.get_index()
+        if index is None:
+            # No neighbour index for this catalog size: fall back to the user's history
+            if user is None:
+                return []
+            return self.get_recommendations(user, num_recommendations, list(quantities))
+
+        key = cart_recommendations_key(quantities, num_recommendations)
+        ranked_ids = cache.get(key)
+        metrics.cache_requests.inc(cache='cart_recs', result='miss' if ranked_ids is None else 'hit')
+        if ranked_ids is None:
+            with stage('rec-neighbours'):
+                scores = {}
+                for product_id, quantity in quantities.items():
+                    ids, similarities = index.scored_neighbours(product_id)
+                    for candidate, similarity in zip(ids.tolist(), similarities.tolist()):
+                        if candidate not in quantities:
+                            scores[candidate] = scores.get(candidate, 0.0) + quantity * similarity
+                best = heapq.nlargest(num_recommendations, scores.items(), key=lambda item: item[1])
+                ranked_ids = [product_id for product_id, score in best]
+            cache.set(key, ranked_ids, PAGE_CACHE_TIMEOUT)
+        return self.hydrate(ranked_ids)
+
     def get_similar_products(self, product_id, num_recommendations=4):
+        index = neighbours.get_index()
+        if index is not None:
+            with stage('rec-neighbours'):
+                similar_ids = index.neighbours_of(product_id, num_recommendations)
+            return self.hydrate(similar_ids)
+
+        # Catalog too large for an in-process index: score this product against all
         all_features, product_ids = self.get_product_features()
-        if product_id not in product_ids:
+        if self.pipeline.row_of(product_id) is None:
             return []
         
-        all_features = self.scaler.fit_transform(all_features)
-        similarities = self.calculate_content_similarity(product_id, all_features, product_ids)
+        with stage('rec-similarity'):
+            similarities = self.calculate_content_similarity(product_id, all_features, product_ids)
         
-        product_score_pairs = list(zip(product_ids, similarities))
-        product_score_pairs.sort(key=lambda x: x[1], reverse=True)
-        
-        similar_ids = [pid for pid, score in product_score_pairs[1:num_recommendations+1]]
-        return Product.objects.filter(id__in=similar_ids)
\ No newline at end of file
+        with stage('rec-topk'):
+            product_score_pairs = list(zip(product_ids, similarities))
+            product_score_pairs.sort(key=lambda x: x[1], reverse=True)
+            
+            similar_ids = [pid for pid, score in product_score_pairs[1:num_recommendations+1]]
+        return self.hydrate(similar_ids)
\ No newline at end of file
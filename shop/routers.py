@@ -0,0 +1,179 @@
+# shop/routers.py
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+def interactions_database():
+    """Alias of the interaction-log database, or None when it is not configured"""
+    alias = getattr(settings, 'SHOP_INTERACTIONS_DATABASE', 'interactions')
+    return alias if alias in settings.DATABASES else None
+
+
+class InteractionRouter:
+    """Keeps the interaction log, and tables derived from it, in their own database.
+
+    Interactions reference users and products without foreign key
+    constraints, so they can live in a different SQLite file; signals
+    remove them when the user or product is deleted. Without a configured
+    interactions database the router has no opinion and everything stays
+    in the default database.
+    """
+    models = {'userinteraction', 'productpopularity'}
+
+    def routed(self, model):
+        """Whether a model class or instance belongs in the interactions database"""
+        return model._meta.app_label == 'shop' and model._meta.model_name in self.models
+
+    def db_for_read(self, model, **hints):
+        alias = interactions_database()
+        if alias is None:
+            return None
+        if self.routed(model):
+            return alias
+        # The user and product of an interaction are not in the interaction's database
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == alias:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if interactions_database() and (self.routed(obj1) or self.routed(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = interactions_database()
+        if alias is None:
+            return None
+        if app_label == 'shop' and model_name in self.models:
+            return db == alias
+        if db == alias:
+            return False
+        return None
+
+
+def read_replicas():
+    return getattr(settings, 'SHOP_READ_REPLICAS', [])
+
+
+def replica_version_key(alias):
+    return f'shop:replica_version:{alias}'
+
+
+def mark_replica_synced(alias, version):
+    """Record that a replica holds every catalog change up to `version` (a catalog version).
+
+    Kept next to the catalog version, in the cache every process shares,
+    so the servers see what sync_replicas copied.
+    """
+    from .cache import version_cache
+
+    version_cache().set(replica_version_key(alias), version, timeout=None)
+
+
+def current_replicas(replicas):
+    """The replicas that already hold the current catalog version.
+
+    Everything cached per catalog version (pages, cards, the feature
+    pipeline and neighbour index) must be built from rows at least that
+    new, or stale rows would be cached under the new version. Replicas
+    refreshed by sync_replicas record the version they copied; a replica
+    replicating by itself counts as current once the last catalog change
+    is SHOP_REPLICA_MAX_LAG_SECONDS old.
+    """
+    from .cache import get_catalog_version, version_cache
+
+    version = get_catalog_version()
+    synced = version_cache().get_many([replica_version_key(alias) for alias in replicas])
+    max_lag = getattr(settings, 'SHOP_REPLICA_MAX_LAG_SECONDS', 5)
+    settled = version <= (time.time() - max_lag) * 1000  # versions are millisecond timestamps
+    return [
+        alias for alias in replicas
+        if synced.get(replica_version_key(alias), version if settled else -1) >= version
+    ]
+
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class ReplicaRouting:
+    """Replica state of the request being served"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned  # the session wrote recently, or this is not a safe method
+        self.wrote = False
+        self.replica = None  # one replica per request, so a page never mixes two lags
+
+    def watch(self, execute, sql, params, many, context):
+        """Execute wrapper for the primary: the request wrote once a write statement actually ran.
+
+        Router calls cannot tell, since get_or_create() asks for a write
+        database before it knows whether it will insert.
+        """
+        if not self.wrote and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+            self.wrote = True
+        return execute(sql, params, many, context)
+
+
+_routing = ContextVar('shop_replica_routing', default=None)
+
+
+def activate(state):
+    return _routing.set(state)
+
+
+def deactivate(token):
+    _routing.reset(token)
+
+
+class ReplicaRouter:
+    """Sends catalog reads made while serving a request to a read replica.
+
+    Writes, and reads of everything else (carts, orders, users, sessions),
+    stay on the primary, and so do catalog reads while no replica holds
+    the current catalog version (current_replicas). Once a request writes,
+    its remaining reads go to the primary as well, and ReplicaMiddleware
+    pins the session there for SHOP_REPLICA_STICKY_SECONDS so users see
+    their own writes through replica lag. Outside requests (commands,
+    background threads) every query uses the primary.
+    """
+    catalog_models = {'category', 'product', 'productassociation'}
+
+    def db_for_read(self, model, **hints):
+        replicas = read_replicas()
+        if not replicas:
+            return None
+        state = _routing.get()
+        if (state is not None and not state.pinned and not state.wrote
+                and model._meta.app_label == 'shop' and model._meta.model_name in self.catalog_models):
+            if state.replica is None:
+                current = current_replicas(replicas)
+                state.replica = random.choice(current) if current else DEFAULT_DB_ALIAS
+            return state.replica
+        # Explicit, or objects read from a replica would pull their relations from it too
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if not read_replicas():
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        replicas = read_replicas()
+        if not replicas:
+            return None
+        databases = {DEFAULT_DB_ALIAS, *replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in read_replicas():
+            return False  # copies of the primary, never migrated directly
+        return None
@@ -0,0 +1,46 @@
+# shop/signals.py
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import images, metrics
+from .cache import bump_catalog_version
+from .models import Category, Product, ProductPopularity, UserInteraction
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, **kwargs):
+    """Any product or category change invalidates cached catalog fragments"""
+    bump_catalog_version()
+    # Again once committed: a request that read the old rows while the
+    # transaction was open may have cached them under the first new version
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def image_uploaded(sender, instance, **kwargs):
+    if instance.image and not images.has_derivatives(instance):
+        product_id, name = instance.pk, instance.image.name
+        # The worker must see the committed row
+        transaction.on_commit(lambda: images.schedule_derivatives(product_id, name))
+
+
+@receiver(post_save, sender=UserInteraction)
+def interaction_written(sender, instance, created, **kwargs):
+    if created:
+        metrics.interaction_writes.inc(type=instance.interaction_type)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=User)
+def delete_interactions(sender, instance, **kwargs):
+    """Cascade by hand: interactions have no foreign key constraints (shop.routers)"""
+    lookup = {'product_id' if sender is Product else 'user_id': instance.pk}
+    # Only once the deletion is committed; the interaction log is another database
+    transaction.on_commit(lambda: UserInteraction.objects.filter(**lookup).delete(), robust=True)
+    if sender is Product:
+        transaction.on_commit(lambda: ProductPopularity.objects.filter(**lookup).delete(), robust=True)
@@ -0,0 +1,53 @@
+# shop/templatetags/shop_tags.py
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .. import metrics
+from ..cache import CARD_CACHE_TIMEOUT, get_catalog_version, product_card_key
+from ..images import has_derivatives, product_image_url
+
+register = template.Library()
+
+
+@register.filter
+def image_url(product, size='card'):
+    """{{ product|image_url:'thumb' }}"""
+    return product_image_url(product, size)
+
+
+@register.inclusion_tag('shop/includes/product_picture.html')
+def product_picture(product, size='card', css_class='', style='', lazy=True):
+    """{% product_picture product 'thumb' css_class='...' %}: resized WebP with a JPEG fallback"""
+    webp_url = None
+    if has_derivatives(product) or not product.image:
+        webp_url = product_image_url(product, size, 'webp')
+    return {
+        'product': product,
+        'url': product_image_url(product, size),
+        'webp_url': webp_url,
+        'css_class': css_class,
+        'style': style,
+        'lazy': lazy,
+    }
+
+
+@register.simple_tag(takes_context=True)
+def product_card(context, product, variant='featured'):
+    """Render a product card, cached per product and catalog version"""
+    version = context.get('catalog_version')
+    if version is None:
+        version = get_catalog_version()
+        context['catalog_version'] = version
+
+    key = product_card_key(product.id, variant, version)
+    html = cache.get(key)
+    metrics.cache_requests.inc(cache='card', result='miss' if html is None else 'hit')
+    if html is None:
+        html = render_to_string('shop/includes/product_card.html', {
+            'product': product,
+            'variant': variant,
+        })
+        cache.set(key, html, CARD_CACHE_TIMEOUT)
+    return mark_safe(html)
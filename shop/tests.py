@@ -1,3 +1,1214 @@
-from django.test import TestCase
+import datetime
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Count
+from django.template import Context, Template
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from . import (analytics, associations, benchmarks, engine, evaluation, feature_pipeline, images, loadtest,
+               metrics, neighbours, popularity, routers)
+from .cache import bump_catalog_version, get_catalog_version, product_card_key, version_cache
+from .middleware import ReplicaMiddleware
+from .models import (Cart, CartItem, Category, DailyCategorySales, DailyProductSales, Order, OrderItem,
+                     Product, ProductAssociation, ProductPopularity, UserInteraction)
+from .recommendation import RecommendationEngine
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def result(self, median, name='get_similar_products', size=1000, **params):
+        return {'name': name, 'size': size, 'params': params, 'median': median}
+
+    def test_flags_slowdown_beyond_threshold(self):
+        baseline = {'results': [self.result(0.100), self.result(0.200, history=10)]}
+        current = {'results': [self.result(0.125), self.result(0.210, history=10)]}
+
+        regressions = benchmarks.compare(current, baseline, threshold=0.10)
+
+        self.assertEqual([r['benchmark'] for r in regressions],
+                         ['get_similar_products[size=1000]'])
+
+    def test_ignores_benchmarks_missing_from_baseline(self):
+        current = {'results': [self.result(1.0, size=1000000)]}
+        self.assertEqual(benchmarks.compare(current, {'results': []}), [])
+
+
+class StartupImportTests(SimpleTestCase):
+    def test_check_does_not_import_the_ml_stack(self):
+        environment = {key: value for key, value in os.environ.items() if key != 'SHOP_PREWARM_ENGINE'}
+        result = subprocess.run([sys.executable, '-X', 'importtime', 'manage.py', 'check'],
+                                 cwd=settings.BASE_DIR, env=environment, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        packages = engine.import_costs(result.stderr)
+        self.assertIn('django', packages)
+        for package in ['sklearn', 'scipy', 'numpy']:
+            self.assertNotIn(package, packages)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    def make_registry(self):
+        registry = metrics.Registry()
+        counter = registry.counter('test_total', 'Test counter', ['kind'])
+        histogram = registry.histogram('test_seconds', 'Test histogram', buckets=(0.1, 1.0))
+        return registry, counter, histogram
+
+    def test_render_prometheus_text(self):
+        registry, counter, histogram = self.make_registry()
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+
+        text = registry.render()
+
+        self.assertIn('# TYPE test_total counter', text)
+        self.assertIn('test_total{kind="a"} 3', text)
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('test_seconds_count 2', text)
+
+    def test_merges_other_process_snapshots(self):
+        registry, counter, histogram = self.make_registry()
+        counter.inc(kind='a')
+        with tempfile.TemporaryDirectory() as directory, override_settings(SHOP_METRICS_DIR=directory):
+            with open(os.path.join(directory, f'metrics-{os.getppid()}.json'), 'w') as f:
+                json.dump({'test_total': [[['a'], 4]]}, f)
+            # A worker that has exited since: its snapshot is dropped
+            dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+            dead.wait()
+            with open(os.path.join(directory, f'metrics-{dead.pid}.json'), 'w') as f:
+                json.dump({'test_total': [[['a'], 100]]}, f)
+            text = registry.render()
+            left = sorted(os.listdir(directory))
+
+        self.assertIn('test_total{kind="a"} 5', text)
+        self.assertEqual(left, sorted([f'metrics-{os.getppid()}.json', f'metrics-{os.getpid()}.json']))
+
+    def test_samples_of_exited_threads_are_folded(self):
+        registry, counter, histogram = self.make_registry()
+        for _ in range(5):
+            thread = threading.Thread(target=lambda: (counter.inc(kind='a'), histogram.observe(0.5)))
+            thread.start()
+            thread.join()
+        counter.inc(kind='a')
+
+        self.assertLessEqual(len(counter._shards), 2)
+        self.assertEqual(counter.collect(), {('a',): 6})
+        self.assertEqual(histogram.collect()[()][-1], 5)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class CatalogVersionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    def test_bumps_by_other_processes_reach_the_server(self):
+        first = self.client.get(reverse('product_list'))
+        # As a management command run next to the server would
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-c',
+             'from shop.cache import bump_catalog_version; print(bump_catalog_version())'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        bumped = int(result.stdout.split()[-1])
+
+        self.assertEqual(get_catalog_version(), bumped)
+        second = self.client.get(reverse('product_list'))
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertTrue(second['ETag'].endswith(f'-{bumped}"'))
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class AnonymousPageCacheTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+        cls.user = User.objects.create_user('shopper', password='shopper-pass-123')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('product_list')
+
+    def test_anonymous_hits_are_served_from_the_cache(self):
+        first = self.client.get(self.url)
+        self.assertIn('ETag', first)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertIn('Cookie', second['Vary'])
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.get(self.url)  # cached for anonymous visitors
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertGreater(len(queries), 0)
+        self.assertNotIn('ETag', response)
+
+    def test_keyed_on_the_full_path(self):
+        laptops = self.client.get(self.url, {'search': 'Laptop'})
+        shirts = self.client.get(self.url, {'search': 'Shirt'})
+        self.assertNotEqual(laptops['ETag'], shirts['ETag'])
+        self.assertContains(laptops, 'Laptop')
+        self.assertNotContains(shirts, 'Laptop')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, {'search': 'Laptop'}).content, laptops.content)
+
+    def test_catalog_changes_invalidate_cached_pages(self):
+        first = self.client.get(self.url)
+        product = Product.objects.order_by('id').first()
+        product.name = 'Renamed Gadget'
+        product.save()  # bumps the catalog version
+        second = self.client.get(self.url)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertNotContains(first, 'Renamed Gadget')
+        self.assertContains(second, 'Renamed Gadget')
+
+    def test_if_none_match_gets_304_until_the_catalog_changes(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        bump_catalog_version()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ProductCardCacheTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.order_by('id').first()
+
+    def render(self):
+        return Template("{% load shop_tags %}{% product_card product 'list' %}").render(
+            Context({'product': self.product}))
+
+    def test_cards_are_cached_per_product_and_catalog_version(self):
+        html = self.render()
+        self.assertEqual(cache.get(product_card_key(self.product.id, 'list')), html)
+        # Queryset updates send no signal, so the cached card is still served
+        Product.objects.filter(pk=self.product.pk).update(name='Quietly Renamed')
+        self.product.refresh_from_db()
+        self.assertEqual(self.render(), html)
+
+        self.product.save()  # bumps the catalog version
+        self.assertIn('Quietly Renamed', self.render())
+
+    def test_product_saves_reach_the_cards_of_rendered_pages(self):
+        self.client.force_login(User.objects.create_user('carder', password='carder-pass-123'))
+        self.assertContains(self.client.get(reverse('product_list')), self.product.name)
+        old_name = self.product.name
+        self.product.name = 'Renamed On Save'
+        self.product.save()
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, 'Renamed On Save')
+        self.assertNotContains(response, f'>{old_name}<')
+
+
+@override_settings(SHOP_PRODUCTS_PER_PAGE=4)
+class ProductListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url):
+        """Ids of the products on every page, following the next links from `url`"""
+        seen = []
+        while url:
+            response = self.client.get(url)
+            page = response.context['page']
+            self.assertLessEqual(len(page.object_list), 4)
+            seen.extend(product.id for product in page.object_list)
+            url = page.next_url and reverse('product_list') + page.next_url
+        return seen
+
+    def test_pages_cover_the_catalog_once(self):
+        self.assertEqual(self.walk(reverse('product_list')),
+                         list(Product.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_next_links_keep_the_filters(self):
+        category = Category.objects.annotate(count=Count('products')).order_by('-count').first()
+        seen = self.walk(reverse('product_list') + f'?category={category.id}')
+        self.assertEqual(seen, list(category.products.order_by('id').values_list('id', flat=True)))
+        self.assertGreater(len(seen), 4)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class PerformanceMiddlewareTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+        cls.user = User.objects.create_user('timed', password='timed-pass-123')
+        cls.product = Product.objects.first()
+
+    def test_server_timing_counts_queries_of_every_database(self):
+        self.client.force_login(self.user)
+        url = reverse('product_detail', args=[self.product.id])
+        with CaptureQueriesContext(connection) as queries, \
+                CaptureQueriesContext(connections['interactions']) as interaction_queries:
+            response = self.client.get(url)
+
+        self.assertGreater(len(interaction_queries), 0)  # the view is logged
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn(f'desc="{len(queries) + len(interaction_queries)} queries"', timing)
+        self.assertRegex(timing, r'total;dur=[\d.]+$')
+
+    @override_settings(SHOP_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_slowest_queries(self):
+        with self.assertLogs('shop.performance', 'WARNING') as logs:
+            self.client.get(reverse('product_list'))
+
+        message, = logs.output
+        self.assertIn('Slow request GET /products/', message)
+        self.assertIn('SELECT', message)
+
+
+class FeaturePipelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    def test_rows_are_normalized_and_refresh_matches_fit(self):
+        ids, raw, categories = feature_pipeline.read_catalog_rows()
+        pipeline = feature_pipeline.FeaturePipeline.fit(ids[:-2], raw[:-2], categories[:-2])
+        refreshed = pipeline.refreshed(ids, ids[-2:], raw[-2:], categories[-2:])
+        row = refreshed.row_of(int(ids[-1]))
+
+        self.assertAlmostEqual(refreshed.similarities(refreshed.matrix[row])[row], 1.0)
+        # Rows for products known at fit time are reused unchanged
+        self.assertEqual((refreshed.matrix[:-2] != pipeline.matrix).nnz, 0)
+
+    def test_refresh_rereads_only_saved_rows_text_included(self):
+        # As if the catalog was loaded two hours ago and one product last saved an hour ago
+        last_saved, edited = Product.objects.order_by('id')[:2]
+        Product.objects.update(updated_at=timezone.now() - datetime.timedelta(hours=2))
+        Product.objects.filter(id=last_saved.id).update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+        pipeline = feature_pipeline.fit_catalog()
+        edited.description = 'waterproof trail running shoes'
+        edited.save()
+
+        # The overlap re-reads the last row the pipeline saw too
+        ids, changed_ids, raw, categories, watermark = feature_pipeline.read_catalog_changes(pipeline)
+        self.assertEqual(changed_ids.tolist(), [last_saved.id, edited.id])
+        self.assertGreater(watermark, pipeline.rows_updated_at)
+        refreshed = pipeline.refreshed(ids, changed_ids, raw, categories)
+        row = refreshed.row_of(edited.id)
+        self.assertNotEqual((refreshed.text[row] != pipeline.text[row]).nnz, 0)
+        everything = pipeline.refreshed(ids, ids, *feature_pipeline.read_catalog_rows()[1:])
+        self.assertAlmostEqual(abs(refreshed.matrix - everything.matrix).max(), 0.0)
+
+    def test_workers_map_published_changes_instead_of_reading_the_catalog(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(feature_pipeline.reset)
+        with override_settings(RECOMMENDATION_ARTIFACT_DIR=directory):
+            feature_pipeline.reset()
+            self.assertEqual(feature_pipeline.publish_changes().generation, 1)
+            self.assertIsNone(feature_pipeline.publish_changes())  # nothing changed since
+            pipeline = feature_pipeline.get_pipeline()
+            edited = Product.objects.order_by('id').first()
+            edited.description = 'waterproof trail running shoes'
+            edited.save()
+
+            with self.assertNumQueries(0):  # the version bump costs requests nothing
+                self.assertIs(feature_pipeline.get_pipeline(), pipeline)
+            self.assertEqual(feature_pipeline.publish_changes().generation, 2)
+            feature_pipeline._generation_checked = 0.0  # as if GENERATION_CHECK_SECONDS went by
+            swapped = feature_pipeline.get_pipeline()
+
+        self.assertEqual(swapped.generation, 2)
+        self.assertFalse(swapped.matrix.data.flags.writeable)  # mapped, not a private copy
+        old_row, new_row = pipeline.row_of(edited.id), swapped.row_of(edited.id)
+        self.assertNotEqual((swapped.text[new_row] != pipeline.text[old_row]).nnz, 0)
+
+    def test_saved_generations_are_memory_mapped_and_swapped(self):
+        pipeline = feature_pipeline.FeaturePipeline.fit(*feature_pipeline.read_catalog_rows())
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(3):
+                pipeline.save(directory)
+            loaded = feature_pipeline.FeaturePipeline.load(directory)
+
+            self.assertEqual(feature_pipeline.current_generation(directory), 3)
+            self.assertEqual(loaded.generation, 3)
+            self.assertFalse(loaded.matrix.data.flags.writeable)
+            self.assertEqual((loaded.matrix != pipeline.matrix).nnz, 0)
+            self.assertEqual(sorted(n for n in os.listdir(directory) if n.startswith('gen-')),
+                             ['gen-000002', 'gen-000003'])
+
+
+class NeighbourIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    def test_point_updates_match_a_rebuild(self):
+        pipeline = feature_pipeline.FeaturePipeline.fit(*feature_pipeline.read_catalog_rows())
+        index = neighbours.NeighbourIndex.build(pipeline, k=5)
+        edited, removed, template = Product.objects.order_by('id')[:3]
+        edited.name, edited.price = template.name, template.price
+        edited.save()
+        added = Product.objects.create(
+            name=template.name, description=template.description, price=template.price,
+            category=template.category, stock=1,
+        )
+        removed_id = removed.id
+        removed.delete()
+        # Every row re-read, as after an edit in another process
+        ids, raw, categories = feature_pipeline.read_catalog_rows()
+        refreshed = pipeline.refreshed(ids, ids, raw, categories)
+
+        upsert_ids, deleted_ids = neighbours.changed_products(pipeline, refreshed)
+        self.assertEqual(upsert_ids.tolist(), [edited.id, added.id])
+        self.assertEqual(deleted_ids.tolist(), [removed_id])
+        patched = index.apply(refreshed, upsert_ids, deleted_ids)
+        rebuilt = neighbours.NeighbourIndex.build(refreshed, k=5)
+
+        np.testing.assert_array_equal(patched.product_ids, rebuilt.product_ids)
+        np.testing.assert_allclose(patched.scores, rebuilt.scores, atol=1e-6)
+        self.assertIn(added.id, patched.neighbours_of(template.id, 5))
+
+    def test_cart_recommendations_merge_neighbour_lists(self):
+        engine = RecommendationEngine()
+        first, second = Product.objects.order_by('id')[:2]
+        index = neighbours.get_index(wait=True)
+        quantities = {first.id: 3, second.id: 1}
+
+        expected = {}
+        for product_id, quantity in quantities.items():
+            ids, scores = index.scored_neighbours(product_id)
+            for candidate, score in zip(ids.tolist(), scores.tolist()):
+                if candidate not in quantities:
+                    expected[candidate] = expected.get(candidate, 0) + quantity * score
+        best = sorted(expected, key=expected.get, reverse=True)[:4]
+
+        self.assertEqual([p.id for p in engine.get_cart_recommendations(quantities)], best)
+        with self.assertNumQueries(1):  # cached ids, only hydration
+            engine.get_cart_recommendations(quantities)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_cart_with_a_product_missing_from_the_index(self):
+        first, missing = Product.objects.order_by('id')[:2]
+        index = neighbours.get_index(wait=True)
+        self.addCleanup(neighbours.reset)
+        # As if `missing` was added after the index was last brought up to date
+        neighbours._index = index.apply(index.pipeline, [], [missing.id])
+        self.assertEqual(len(neighbours.get_index().scored_neighbours(missing.id)[0]), 0)
+
+        user = User.objects.create_user('shopper', password='shopper-pass-123')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=first), CartItem(cart=cart, product=missing)])
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('cart')).status_code, 200)
+
+    def test_index_follows_edits_made_by_other_processes(self):
+        self.addCleanup(neighbours.reset)
+        self.addCleanup(feature_pipeline.reset)
+        index = neighbours.get_index(wait=True)
+        edited, template = Product.objects.order_by('id')[:2]
+        # A bulk update sends no signal; only the catalog version tells
+        Product.objects.filter(pk=edited.pk).update(
+            name=template.name, description=template.description, price=template.price,
+            category=template.category, updated_at=timezone.now(),
+        )
+        bump_catalog_version()
+
+        self.assertIs(neighbours.get_index(), index)  # stale until the background update is in
+        updated = neighbours.get_index(wait=True)
+        self.assertIs(updated.pipeline, feature_pipeline.get_pipeline())
+        rebuilt = neighbours.NeighbourIndex.build(updated.pipeline)
+        np.testing.assert_allclose(updated.scores, rebuilt.scores, atol=1e-6)
+        self.assertIn(edited.id, updated.neighbours_of(template.id, 3))
+
+
+class InteractionDatabaseTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    def test_interactions_live_apart_and_go_with_their_product(self):
+        call_command('populate_db', stdout=StringIO())
+        user = User.objects.create_user('logger', password='logger-pass-123')
+        product = Product.objects.first()
+        interaction = UserInteraction.objects.create(user=user, product=product, interaction_type='view')
+
+        self.assertEqual(interaction._state.db, 'interactions')
+        self.assertEqual(interaction.product, product)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertFalse(UserInteraction.objects.exists())
+
+    def test_connections_apply_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+class InteractionCopyTests(TransactionTestCase):
+    databases = {'default', 'interactions'}
+
+    def test_interactions_logged_before_the_split_are_copied_once(self):
+        # A default database migrated before the interactions database existed
+        with connection.schema_editor() as editor:
+            editor.create_model(UserInteraction)
+        self.addCleanup(self.drop_old_table)
+        call_command('populate_db', stdout=StringIO())
+        user = User.objects.create_user('early', password='early-pass-123')
+        products = list(Product.objects.order_by('id')[:3])
+        UserInteraction.objects.using('default').bulk_create([
+            UserInteraction(user=user, product=product, interaction_type='view') for product in products
+        ])
+        old = list(UserInteraction.objects.using('default').order_by('id').values())
+
+        call_command('copy_interactions', chunk_size=2, stdout=StringIO())
+        call_command('copy_interactions', '--delete', stdout=StringIO())
+
+        self.assertEqual(list(UserInteraction.objects.order_by('id').values()), old)
+        self.assertNotIn(UserInteraction._meta.db_table, connection.introspection.table_names())
+
+    def drop_old_table(self):
+        if UserInteraction._meta.db_table in connection.introspection.table_names():
+            with connection.schema_editor() as editor:
+                editor.delete_model(UserInteraction)
+
+
+@override_settings(SHOP_READ_REPLICAS=['replica'])
+class ReplicaRouterTests(SimpleTestCase):
+    def test_catalog_reads_leave_the_primary_only_inside_clean_requests(self):
+        router = routers.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), 'default')  # no request
+        routers.mark_replica_synced('replica', get_catalog_version())
+        self.addCleanup(version_cache().delete, routers.replica_version_key('replica'))
+
+        state = routers.ReplicaRouting()
+        token = routers.activate(state)
+        try:
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_read(Cart), 'default')
+            self.assertEqual(router.db_for_write(Product), 'default')
+            self.assertEqual(router.db_for_read(Product), 'replica')  # nothing written yet
+            state.watch(lambda *args: None, 'UPDATE "shop_product" SET ...', (), False, {})
+            self.assertEqual(router.db_for_read(Product), 'default')  # read-your-writes
+        finally:
+            routers.deactivate(token)
+        self.assertFalse(router.allow_migrate('replica', 'shop', 'product'))
+
+    def test_replicas_behind_the_catalog_version_are_not_read(self):
+        router = routers.ReplicaRouter()
+        routers.mark_replica_synced('replica', get_catalog_version())
+        self.addCleanup(version_cache().delete, routers.replica_version_key('replica'))
+        bump_catalog_version()  # a change the replica has not copied yet
+
+        token = routers.activate(routers.ReplicaRouting())
+        try:
+            self.assertEqual(router.db_for_read(Product), 'default')
+        finally:
+            routers.deactivate(token)
+        # Replicas replicating by themselves are trusted once the change is old enough
+        version_cache().delete(routers.replica_version_key('replica'))
+        token = routers.activate(routers.ReplicaRouting())
+        try:
+            with override_settings(SHOP_REPLICA_MAX_LAG_SECONDS=-60):
+                self.assertEqual(router.db_for_read(Product), 'replica')
+        finally:
+            routers.deactivate(token)
+
+    def test_sync_marks_written_by_another_process_are_seen(self):
+        self.addCleanup(version_cache().delete, routers.replica_version_key('replica'))
+        version = bump_catalog_version()
+        # What sync_replicas records after copying, from its own process
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-c',
+             f'from shop.routers import mark_replica_synced; mark_replica_synced("replica", {version})'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        with override_settings(SHOP_REPLICA_MAX_LAG_SECONDS=3600):
+            self.assertEqual(routers.current_replicas(['replica']), ['replica'])
+            bump_catalog_version()
+            self.assertEqual(routers.current_replicas(['replica']), [])
+
+
+# The primary stands in for the replica; only the session pinning is observed
+@override_settings(SHOP_READ_REPLICAS=['default'])
+class ReplicaStickinessTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    def test_writing_pins_the_session_to_the_primary(self):
+        call_command('populate_db', stdout=StringIO())
+        user = User.objects.create_user('sticky', password='sticky-pass-123')
+        self.client.force_login(user)
+        product = Product.objects.first()
+        with override_settings(SHOP_POPULARITY_FLUSH_SECONDS=0), \
+                CaptureQueriesContext(connection) as queries:
+            # logs an interaction and writes popularity counters, both in the interactions database
+            self.client.get(reverse('product_detail', args=[product.id]))
+        self.assertTrue(ProductPopularity.objects.filter(product=product).exists())
+        self.assertFalse([query for query in queries if query['sql'].startswith(routers.WRITE_STATEMENTS)])
+        self.assertNotIn(ReplicaMiddleware.session_key, self.client.session)
+
+        Cart.objects.create(user=user)
+        self.client.get(reverse('cart'))  # get_or_create that only reads
+        self.assertNotIn(ReplicaMiddleware.session_key, self.client.session)
+
+        self.client.get(reverse('add_to_cart', args=[product.id]))
+        self.assertGreater(self.client.session[ReplicaMiddleware.session_key], time.time())
+
+
+class LargeTableAdminTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+        cls.admin = User.objects.create_superuser('staff', 'staff@example.com', 'staff-pass-123')
+        product = Product.objects.first()
+        UserInteraction.objects.bulk_create([
+            UserInteraction(user=cls.admin, product=product, interaction_type='view') for _ in range(25)
+        ])
+
+    def test_interactions_page_by_key_without_counting_or_offsets(self):
+        model_admin = admin.site._registry[UserInteraction]
+        self.addCleanup(setattr, model_admin, 'list_per_page', model_admin.list_per_page)
+        model_admin.list_per_page = 10
+        self.client.force_login(self.admin)
+        url = reverse('admin:shop_userinteraction_changelist')
+
+        seen = []
+        with CaptureQueriesContext(connections['interactions']) as queries:
+            response = self.client.get(url)
+            while True:
+                cl = response.context['cl']
+                seen.extend(row.pk for row in cl.result_list)
+                if not cl.next_url:
+                    break
+                response = self.client.get(url + cl.next_url)
+        self.assertEqual(seen, sorted(UserInteraction.objects.values_list('pk', flat=True), reverse=True))
+        for query in queries.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+            self.assertNotIn('DISTINCT', query['sql'])
+
+        today = timezone.localdate()
+        response = self.client.get(url, {'timestamp__year': today.year, 'timestamp__month': today.month})
+        self.assertEqual(len(response.context['cl'].result_list), 10)
+
+
+class AssociationMiningTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+        cls.user = User.objects.create_user('shopper', password='shopper-pass-123')
+        a, b, c, d = Product.objects.order_by('id')[:4]
+        cls.a, cls.b, cls.c = a, b, c
+        # a+b bought together 3 times, a+c once, d everywhere else
+        for basket in [[a, b], [a, b], [a, b, d], [a, c], [d], [d, c]]:
+            order = Order.objects.create(user=cls.user, total_amount=1)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price=product.price)
+                for product in basket
+            ])
+
+    def test_chunked_counts_match_and_pairs_are_ranked(self):
+        whole, orders = associations.count_cooccurrences(chunk_size=1000)
+        chunked, chunked_orders = associations.count_cooccurrences(chunk_size=2)
+        self.assertEqual(orders, 6)
+        self.assertEqual(chunked_orders, 6)
+        self.assertEqual((whole != chunked).nnz, 0)
+        forked, forked_orders = associations.count_cooccurrences(chunk_size=2, workers=2)
+        self.assertEqual(forked_orders, 6)
+        self.assertEqual((whole != forked).nnz, 0)
+
+        call_command('mine_associations', min_support=0.1, stdout=StringIO())
+        top = ProductAssociation.objects.get(product=self.a, rank=0)
+        self.assertEqual(top.associated_id, self.b.id)
+        self.assertAlmostEqual(top.confidence, 0.75)
+        self.assertEqual(associations.bought_together([self.a.id], limit=1), [self.b])
+
+
+class PopularityTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    @override_settings(SHOP_POPULARITY_HALF_LIFE_HOURS=1, SHOP_POPULARITY_FLUSH_SECONDS=60)
+    def test_counters_decay_and_scores_are_recomputed(self):
+        hot, warm, cold = Product.objects.order_by('id')[:3]
+        Product.objects.filter(pk=cold.pk).update(popularity_score=0.4)
+        tracker = popularity.PopularityTracker()
+        tracker.record({hot.id: 1}, 'view')  # the first event flushes at once
+        tracker.record({hot.id: 2, warm.id: 1}, 'purchase')
+        tracker.record({warm.id: 1}, 'cart')
+        self.assertEqual(tracker.pending, {hot.id: 10.0, warm.id: 8.0})
+        tracker.flush()
+        self.assertEqual(tracker.pending, {})
+        self.assertAlmostEqual(hot.popularity.score, 11.0, places=3)
+
+        # One half-life later: warm is 8 / 2 + 1, hot (not written since) 11 / 2
+        now = time.time() + 3600
+        popularity.apply_events({warm.id: 1.0}, now=now)
+        warm.popularity.refresh_from_db()
+        self.assertAlmostEqual(warm.popularity.score, 5.0, places=3)
+        updated, pruned = popularity.refresh_scores(now=now)
+
+        scores = dict(Product.objects.values_list('id', 'popularity_score'))
+        self.assertEqual((updated, pruned), (2, 0))
+        # Products nobody has viewed yet keep their catalog score
+        self.assertEqual((scores[hot.id], scores[cold.id]), (1.0, 0.4))
+        self.assertGreater(scores[warm.id], 0.9)
+        self.assertEqual(popularity.refresh_scores(now=now), (0, 0))
+        # Long faded counters are dropped
+        self.assertEqual(popularity.refresh_scores(now=now + 3600 * 20), (0, 2))
+
+
+class GenerateDatasetTests(TestCase):
+    databases = {'default', 'interactions'}
+    end = datetime.datetime(2026, 1, 31, tzinfo=datetime.timezone.utc)
+
+    def generate(self, prefix, seed=7):
+        call_command(
+            'generate_dataset', products=200, users=20, interactions=2000, categories=4, chunk_size=500,
+            days=30, end=self.end.isoformat(), seed=seed, prefix=prefix, stdout=StringIO(),
+        )
+        users = dict(User.objects.filter(username__startswith=f'{prefix}_').values_list('id', 'username'))
+        products = dict(Product.objects.filter(category__name__startswith=f'{prefix} ')
+                        .values_list('id', 'name'))
+        return [
+            (users[user_id][len(prefix):], products[product_id], interaction_type, timestamp)
+            for user_id, product_id, interaction_type, timestamp in UserInteraction.objects
+            .filter(user_id__in=users).order_by('id')
+            .values_list('user_id', 'product_id', 'interaction_type', 'timestamp')
+        ]
+
+    def test_same_seed_same_dataset(self):
+        first = self.generate('one')
+        self.assertEqual(self.generate('two'), first)
+        self.assertNotEqual(self.generate('three', seed=8), first)
+
+    def test_counts_and_distributions(self):
+        interactions = self.generate('synth')
+        self.assertEqual(len(interactions), 2000)
+        self.assertEqual(Product.objects.filter(category__name__startswith='synth ').count(), 200)
+        self.assertEqual(User.objects.filter(username__startswith='synth_').count(), 20)
+        self.assertEqual(Category.objects.filter(name__startswith='synth ').count(), 4)
+
+        types = [interaction_type for _, _, interaction_type, _ in interactions]
+        self.assertAlmostEqual(types.count('view') / len(types), 0.78, delta=0.05)
+        self.assertAlmostEqual(types.count('purchase') / len(types), 0.05, delta=0.02)
+        # Power-law popularity: the busiest tenth of the catalog gets most of the traffic
+        per_product = sorted(np.unique([name for _, name, _, _ in interactions], return_counts=True)[1])
+        self.assertGreater(sum(per_product[-20:]) / len(interactions), 0.5)
+
+        # Spread over the period, in id order, not all stamped with the insert time
+        timestamps = [timestamp for _, _, _, timestamp in interactions]
+        self.assertGreaterEqual(min(timestamps), self.end - datetime.timedelta(days=30))
+        self.assertLessEqual(max(timestamps), self.end)
+        self.assertGreater(max(timestamps) - min(timestamps), datetime.timedelta(days=25))
+        self.assertEqual(timestamps[:500], sorted(timestamps[:500]))
+        # Sessions: a user's next event mostly follows within minutes
+        last_seen, gaps = {}, []
+        for user, _, _, timestamp in interactions:
+            if user in last_seen:
+                gaps.append(timestamp - last_seen[user])
+            last_seen[user] = timestamp
+        short = sum(gap < datetime.timedelta(minutes=10) for gap in gaps)
+        self.assertGreater(short / len(gaps), 0.5)
+
+
+class EvaluationTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_dataset', products=300, users=30, interactions=3000,
+            categories=5, stdout=StringIO(),
+        )
+
+    def test_report_scores_every_strategy(self):
+        report = evaluation.evaluate(list(evaluation.STRATEGIES), k=5)
+
+        self.assertGreater(report['meta']['users'], 0)
+        self.assertEqual(set(report['strategies']), set(evaluation.STRATEGIES))
+        for result in report['strategies'].values():
+            for metric in ['precision@5', 'recall@5', 'ndcg@5', 'coverage']:
+                self.assertGreaterEqual(result[metric], 0.0)
+                self.assertLessEqual(result[metric], 1.0)
+        json.dumps(report)
+
+    def test_event_log_loads_interactions_and_order_lines_in_chunks(self):
+        user = User.objects.first()
+        order = Order.objects.create(user=user, total_amount=1)
+        product = Product.objects.first()
+        OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        chunk_size, evaluation.LOAD_CHUNK_SIZE = evaluation.LOAD_CHUNK_SIZE, 7  # several partial chunks
+        self.addCleanup(setattr, evaluation, 'LOAD_CHUNK_SIZE', chunk_size)
+
+        log = evaluation.EventLog.load()
+        self.assertEqual(len(log.times), UserInteraction.objects.count() + 1)
+        self.assertTrue(np.all(np.diff(log.times) >= 0))
+        purchase = np.flatnonzero(log.times == order.created_at.timestamp())
+        self.assertEqual((log.users[purchase[-1]], log.products[purchase[-1]], log.types[purchase[-1]]),
+                         (user.id, product.id, evaluation.TYPE_CODES['purchase']))
+        views = UserInteraction.objects.filter(interaction_type='view').count()
+        self.assertEqual(int((log.types == evaluation.TYPE_CODES['view']).sum()), views)
+
+
+class CatalogImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    def write_feed(self, directory, name, rows):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write('sku,name,description,category,price,stock\n')
+            f.writelines(','.join(row) + '\n' for row in rows)
+        return path
+
+    def test_upserts_by_sku_and_round_trips(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(RECOMMENDATION_ARTIFACT_DIR=directory):
+            feed = self.write_feed(directory, 'feed.csv', [
+                ['A-1', 'Trail Tent', 'two person tent', 'Outdoor', '199.90', '4'],
+                ['A-2', 'Camp Stove', 'gas stove', 'Outdoor', '49.00', ''],
+                ['A-3', 'Broken', '', 'Outdoor', 'free', '1'],
+            ])
+            errors = StringIO()
+            call_command('import_catalog', feed, chunk_size=1, stdout=StringIO(), stderr=errors)
+            self.assertIn('line 4: price is not a number', errors.getvalue())
+            self.assertEqual(feature_pipeline.current_generation(directory), 1)
+            outdoor = Product.objects.get(sku='A-1').category
+            self.assertEqual(outdoor.products.count(), 2)
+
+            # Columns the feed leaves out or empty, and popularity, keep their values
+            Product.objects.filter(sku='A-1').update(rating=4.5, popularity_score=0.9)
+            update = self.write_feed(directory, 'update.csv', [
+                ['A-1', 'Trail Tent', '', 'Outdoor', '219.90', '2'],
+            ])
+            call_command('import_catalog', update, skip_rebuild=True, stdout=StringIO())
+            tent = Product.objects.get(sku='A-1')
+            self.assertEqual((str(tent.price), tent.stock, tent.category_id), ('219.90', 2, outdoor.id))
+            self.assertEqual((tent.description, tent.rating, tent.popularity_score),
+                             ('two person tent', 4.5, 0.9))
+            self.assertEqual(Product.objects.filter(category__name='Outdoor').count(), 2)
+
+            # The seeded catalog has no SKUs: the export lists them as SHOP-<id> without writing,
+            # and importing the file gives the products those SKUs
+            export = os.path.join(directory, 'catalog.jsonl')
+            with CaptureQueriesContext(connection) as queries:
+                call_command('export_catalog', export, chunk_size=2, stdout=StringIO())
+            self.assertEqual([query for query in queries if not query['sql'].startswith('SELECT')], [])
+            with open(export) as f:
+                exported = [json.loads(line) for line in f]
+            self.assertEqual(len(exported), Product.objects.count())
+            unnamed = Product.objects.filter(sku__isnull=True).order_by('id').first()
+            self.assertIn({'sku': f'SHOP-{unnamed.id}', 'name': unnamed.name}, [
+                {'sku': row['sku'], 'name': row['name']} for row in exported
+            ])
+            self.assertEqual(exported[-1], {
+                'sku': 'A-2', 'name': 'Camp Stove', 'description': 'gas stove', 'category': 'Outdoor',
+                'price': '49.00', 'stock': 0, 'popularity_score': 0.5, 'rating': 3.0,
+            })
+            errors = StringIO()
+            call_command('import_catalog', export, chunk_size=3, max_errors=0, stdout=StringIO(), stderr=errors)
+            self.assertEqual(errors.getvalue(), '')
+            self.assertEqual(Product.objects.get(id=unnamed.id).sku, f'SHOP-{unnamed.id}')
+            self.assertFalse(Product.objects.filter(sku__isnull=True).exists())
+            again = os.path.join(directory, 'again.jsonl')
+            call_command('export_catalog', again, stdout=StringIO())
+            with open(again) as f:
+                self.assertEqual([json.loads(line) for line in f], exported)
+
+    def test_stopped_import_still_rebuilds(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(RECOMMENDATION_ARTIFACT_DIR=directory):
+            feed = self.write_feed(directory, 'feed.csv', [
+                ['B-1', 'Rain Jacket', '', 'Outdoor', '89.00', '3'],
+                ['B-2', 'Broken', '', 'Outdoor', '', '1'],
+                ['B-3', 'Broken', '', '', '1.00', '1'],
+            ])
+            with self.assertRaisesMessage(CommandError, '1 rows were already upserted'):
+                call_command('import_catalog', feed, chunk_size=1, max_errors=1,
+                             stdout=StringIO(), stderr=StringIO())
+            self.assertTrue(Product.objects.filter(sku='B-1').exists())
+            self.assertEqual(feature_pipeline.current_generation(directory), 1)
+
+
+class SalesAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+        cls.staff = User.objects.create_user('finance', password='finance-pass-123', is_staff=True)
+        cls.shopper = User.objects.create_user('shopper', password='shopper-pass-123')
+        cls.a = Product.objects.order_by('id').first()
+        cls.b = Product.objects.filter(category=cls.a.category).exclude(id=cls.a.id).first()
+        cls.yesterday = timezone.now() - datetime.timedelta(days=1)
+        for basket, when in [([(cls.a, 2), (cls.b, 1)], cls.yesterday), ([(cls.a, 1)], cls.yesterday),
+                             ([(cls.b, 3)], None)]:
+            cls.order(basket, when)
+
+    @classmethod
+    def order(cls, basket, when=None):
+        order = Order.objects.create(user=cls.shopper, total_amount=sum(p.price * q for p, q in basket))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantity, price=product.price)
+            for product, quantity in basket
+        ])
+        if when:
+            Order.objects.filter(id=order.id).update(created_at=when)
+        return order
+
+    def test_rollups_are_incremental(self):
+        self.assertEqual(analytics.update_rollups(chunk_size=1), 2)  # today's order is too recent
+        self.assertEqual(analytics.update_rollups(chunk_size=1, lag=0), 1)
+        self.assertEqual(analytics.update_rollups(lag=0), 0)
+        day = self.yesterday.date()
+        a = DailyProductSales.objects.get(date=day, product=self.a)
+        self.assertEqual((a.orders, a.units, a.revenue), (2, 3, self.a.price * 3))
+        # The first order has both products but counts once for their category
+        category = DailyCategorySales.objects.get(date=day, category=self.a.category_id)
+        self.assertEqual((category.orders, category.units), (2, 4))
+
+        self.order([(self.a, 1)])
+        self.assertEqual(analytics.update_rollups(lag=0), 1)
+        today = DailyProductSales.objects.get(date=timezone.localdate(), product=self.a)
+        self.assertEqual((today.orders, today.units), (1, 1))
+        snapshot = sorted(DailyProductSales.objects.values_list('date', 'product_id', 'orders', 'units', 'revenue'))
+        call_command('update_sales_rollups', rebuild=True, lag=0, stdout=StringIO())
+        self.assertEqual(
+            sorted(DailyProductSales.objects.values_list('date', 'product_id', 'orders', 'units', 'revenue')),
+            snapshot,
+        )
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_staff_report_and_streamed_export(self):
+        analytics.update_rollups(lag=0)
+        url = reverse('sales_report')
+        self.client.force_login(self.shopper)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.assertEqual(self.client.get(reverse('export_orders')).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['totals']['units'], 7)
+        self.assertEqual(response.context['products'][0]['units'], 4)
+        self.assertEqual(self.client.get(url, {'start': 'yesterday'}).status_code, 400)
+
+        with self.assertNumQueries(6):  # session, user, period bounds, then 2 queries per chunk
+            response = self.client.get(reverse('export_orders'))
+            self.assertTrue(response.streaming)
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), analytics.EXPORT_FIELDS)
+        self.assertEqual(len(lines), 1 + OrderItem.objects.count())
+        self.assertEqual(list(analytics.export_rows(chunk_size=1)), list(analytics.export_rows()))
+        today = timezone.localdate()
+        self.assertEqual(len(list(analytics.export_rows(today, today))), 1)
+
+    def test_export_neutralizes_formulas(self):
+        Product.objects.filter(pk=self.b.pk).update(name='=HYPERLINK("http://evil.example","x")')
+        User.objects.filter(pk=self.shopper.pk).update(username='@shopper')
+        row = list(analytics.export_rows(timezone.localdate(), timezone.localdate()))[0]
+        fields = dict(zip(analytics.EXPORT_FIELDS, row))
+        self.assertEqual(fields['product'], '\'=HYPERLINK("http://evil.example","x")')
+        self.assertEqual(fields['customer'], "'@shopper")
+
+
+class ImageDerivativeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('populate_db', stdout=StringIO())
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name, SHOP_IMAGE_WORKERS=0)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def upload(self, product, name, size=(1200, 900)):
+        buffer = BytesIO()
+        PILImage.new('RGB', size, 'teal').save(buffer, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image.save(name, ContentFile(buffer.getvalue()))
+
+    def test_uploads_are_resized_and_served_as_derivatives(self):
+        product = Product.objects.first()
+        self.upload(product, 'tent.jpg')
+        product.refresh_from_db()
+
+        self.assertEqual(product.image_derived_from, product.image.name)
+        with default_storage.open(images.derivative_name(product.image.name, 'card', 'webp')) as f:
+            self.assertEqual(PILImage.open(f).size, images.IMAGE_SIZES['card'])
+        html = Template("{% load shop_tags %}{% product_picture product 'card' %}").render(
+            Context({'product': product}))
+        self.assertIn('/derived/card/tent.jpg.webp" type="image/webp"', html)
+        self.assertIn('/derived/card/tent.jpg.jpg"', html)
+
+    def test_image_urls_follow_the_product(self):
+        product = Product.objects.first()
+        # Without an upload: a stock photo picked by the first keyword rule the name matches
+        product.name = 'Laptop Stand'
+        self.assertEqual(images.product_image_url(product, 'thumb'),
+                         images.UNSPLASH_URL.format(photo='1496181133206-80ce9b88a853',
+                                                    width=100, height=100, format='jpg'))
+        product.name = 'Mystery Box'
+        self.assertIn(f'photo-{images.DEFAULT_PHOTO}?w=250&h=200&fit=crop&fm=webp',
+                      images.product_image_url(product, 'card', 'webp'))
+
+        # Uploaded: the original until its derivatives exist, then the resized copy
+        buffer = BytesIO()
+        PILImage.new('RGB', (800, 600), 'teal').save(buffer, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=False):
+            product.image.save('box.jpg', ContentFile(buffer.getvalue()))
+        self.assertEqual(images.product_image_url(product, 'large'), product.image.url)
+        rendered = Template("{% load shop_tags %}{{ product|image_url:'large' }}").render(
+            Context({'product': product}))
+        self.assertEqual(rendered, product.image.url)
+        images.process_upload(product.id, product.image.name)
+        product.refresh_from_db()
+        self.assertEqual(images.product_image_url(product, 'large'),
+                         default_storage.url(images.derivative_name(product.image.name, 'large', 'jpeg')))
+
+    def test_backfill_covers_images_without_derivatives(self):
+        first, second = Product.objects.order_by('id')[:2]
+        self.upload(first, 'a.jpg')
+        self.upload(second, 'b.jpg', size=(300, 1000))
+        Product.objects.filter(pk=second.pk).update(image_derived_from='')
+
+        out = StringIO()
+        call_command('build_image_derivatives', workers=1, stdout=out)
+        self.assertIn('Generated derivatives for 1 images', out.getvalue())
+        second.refresh_from_db()
+        self.assertTrue(images.has_derivatives(second))
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])  # the test runner turns DEBUG off
+class LoadTestTests(TestCase):
+    databases = {'default', 'interactions'}
+
+    def setUp(self):
+        call_command('populate_db', stdout=StringIO())
+
+    def test_sessions_are_recorded_per_endpoint(self):
+        # One virtual user in this thread: the test transaction is not visible to others
+        user, = loadtest.prepare_users(1, 'loadtest-pass-123')
+        products, weights, categories = loadtest.catalog_sample()
+        recorder = loadtest.Recorder()
+        rng = random.Random(0)
+        for _ in range(5):
+            loadtest.run_session(loadtest.InProcessSession(user), recorder, rng,
+                                 products, weights, categories, think_time=0)
+        report = loadtest.summarize([recorder], elapsed=1.0, users=1)
+
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['endpoints']['home']['requests'], 5)
+        self.assertIn('product_detail', report['endpoints'])
+        self.assertEqual(report['requests'], sum(e['requests'] for e in report['endpoints'].values()))
+        json.dumps(report)
+
+
+class QueryBudgetMixin:
+    """Maximum SQL queries and a rough wall-clock budget for every shop URL.
+
+    The same budgets are checked against a tiny and a medium catalog, so a
+    view whose query count grows with catalog or cart size fails here.
+    """
+    time_budget = 0.5  # seconds, the same for both catalogs: no view renders the whole catalog
+    databases = {'default', 'interactions'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.build_catalog()
+        cls.user = User.objects.create_user('budget', password='budget-pass-123')
+        products = list(Product.objects.order_by('id')[:cls.cart_size + 1])
+        cls.product = products[0]
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=2) for product in products[1:]
+        ])
+        cls.cart_item = cart.items.first()
+        UserInteraction.objects.bulk_create([
+            UserInteraction(user=cls.user, product=product, interaction_type='view')
+            for product in products
+        ])
+        cls.order = Order.objects.create(user=cls.user, total_amount=100)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=cls.order, product=product, quantity=2, price=product.price) for product in products[1:]
+        ])
+        analytics.update_rollups(lag=0)
+        cls.staff = User.objects.create_user('budget-staff', password='budget-pass-123', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        # Fitting the feature pipeline is a one-off per process, not per request
+        feature_pipeline.get_pipeline()
+        # and so is the neighbour index, built in the background
+        neighbours.get_index(wait=True)
+        # and popularity counters are written once per flush interval
+        # and the slow-request log is the time budget, asserted below
+        per_test = override_settings(SHOP_POPULARITY_FLUSH_SECONDS=math.inf,
+                                     SHOP_SLOW_REQUEST_MS=self.time_budget * 1000)
+        per_test.enable()
+        self.addCleanup(per_test.disable)
+        self.client.force_login(self.user)
+
+    def assertWithinBudget(self, max_queries, method, url, data=None, anonymous=False, max_interaction_queries=0):
+        """Budget the default and the interactions database separately"""
+        if anonymous:
+            self.client.logout()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries, \
+                CaptureQueriesContext(connections['interactions']) as interaction_queries, \
+                self.assertNoLogs('shop.performance', 'WARNING'):
+            response = getattr(self.client, method)(url, data or {})
+            if response.streaming:
+                # A streamed body runs its queries while it is read
+                b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+        self.assertLess(response.status_code, 400)
+        for captured, budget, alias in [(queries, max_queries, 'default'),
+                                        (interaction_queries, max_interaction_queries, 'interactions')]:
+            self.assertLessEqual(
+                len(captured), budget,
+                f'{method.upper()} {url} ran {len(captured)} {alias} queries (budget {budget}):\n'
+                + '\n'.join(q['sql'] for q in captured.captured_queries),
+            )
+        self.assertLess(elapsed, self.time_budget, f'{method.upper()} {url} took {elapsed:.2f}s')
+        return response
+
+    def test_home_anonymous(self):
+        self.assertWithinBudget(1, 'get', reverse('home'), anonymous=True)
+
+    def test_home(self):
+        self.assertWithinBudget(6, 'get', reverse('home'), max_interaction_queries=1)
+
+    def test_product_list(self):
+        self.assertWithinBudget(2, 'get', reverse('product_list'), anonymous=True)
+
+    def test_product_list_deep_page(self):
+        ids = Product.objects.order_by('id').values_list('id', flat=True)
+        after = ids[len(ids) // 2]
+        self.assertWithinBudget(2, 'get', reverse('product_list') + f'?after={after}', anonymous=True)
+
+    def test_product_list_filtered(self):
+        url = reverse('product_list') + f'?category={self.product.category_id}&search=a'
+        self.assertWithinBudget(4, 'get', url)
+
+    def test_product_detail(self):
+        self.assertWithinBudget(6, 'get', reverse('product_detail', args=[self.product.id]),
+                                max_interaction_queries=1)
+
+    def test_add_to_cart(self):
+        self.assertWithinBudget(9, 'get', reverse('add_to_cart', args=[self.product.id]),
+                                max_interaction_queries=1)
+
+    def test_cart(self):
+        self.assertWithinBudget(8, 'get', reverse('cart'))
+
+    def test_update_cart(self):
+        url = reverse('update_cart', args=[self.cart_item.id])
+        self.assertWithinBudget(5, 'post', url, {'action': 'increase'})
+
+    def test_checkout(self):
+        self.assertWithinBudget(5, 'get', reverse('checkout'))
+
+    def test_checkout_post(self):
+        self.assertWithinBudget(12, 'post', reverse('checkout'))
+
+    def test_order_success(self):
+        self.assertWithinBudget(3, 'get', reverse('order_success', args=[self.order.id]))
+
+    def test_product_feedback(self):
+        url = reverse('product_feedback', args=[self.product.id])
+        self.assertWithinBudget(4, 'post', url, {'feedback': 'like'}, max_interaction_queries=1)
+
+    def test_register(self):
+        self.assertWithinBudget(0, 'get', reverse('register'), anonymous=True)
+
+    def test_login(self):
+        self.assertWithinBudget(0, 'get', reverse('login'), anonymous=True)
+
+    def test_logout(self):
+        self.assertWithinBudget(4, 'get', reverse('logout'))
+
+    def test_metrics(self):
+        self.assertWithinBudget(0, 'get', reverse('metrics'), anonymous=True)
+
+    def test_sales_report(self):
+        self.client.force_login(self.staff)
+        self.assertWithinBudget(6, 'get', reverse('sales_report'))
+
+    def test_export_orders(self):
+        self.client.force_login(self.staff)
+        self.assertWithinBudget(6, 'get', reverse('export_orders'))
+
+
+class TinyCatalogQueryBudgetTests(QueryBudgetMixin, TestCase):
+    cart_size = 3
+
+    @classmethod
+    def build_catalog(cls):
+        call_command('populate_db', stdout=StringIO())
+
+
+class MediumCatalogQueryBudgetTests(QueryBudgetMixin, TestCase):
+    cart_size = 25
+
+    @classmethod
+    def build_catalog(cls):
+        call_command(
+            'generate_dataset', products=2000, users=20, interactions=2000,
+            categories=10, chunk_size=1000, stdout=StringIO(),
+        )
+
+
+def tearDownModule():
+    # Events recorded by test requests must not be flushed into the real database at exit
+    popularity.tracker.pending.clear()
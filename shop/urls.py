@@ -15,4 +15,7 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
+    path('reports/sales/', views.sales_report, name='sales_report'),
+    path('reports/orders.csv', views.export_orders, name='export_orders'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,14 +1,26 @@
 # shop/views.py
+import csv
+import datetime
+import itertools
+
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Q
 from .models import Product, Cart, CartItem, Order, OrderItem, UserInteraction, Category
-from .recommendation import RecommendationEngine
-from django.http import JsonResponse
+from .cache import cache_anonymous_page
+from .pagination import KeysetPage
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from . import analytics, metrics, popularity
+from .engine import bought_together, recommendation_engine
 
+@cache_anonymous_page
 def home(request):
     """Home page with featured products and recommendations"""
     products = Product.objects.all()[:8]
@@ -16,7 +28,7 @@ def home(request):
     
     recommended_products = []
     if request.user.is_authenticated:
-        engine = RecommendationEngine()
+        engine = recommendation_engine()
         recommended_products = engine.get_recommendations(request.user, num_recommendations=6)
     
     context = {
@@ -26,9 +38,10 @@ def home(request):
     }
     return render(request, 'shop/home.html', context)
 
+@cache_anonymous_page
 def product_list(request):
-    """Display all products with filtering"""
-    products = Product.objects.all()
+    """Display products with filtering, a page at a time"""
+    products = Product.objects.select_related('category')
     categories = Category.objects.all()
     
     # Filter by category
@@ -45,7 +58,7 @@ def product_list(request):
         )
     
     context = {
-        'products': products,
+        'page': KeysetPage(products, request.GET, getattr(settings, 'SHOP_PRODUCTS_PER_PAGE', 24)),
         'categories': categories,
         'selected_category': category_id,
         'search_query': search_query,
@@ -54,9 +67,10 @@ def product_list(request):
 
 def product_detail(request, pk):
     """Product detail page with similar products"""
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(Product.objects.select_related('category'), pk=pk)
     
     # Track product view
+    popularity.record(product.id, 'view')
     if request.user.is_authenticated:
         UserInteraction.objects.create(
             user=request.user,
@@ -65,12 +79,13 @@ def product_detail(request, pk):
         )
     
     # Get similar products
-    engine = RecommendationEngine()
+    engine = recommendation_engine()
     similar_products = engine.get_similar_products(product.id, num_recommendations=4)
     
     context = {
         'product': product,
         'similar_products': similar_products,
+        'bought_together': bought_together([product.id]),
     }
     return render(request, 'shop/product_detail.html', context)
 
@@ -99,6 +114,7 @@ def add_to_cart(request, pk):
         product=product,
         interaction_type='cart'
     )
+    popularity.record(product.id, 'cart')
     
     messages.success(request, f'{product.name} added to cart!')
     return redirect('product_detail', pk=pk)
@@ -107,22 +123,24 @@ def add_to_cart(request, pk):
 def cart_view(request):
     """View cart contents"""
     cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
+    cart_items = cart.items.select_related('product')
     total = cart.get_total()
     
     # Get recommendations based on cart items
-    engine = RecommendationEngine()
-    cart_product_ids = [item.product.id for item in cart_items]
-    recommended_products = engine.get_recommendations(
-        request.user, 
-        num_recommendations=4,
-        exclude_products=cart_product_ids
+    engine = recommendation_engine()
+    quantities = {item.product_id: item.quantity for item in cart_items}
+    cart_product_ids = list(quantities)
+    recommended_products = engine.get_cart_recommendations(
+        quantities,
+        user=request.user,
+        num_recommendations=4
     )
     
     context = {
         'cart_items': cart_items,
         'total': total,
         'recommended_products': recommended_products,
+        'bought_together': bought_together(cart_product_ids) if cart_product_ids else [],
     }
     return render(request, 'shop/cart.html', context)
 
@@ -153,43 +171,54 @@ def update_cart(request, pk):
 def checkout(request):
     """Checkout process"""
     cart = get_object_or_404(Cart, user=request.user)
-    cart_items = cart.items.all()
+    cart_items = cart.items.select_related('product')
     
     if not cart_items:
+        metrics.checkouts.inc(outcome='empty_cart')
         messages.warning(request, 'Your cart is empty!')
         return redirect('cart')
     
     if request.method == 'POST':
-        # Create order
-        total = cart.get_total()
-        order = Order.objects.create(
-            user=request.user,
-            total_amount=total
-        )
-        
-        # Create order items and track purchases
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.price
-            )
-            
-            # Track purchase interaction
-            UserInteraction.objects.create(
+        # Priced from the lines already loaded: a transaction that reads before
+        # its first write cannot wait for SQLite's write lock, it fails at once
+        total = sum(item.product.price * item.quantity for item in cart_items)
+        with transaction.atomic():
+            # Create order
+            order = Order.objects.create(
                 user=request.user,
-                product=item.product,
-                interaction_type='purchase'
+                total_amount=total
             )
             
-            # Update product popularity
-            item.product.popularity_score = min(1.0, item.product.popularity_score + 0.05)
-            item.product.save()
-        
-        # Clear cart
-        cart_items.delete()
+            # Create order items and track purchases in one batch each
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=item.product,
+                    quantity=item.quantity,
+                    price=item.product.price
+                )
+                for item in cart_items
+            ])
+            purchases = [
+                UserInteraction(
+                    user=request.user,
+                    product=item.product,
+                    interaction_type='purchase'
+                )
+                for item in cart_items
+            ]
+            # The interaction log is its own database; a failed write there must not lose the order
+            transaction.on_commit(lambda: UserInteraction.objects.bulk_create(purchases), robust=True)
+            metrics.interaction_writes.inc(len(cart_items), type='purchase')
+            
+            # Counted once the order is committed; popularity_score follows on the next refresh
+            bought = {item.product_id: item.quantity for item in cart_items}
+            transaction.on_commit(lambda: popularity.record_all(bought, 'purchase'))
+            
+            # Clear cart
+            cart.items.all().delete()
         
+        metrics.checkouts.inc(outcome='success')
         messages.success(request, f'Order #{order.id} placed successfully!')
         return redirect('order_success', order_id=order.id)
     
@@ -277,4 +306,48 @@ def logout_view(request):
     """User logout"""
     logout(request)
     messages.success(request, 'Logged out successfully!')
-    return redirect('home')
\ No newline at end of file
+    return redirect('home')
+
+def metrics_view(request):
+    """Prometheus scrape endpoint"""
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def report_period(request, days=30):
+    """(start, end) dates from ?start=&end= (YYYY-MM-DD), by default the last `days` days"""
+    end = request.GET.get('end')
+    end = datetime.date.fromisoformat(end) if end else timezone.localdate()
+    start = request.GET.get('start')
+    start = datetime.date.fromisoformat(start) if start else end - datetime.timedelta(days=days - 1)
+    if start > end:
+        raise ValueError('start is after end')
+    return start, end
+
+@staff_member_required
+def sales_report(request):
+    """Revenue, units and orders by day, category and product, from the daily rollups"""
+    try:
+        start, end = report_period(request)
+    except ValueError as exc:
+        return HttpResponseBadRequest(f'Invalid period: {exc}')
+    context = analytics.sales_report(start, end)
+    context.update({'start': start, 'end': end})
+    return render(request, 'shop/sales_report.html', context)
+
+class Echo:
+    """File-like object whose write() returns the line, for csv.writer in a streaming response"""
+    def write(self, value):
+        return value
+
+@staff_member_required
+def export_orders(request):
+    """CSV of every order line in the period, streamed a chunk of orders at a time"""
+    try:
+        start, end = report_period(request)
+    except ValueError as exc:
+        return HttpResponseBadRequest(f'Invalid period: {exc}')
+    writer = csv.writer(Echo())
+    rows = itertools.chain([analytics.EXPORT_FIELDS], analytics.export_rows(start, end))
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows),
+                                     content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="orders-{start}-{end}.csv"'
+    return response